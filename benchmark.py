@@ -0,0 +1,951 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" benchmark.py
+    Times FormatBlock engines and features against each other.
+"""
+
+import io
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import timeit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from colr import (
+    auto_disable as colr_auto_disable,
+    docopt,
+    Colr as C,
+)
+from fmtblock import (
+    __version__ as fmtblock_version,
+    FormatBlock,
+)
+from fmtblock import (
+    client,
+    core,
+    follow,
+    linebreak,
+    npengine,
+    parallel,
+    tail,
+    widths,
+)
+from fmtblock.incremental import IncrementalFormatter
+from fmtblock.index import LineIndex
+from fmtblock.server import FormatServer
+colr_auto_disable()
+
+APPNAME = 'FormatBlock'
+NAME = '{} Benchmarks'.format(APPNAME)
+VERSION = '0.0.1'
+VERSIONSTR = '{} v. {}'.format(NAME, VERSION)
+SCRIPT = os.path.split(os.path.abspath(sys.argv[0]))[1]
+SCRIPTDIR = os.path.abspath(sys.path[0])
+
+# Default input size, in characters.
+DEFAULT_SIZE = 1000000
+# Default number of runs for each timing (the best run is reported).
+DEFAULT_REPEAT = 3
+# Target output rate for bench_records, in lines per second.
+RECORDS_TARGET = 250000
+
+USAGESTR = """{versionstr}
+    Runs benchmarks for {appname} v. {appversion}.
+
+    Usage:
+        {script} [-h | -l | -v]
+        {script} [NAMES...] [-r num] [-s num]
+
+    Options:
+        NAMES                : Benchmark names to run.
+                               If not given, all benchmarks are run.
+        -h,--help            : Show this help message.
+        -l,--list            : List all benchmark names.
+        -r num,--repeat num  : Number of runs for each timing.
+                               Default: {repeat}
+        -s num,--size num    : Size of the input text, in characters.
+                               Default: {size}
+        -v,--version         : Show version.
+""".format(
+    appname=APPNAME,
+    appversion=fmtblock_version,
+    repeat=DEFAULT_REPEAT,
+    script=SCRIPT,
+    size=DEFAULT_SIZE,
+    versionstr=VERSIONSTR,
+)
+
+
+def main(argd):
+    """ Main entry point, expects doctopt arg dict as argd. """
+    benchmarks = get_benchmarks()
+    if argd['--list']:
+        for name, func in benchmarks.items():
+            print('{}: {}'.format(C(name, 'blue'), func.__doc__.strip()))
+        return 0
+    names = argd['NAMES'] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            raise InvalidArg('unknown benchmark: {}'.format(name))
+    size = parse_int(argd['--size'] or DEFAULT_SIZE)
+    repeat = parse_int(argd['--repeat'] or DEFAULT_REPEAT)
+    for name in names:
+        print(C(': ').join(
+            C(name, 'blue', style='bright'),
+            C(benchmarks[name].__doc__.strip(), 'cyan'),
+        ))
+        benchmarks[name](size=size, repeat=repeat)
+        print()
+    return 0
+
+
+def bench_breaks(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Line offsets with get_breaks(), vs. creating the line strings. """
+    text = make_text(size)
+    linestime = time_func(
+        lambda: list(core.iter_block(text, width=60)),
+        repeat=repeat,
+    )
+    breakstime = time_func(
+        lambda: core.get_breaks(text, width=60),
+        repeat=repeat,
+    )
+    breaks = core.get_breaks(text, width=60)
+    print(C(': ').join(C('lines', 'cyan'), C(len(breaks) // 2, 'blue')))
+    print_result('iter_block()', linestime)
+    print_result('get_breaks()', breakstime, baseline=linestime)
+
+
+def bench_cache(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Per-call latency for the `fmtblock` command, cache hit vs. miss. """
+    calls = 10
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'input.txt')
+    with open(filename, 'w') as f:
+        f.write(make_text(size))
+    env = dict(
+        os.environ,
+        FMTBLOCK_SOCKET=os.path.join(tmpdir, 'fmtblock.sock'),
+    )
+    pkgdir = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        s for s in (pkgdir, env.get('PYTHONPATH', '')) if s
+    )
+
+    def run_cmd(*args):
+        """ Run the `fmtblock` command on the input file. """
+        subprocess.run(
+            [sys.executable, '-m', 'fmtblock.client', '-w', '60', filename]
+            + list(args),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    coldtime = time_func(
+        lambda: [run_cmd() for _ in range(calls)],
+        repeat=repeat,
+    ) / calls
+    cachedir = os.path.join(tmpdir, 'cache')
+    run_cmd('--cache', cachedir)
+    hittime = time_func(
+        lambda: [run_cmd('--cache', cachedir) for _ in range(calls)],
+        repeat=repeat,
+    ) / calls
+    print(C(': ').join(C('input', 'cyan'), C(size, 'blue')))
+    print_result('no cache', coldtime)
+    print_result('cache hit', hittime, baseline=coldtime)
+
+
+def bench_compressed(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Records mode for compressed files, vs. piping through zcat/xzcat.
+    """
+    text = make_text(size)
+    records = '\n'.join(text[i:i + 150] for i in range(0, len(text), 150))
+    data = records.encode('utf-8')
+    tmpdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        FMTBLOCK_SOCKET=os.path.join(tmpdir, 'fmtblock.sock'),
+    )
+    pkgdir = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        s for s in (pkgdir, env.get('PYTHONPATH', '')) if s
+    )
+    cmd = [sys.executable, '-m', 'fmtblock', '--records', '-w', '80']
+
+    def run_direct(filename):
+        """ Run `fmtblock --records` on the compressed file. """
+        return subprocess.run(
+            cmd + [filename],
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+
+    def run_piped(filename, catcmd):
+        """ Run `catcmd file | fmtblock --records`, like a shell would. """
+        cat = subprocess.Popen([catcmd, filename], stdout=subprocess.PIPE)
+        try:
+            output = subprocess.run(
+                cmd,
+                env=env,
+                stdin=cat.stdout,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+        finally:
+            cat.stdout.close()
+            cat.wait()
+        return output
+
+    print(C(': ').join(C('input', 'cyan'), C(len(data), 'blue')))
+    for suffix, modname, catcmd in (
+            ('gz', 'gzip', 'zcat'),
+            ('bz2', 'bz2', 'bzcat'),
+            ('xz', 'lzma', 'xzcat')):
+        filename = os.path.join(tmpdir, 'input.{}'.format(suffix))
+        with open(filename, 'wb') as f:
+            f.write(__import__(modname).compress(data))
+        if shutil.which(catcmd) is None:
+            print_err('  {} is not installed, skipping.'.format(catcmd))
+            continue
+        if run_direct(filename) != run_piped(filename, catcmd):
+            raise ValueError('Output differs for: {}'.format(filename))
+        pipedtime = time_func(
+            lambda: run_piped(filename, catcmd),
+            repeat=repeat,
+        )
+        directtime = time_func(lambda: run_direct(filename), repeat=repeat)
+        print_result('{} | fmtblock'.format(catcmd), pipedtime)
+        print_result(
+            'fmtblock input.{}'.format(suffix),
+            directtime,
+            baseline=pipedtime,
+        )
+        print(C(': ').join(
+            C('MB/sec'.rjust(24), 'cyan'),
+            C('{:.2f}'.format(len(data) / directtime / 1e6), 'blue'),
+        ))
+
+
+def bench_follow(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Latency from appending a line to printing it, with follow mode. """
+    text = make_text(size)
+    records = ''.join(
+        '{}\n'.format(text[i:i + 70])
+        for i in range(0, len(text), 70)
+    )
+    fmtargs = {'width': 80, 'newlines': True}
+    initial = len(IncrementalFormatter(**fmtargs).feed(records))
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'app.log')
+    timer = timeit.default_timer
+    appends = 50 * repeat
+
+    print(C(': ').join(C('file size', 'cyan'), C(len(records), 'blue')))
+    for inotify in (True, False):
+        with open(filename, 'w') as f:
+            f.write(records)
+        outq = queue.Queue()
+        stop = threading.Event()
+
+        def consume():
+            """ Put each output line in the queue, with the time. """
+            for line in follow.iter_follow(
+                    filename,
+                    stop=stop.is_set,
+                    inotify=inotify,
+                    **fmtargs):
+                outq.put((timer(), line))
+
+        start = timer()
+        thread = threading.Thread(target=consume, daemon=True)
+        thread.start()
+        for _ in range(initial):
+            outq.get()
+        inittime = timer() - start
+        latencies = []
+        for i in range(appends):
+            with open(filename, 'a') as f:
+                f.write('appended line {}\n'.format(i))
+                written = timer()
+            printed, line = outq.get()
+            if line != 'appended line {}'.format(i):
+                raise ValueError('Wrong line: {!r}'.format(line))
+            latencies.append(printed - written)
+        stop.set()
+        thread.join()
+        label = 'inotify' if inotify else 'polling'
+        print_result('{} initial'.format(label), inittime)
+        print(C(': ').join(
+            C('{} latency'.format(label).rjust(24), 'cyan'),
+            C('avg {:.6f}s, max {:.6f}s'.format(
+                sum(latencies) / len(latencies),
+                max(latencies),
+            ), 'blue'),
+        ))
+    shutil.rmtree(tmpdir)
+
+
+def bench_incremental(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Feeding 4KB chunks to IncrementalFormatter, vs. formatting it all.
+    """
+    text = make_text(size).replace('a', '\x1b[31ma\x1b[0m', 2000)
+    data = text.encode('utf-8')
+    chunksize = 4096
+    chunktimes = []
+
+    def incremental():
+        formatter = IncrementalFormatter(width=60)
+        lines = []
+        timer = timeit.default_timer
+        for i in range(0, len(data), chunksize):
+            start = timer()
+            lines.extend(formatter.feed(data[i:i + chunksize]))
+            chunktimes.append(timer() - start)
+        lines.extend(formatter.flush())
+        return lines
+
+    if incremental() != list(core.iter_format_block(text, width=60)):
+        raise ValueError('Incremental output differs.')
+    wholetime = time_func(
+        lambda: list(core.iter_format_block(text, width=60)),
+        repeat=repeat,
+    )
+    incrtime = time_func(incremental, repeat=repeat)
+    print_result('whole text', wholetime)
+    print_result('feed() + flush()', incrtime, baseline=wholetime)
+    print(C(': ').join(
+        C('per chunk'.rjust(24), 'cyan'),
+        C('avg {:.6f}s, max {:.6f}s'.format(
+            sum(chunktimes) / len(chunktimes),
+            max(chunktimes),
+        ), 'blue'),
+    ))
+
+
+def bench_lines(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Previewing the first 5 lines, max_lines vs. wrapping everything. """
+    text = make_text(size)
+    fulltime = time_func(
+        lambda: list(core.iter_format_block(text, width=60))[:5],
+        repeat=repeat,
+    )
+    linestime = time_func(
+        lambda: list(core.iter_format_block(text, width=60, max_lines=5)),
+        repeat=repeat,
+    )
+    print_result('all lines', fulltime)
+    print_result('max_lines=5', linestime, baseline=fulltime)
+
+
+def bench_index(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Formatting a window of 40 lines deep in the text, with LineIndex.
+    """
+    text = make_text(size)
+    index = LineIndex(text, width=60)
+    buildtime = time_func(index.build, repeat=1)
+    start = index.lines * 3 // 4
+    fulltime = time_func(
+        lambda: list(core.iter_format_block(text, width=60))[start:start + 40],
+        repeat=repeat,
+    )
+    windowtime = time_func(
+        lambda: index.format_window(start, 40),
+        repeat=repeat,
+    )
+    print(C(': ').join(C('lines', 'cyan'), C(index.lines, 'blue')))
+    print_result('build index', buildtime)
+    print_result('format all', fulltime)
+    print_result('format_window()', windowtime, baseline=fulltime)
+
+
+def bench_measure(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Line count and widths with measure(), vs. format() and counting.
+    """
+    text = make_text(size)
+
+    def count(**options):
+        lines = core.format_block(text, width=60, **options).split('\n')
+        widths = [len(line) for line in lines]
+        return len(lines), max(widths), widths
+
+    for options in ({}, {'fill': True}, {'shrink': True}, {'chars': True}):
+        label = ', '.join(options) or 'space'
+        lines, maxwidth, widths = core.measure(text, width=60, **options)
+        if (lines, maxwidth, list(widths)) != count(**options):
+            raise ValueError('Measurements differ for: {}'.format(label))
+        counttime = time_func(lambda: count(**options), repeat=repeat)
+        measuretime = time_func(
+            lambda: core.measure(text, width=60, **options),
+            repeat=repeat,
+        )
+        print_result('format(), {}'.format(label), counttime)
+        print_result(
+            'measure(), {}'.format(label),
+            measuretime,
+            baseline=counttime,
+        )
+
+
+def bench_newlines(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Newlines mode for many short lines, vs. wrapping each line. """
+    rand = random.Random(0)
+    text = make_text(size)
+    pcs = []
+    start = 0
+    while start < len(text):
+        # Mostly short lines, with some that need wrapping.
+        end = start + rand.choice((5, 10, 20, 30, 40, 80))
+        pcs.append(text[start:end])
+        start = end
+    text = '\n'.join(pcs)
+
+    def per_line():
+        """ Wrap each line separately, with its own engine generator. """
+        return [
+            line
+            for segment in text.split('\n')
+            for line in core.iter_space_block(segment, width=60)
+        ]
+
+    basetime = time_func(per_line, repeat=repeat)
+    newtime = time_func(
+        lambda: list(core.iter_block(text, width=60, newlines=True)),
+        repeat=repeat,
+    )
+    paratime = time_func(
+        lambda: list(core.iter_block(text, width=60, paragraphs=True)),
+        repeat=repeat,
+    )
+    print(C(': ').join(C('lines', 'cyan'), C(len(pcs), 'blue')))
+    print_result('per-line engines', basetime)
+    print_result('newlines', newtime, baseline=basetime)
+    print_result('paragraphs', paratime, baseline=basetime)
+
+
+def bench_numpy(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Pure-python vs. NumPy space wrapping for ASCII text (TIER_ASCII). """
+    if not npengine.HAS_NUMPY:
+        print_err('  NumPy is not installed, skipping.')
+        return None
+    # Double spaces, tabs, and newlines make it TIER_ASCII text, the only
+    # tier that is sent to the NumPy engine (plain text uses str.rfind()).
+    text = make_text(size).replace(' ', '  ', size // 100).replace(
+        ' q', '\tq').replace(' z', '\nz')
+    fmt = FormatBlock(text)
+    # Keep the dispatcher from using the NumPy engine.
+    minlength = npengine.MIN_LENGTH
+    npengine.MIN_LENGTH = len(text) + 1
+    try:
+        pytime = time_func(
+            lambda: list(fmt.iter_space_block()),
+            repeat=repeat,
+        )
+    finally:
+        npengine.MIN_LENGTH = minlength
+    nptime = time_func(
+        lambda: list(npengine.iter_space_block(text)),
+        repeat=repeat,
+    )
+    print_result('python', pytime)
+    print_result('numpy', nptime, baseline=pytime)
+
+
+def bench_overlong(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Policies for one word as long as the text, vs. one long line. """
+    import tracemalloc
+    blob = 'x' * size
+    text = 'some words {} more words'.format(blob)
+    results = []
+    for overlong in (None, 'split', 'truncate'):
+        seconds = time_func(
+            lambda: sum(1 for _ in core.iter_block(
+                text,
+                width=60,
+                overlong=overlong,
+            )),
+            repeat=repeat,
+        )
+        tracemalloc.start()
+        for _ in core.iter_block(text, width=60, overlong=overlong):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((overlong or 'keep', seconds, peak))
+    keeptime = results[0][1]
+    for i, (name, seconds, peak) in enumerate(results):
+        print_result(name, seconds, baseline=keeptime if i else None)
+        print(C(': ').join(
+            C('peak KB'.rjust(24), 'cyan'),
+            C('{:.0f}'.format(peak / 1024), 'blue'),
+        ))
+
+
+def bench_parallel(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Speculative parallel wrapping of one paragraph, by worker count. """
+    text = make_text(size * 10)
+    cpus = os.cpu_count() or 1
+    print(C(': ').join(C('input', 'cyan'), C(len(text), 'blue')))
+    print(C(': ').join(C('cpus', 'cyan'), C(cpus, 'blue')))
+    for label, text in (
+            ('plain', text),
+            # Spread out, so that every shard has escape codes.
+            ('codes', text.replace(' q', ' \x1b[31mq\x1b[0m'))):
+        expected = list(core.iter_space_block(text, width=60))
+        serialtime = time_func(
+            lambda: list(core.iter_space_block(text, width=60)),
+            repeat=repeat,
+        )
+        print_result('{} serial'.format(label), serialtime)
+        jobs = 2
+        while True:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                lines = list(parallel.iter_space_block(
+                    text,
+                    width=60,
+                    jobs=jobs,
+                    executor=executor,
+                ))
+                if lines != expected:
+                    raise ValueError('Parallel output differs.')
+                paralleltime = time_func(
+                    lambda: list(parallel.iter_space_block(
+                        text,
+                        width=60,
+                        jobs=jobs,
+                        executor=executor,
+                    )),
+                    repeat=repeat,
+                )
+            print_result(
+                '{} {} workers'.format(label, jobs),
+                paralleltime,
+                baseline=serialtime,
+            )
+            if jobs >= cpus:
+                break
+            jobs = min(jobs * 2, cpus)
+
+
+def bench_records(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Records mode for log records, vs. one FormatBlock call per record.
+    """
+    rand = random.Random(0)
+    text = make_text(size)
+    pcs = []
+    start = 0
+    while start < len(text):
+        # Log-like records, a few of them long enough to wrap.
+        end = start + rand.choice((40, 60, 80, 120, 200))
+        pcs.append(text[start:end])
+        start = end
+    records = '\n'.join(pcs)
+    options = {'width': 100, 'prepend': '> ', 'append': ' |'}
+
+    def per_record():
+        return [
+            FormatBlock(record).format(**options)
+            for record in records.split('\n')
+        ]
+
+    def stream():
+        return list(core.iter_format_stream(
+            io.StringIO(records),
+            continuation='  ',
+            **options
+        ))
+
+    lines = sum(s.count('\n') + 1 for s in stream())
+    basetime = time_func(per_record, repeat=repeat)
+    streamtime = time_func(stream, repeat=repeat)
+    linerate = lines / streamtime
+    print(C(': ').join(C('records', 'cyan'), C(len(pcs), 'blue')))
+    print_result('FormatBlock per record', basetime)
+    print_result('iter_format_stream()', streamtime, baseline=basetime)
+    print(C(': ').join(
+        C('lines/sec', 'cyan'),
+        C('{:,.0f}'.format(linerate), 'blue', style='bright'),
+        C('target: {:,}'.format(RECORDS_TARGET), 'green' if (
+            linerate >= RECORDS_TARGET) else 'red'),
+    ))
+
+
+def bench_server(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Per-call latency for 1KB inputs, server vs. cold start. """
+    text = make_text(1024)
+    calls = 20
+    socketpath = os.path.join(tempfile.mkdtemp(), 'fmtblock.sock')
+    env = dict(os.environ, FMTBLOCK_SOCKET=socketpath)
+    pkgdir = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        s for s in (pkgdir, env.get('PYTHONPATH', '')) if s
+    )
+
+    def run_cmd(module):
+        """ Run `python -m module` on the text, like a shell script would.
+        """
+        subprocess.run(
+            [sys.executable, '-m', module, '-w', '60', text],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    coldtime = time_func(
+        lambda: [run_cmd('fmtblock') for _ in range(calls)],
+        repeat=repeat,
+    ) / calls
+    with FormatServer(socketpath) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            clienttime = time_func(
+                lambda: [run_cmd('fmtblock.client') for _ in range(calls)],
+                repeat=repeat,
+            ) / calls
+            apitime = time_func(
+                lambda: [
+                    client.format_text(text, socketpath=socketpath)
+                    for _ in range(calls)
+                ],
+                repeat=repeat,
+            ) / calls
+        finally:
+            server.shutdown()
+    print_result('cold start', coldtime)
+    print_result('client command', clienttime, baseline=coldtime)
+    print_result('client.format_text()', apitime, baseline=coldtime)
+
+
+def bench_tail(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ The last 20 lines with tail_lines(), vs. formatting everything. """
+    text = make_text(size)
+    records = ''.join(
+        '{}\n'.format(text[i:i + 150])
+        for i in range(0, len(text), 150)
+    )
+    # A very long last line is formatted from its start.
+    longtext = ''.join((records, text))
+    fmtargs = {'width': 80}
+    for label, data in (
+            ('short lines', records.encode('utf-8')),
+            ('long last line', longtext.encode('utf-8'))):
+        expected = list(core.iter_format_block(
+            data.decode('utf-8'),
+            newlines=True,
+            **fmtargs
+        ))[-20:]
+        with io.BytesIO(data) as f:
+            if tail.tail_lines(f, 20, **fmtargs) != expected:
+                raise ValueError('Tail lines differ: {}'.format(label))
+            fulltime = time_func(
+                lambda: list(core.iter_format_block(
+                    data.decode('utf-8'),
+                    newlines=True,
+                    **fmtargs
+                ))[-20:],
+                repeat=repeat,
+            )
+            tailtime = time_func(
+                lambda: tail.tail_lines(f, 20, **fmtargs),
+                repeat=repeat,
+            )
+        print_result('{} (all)'.format(label), fulltime)
+        print_result(
+            '{} (tail)'.format(label),
+            tailtime,
+            baseline=fulltime,
+        )
+
+
+def bench_threads(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Thread scaling for the stateless core (best on no-GIL builds). """
+    # Small chunks, so the NumPy engine isn't used.
+    chunksize = 16384
+    chunks = [
+        make_text(chunksize, seed=i)
+        for i in range(max(size // chunksize, 1))
+    ]
+    gilcheck = getattr(sys, '_is_gil_enabled', None)
+    gil = 'enabled' if (gilcheck is None or gilcheck()) else 'disabled'
+    print(C(': ').join(C('GIL', 'cyan'), C(gil, 'blue', style='bright')))
+
+    def format_chunk(chunk):
+        return core.format_block(chunk, width=60, fill=True, prepend='> ')
+
+    def run_threads(threads):
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(format_chunk, chunks))
+
+    expected = run_threads(1)
+    basetime = None
+    threads = 1
+    while threads <= max(os.cpu_count() or 1, 4):
+        if run_threads(threads) != expected:
+            raise ValueError('Output differs with {} threads.'.format(threads))
+        seconds = time_func(lambda: run_threads(threads), repeat=repeat)
+        print_result(
+            '{} thread(s)'.format(threads),
+            seconds,
+            baseline=basetime,
+        )
+        basetime = basetime or seconds
+        threads *= 2
+
+
+def bench_tiers(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Engines picked for each input tier, vs. the generic engines. """
+    text = make_text(size)
+    # Some runs of spaces, so only the first tier is plain.
+    spaced = text.replace(' ', '  ', size // 100)
+    texts = (
+        (core.TIER_PLAIN, text),
+        (core.TIER_ASCII, spaced),
+        (core.TIER_TEXT, spaced.replace('e', '\xe9')),
+        (core.TIER_WIDE, spaced.replace('e', '\u6f22')),
+        (core.TIER_CODES, spaced.replace('a', '\x1b[31ma\x1b[0m', 5000)),
+    )
+    modes = (
+        ('space', core.iter_space_lines, core.iter_space_spans),
+        ('shrink', core.iter_shrink_lines, core.iter_shrink_spans),
+    )
+    for tier, tiertext in texts:
+        if core.get_tier(tiertext) != tier:
+            raise ValueError('Text is not in the {} tier.'.format(tier))
+        for mode, linesfunc, spansfunc in modes:
+
+            def run_lines(forcetier=None):
+                spans = spansfunc(tiertext, width=60, tier=forcetier)
+                return list(linesfunc(tiertext, width=60, spans=spans))
+
+            if run_lines() != run_lines(core.TIER_CODES):
+                raise ValueError('Output differs for the {} tier.'.format(
+                    tier,
+                ))
+            generictime = time_func(
+                lambda: run_lines(core.TIER_CODES),
+                repeat=repeat,
+            )
+            tiertime = time_func(run_lines, repeat=repeat)
+            print_result('{} {}, generic'.format(tier, mode), generictime)
+            print_result(
+                '{} {}, tiered'.format(tier, mode),
+                tiertime,
+                baseline=generictime,
+            )
+
+
+def bench_tokens(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Several calls on one FormatBlock (cached tokens), vs. core calls.
+    """
+    # Colored text, so the word-by-word engines are used.
+    text = make_text(size).replace('a', '\x1b[31ma\x1b[0m', size // 100)
+
+    def run_calls(fmtblock=None):
+        if fmtblock is None:
+            return [
+                core.format_block(text, width=40),
+                core.format_block(text, width=60),
+                core.format_block(text, width=60, shrink=True),
+                core.get_breaks(text, width=72),
+            ]
+        return [
+            fmtblock.format(width=40),
+            fmtblock.format(width=60),
+            fmtblock.format(width=60, shrink=True),
+            fmtblock.get_breaks(width=72),
+        ]
+
+    fmtblock = FormatBlock(text)
+    if run_calls(fmtblock) != run_calls():
+        raise ValueError('Output differs with cached tokens.')
+    coretime = time_func(run_calls, repeat=repeat)
+    firsttime = time_func(lambda: run_calls(FormatBlock(text)), repeat=repeat)
+    cachedtime = time_func(lambda: run_calls(fmtblock), repeat=repeat)
+    print(C(': ').join(
+        C('tokens', 'cyan'),
+        C('{} bytes'.format(fmtblock.get_tokens_size()), 'blue'),
+    ))
+    print_result('core functions', coretime)
+    print_result('new FormatBlock', firsttime, baseline=coretime)
+    print_result('cached tokens', cachedtime, baseline=coretime)
+
+
+def bench_uax14(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ UAX #14 line break opportunities, vs. breaking on whitespace. """
+    text = make_text(size)
+    texts = (
+        ('ascii', text),
+        ('hyphens', text.replace('e', '-').replace('a', '/')),
+        ('cjk', text.replace(' ', '。').replace('e', '漢')),
+    )
+    for name, tiertext in texts:
+        spacetime = time_func(
+            lambda: core.format_block(tiertext, width=60),
+            repeat=repeat,
+        )
+        breakstime = time_func(
+            lambda: list(linebreak.iter_breaks(tiertext)),
+            repeat=repeat,
+        )
+        uax14time = time_func(
+            lambda: core.format_block(tiertext, width=60, uax14=True),
+            repeat=repeat,
+        )
+        print_result('{} spaces'.format(name), spacetime)
+        print_result(
+            '{} opportunities only'.format(name),
+            breakstime,
+            baseline=spacetime,
+        )
+        print_result(
+            '{} uax14'.format(name),
+            uax14time,
+            baseline=spacetime,
+        )
+
+
+def bench_widths(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT):
+    """ Display widths from the range table, vs. unicodedata lookups. """
+    import unicodedata
+    text = make_text(size)
+    texts = (
+        ('ascii', text),
+        ('latin-1', text.replace('e', '\xe9')),
+        ('wide', text.replace('e', '\u6f22').replace('a', '\U0001f600')),
+    )
+
+    def lookup_width(word):
+        # The usual way, one unicodedata call (or two) per character.
+        return sum(
+            0 if unicodedata.combining(c) else (
+                2 if unicodedata.east_asian_width(c) in 'WF' else 1
+            )
+            for c in word
+        )
+
+    for name, tiertext in texts:
+        words = tiertext.split()
+        if list(map(widths.get_width, words)) != list(
+                map(lookup_width, words)):
+            raise ValueError('Widths differ for {} text.'.format(name))
+        lookuptime = time_func(
+            lambda: list(map(lookup_width, words)),
+            repeat=repeat,
+        )
+        tabletime = time_func(
+            lambda: list(map(widths.get_width, words)),
+            repeat=repeat,
+        )
+        print_result('{} words, unicodedata'.format(name), lookuptime)
+        print_result(
+            '{} words, table'.format(name),
+            tabletime,
+            baseline=lookuptime,
+        )
+    for mode, kwargs in (('space', {}), ('chars', {'chars': True})):
+        texttime = time_func(
+            lambda: core.format_block(texts[1][1], width=60, **kwargs),
+            repeat=repeat,
+        )
+        widetime = time_func(
+            lambda: core.format_block(texts[2][1], width=60, **kwargs),
+            repeat=repeat,
+        )
+        print_result('latin-1 {}'.format(mode), texttime)
+        print_result('wide {}'.format(mode), widetime, baseline=texttime)
+
+
+def get_benchmarks():
+    """ Return a dict of {name: function} for all bench_ functions. """
+    return {
+        name[6:]: func
+        for name, func in sorted(globals().items())
+        if name.startswith('bench_') and callable(func)
+    }
+
+
+def make_text(size=DEFAULT_SIZE, seed=0, words=None):
+    """ Build plain text of random lowercase words, about `size` chars long.
+    """
+    rand = random.Random(seed)
+    words = words or [
+        ''.join(
+            chr(rand.randint(97, 122))
+            for _ in range(rand.randint(1, 12))
+        )
+        for _ in range(1000)
+    ]
+    pcs = []
+    length = 0
+    while length < size:
+        word = rand.choice(words)
+        pcs.append(word)
+        length += len(word) + 1
+    return ' '.join(pcs)[:size]
+
+
+def parse_int(s):
+    """ Parse a string as an integer, or raise InvalidArg. """
+    try:
+        val = int(s)
+    except ValueError:
+        raise InvalidArg('invalid integer: {}'.format(s))
+    return val
+
+
+def print_err(*args, **kwargs):
+    """ A wrapper for print() that uses stderr by default. """
+    if kwargs.get('file', None) is None:
+        kwargs['file'] = sys.stderr
+    print(*args, **kwargs)
+
+
+def print_result(label, seconds, baseline=None):
+    """ Print a timing, with the speedup against `baseline` if given. """
+    pcs = [
+        C(label.rjust(24), 'cyan'),
+        C('{:>10.4f}s'.format(seconds), 'blue', style='bright'),
+    ]
+    if baseline:
+        pcs.append(C('{:>8.2f}x'.format(baseline / seconds), 'green'))
+    print(C(' ').join(pcs))
+
+
+def time_func(func, repeat=DEFAULT_REPEAT):
+    """ Return the best time, in seconds, for calling `func` once. """
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+class InvalidArg(ValueError):
+    """ Raised when the user has used an invalid argument. """
+    def __init__(self, msg=None):
+        self.msg = msg or ''
+
+    def __str__(self):
+        if self.msg:
+            return 'Invalid argument, {}'.format(self.msg)
+        return 'Invalid argument!'
+
+
+if __name__ == '__main__':
+    try:
+        mainret = main(docopt(USAGESTR, version=VERSIONSTR, script=SCRIPT))
+    except InvalidArg as ex:
+        print_err(ex)
+        mainret = 1
+    except (EOFError, KeyboardInterrupt):
+        print_err('\nUser cancelled.\n')
+        mainret = 2
+    except BrokenPipeError:
+        print_err('\nBroken pipe, input/output was interrupted.\n')
+        mainret = 3
+    sys.exit(mainret)
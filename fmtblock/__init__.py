@@ -1,6 +1,18 @@
-from .formatters import __version__, FormatBlock
+__version__ = '0.4.1'
 
 __all__ = [
     '__version__',
     'FormatBlock',
 ]
+
+
+def __getattr__(name):
+    """ Import FormatBlock the first time it's used, so the `fmtblock`
+        command's client and cache don't load the formatters.
+    """
+    if name == 'FormatBlock':
+        from .formatters import FormatBlock
+        return FormatBlock
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name)
+    )
@@ -8,8 +8,12 @@
 
 import inspect
 import os
+import signal
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import suppress
+from itertools import repeat
 
 from colr import (
     auto_disable as colr_auto_disable,
@@ -17,10 +21,10 @@ from colr import (
     docopt
 )
 
-from .formatters import (
-    __version__,
-    FormatBlock,
-)
+from . import __version__
+from .compressed import open_binary, open_file, open_stdin
+from .core import OVERLONG_POLICIES, iter_format_stream
+from .pipeline import Pipeline
 
 colr_auto_disable()
 
@@ -39,23 +43,66 @@ USAGESTR = """{versionstr}
 
     Usage:
         {script} -h | -v
-        {script} [WORDS...] [-D] [-w num]
-                 [-c | -f] [-e] ([-i num] | [-I num]) [-l] [-n]
+        {script} [WORDS...] [--cache dir] [-D] [-w num]
+                 [-c | -f | -k] [-e] ([-i num] | [-I num]) [-l] [-n | -r] [-u]
+                 ([-s] [-p txt | -P txt]) ([-S] [-a txt | -A txt])
+                 [--lines num [--marker txt]] [--overlong how]
+                 [--profile [--stacks file]]
+        {script} --serve [--socket path] [-D]
+        {script} --follow FILE [-D] [-w num]
+                 [-c | -f | -k] ([-i num] | [-I num]) [-l] [-n | -r] [-u]
+                 ([-s] [-p txt | -P txt]) ([-S] [-a txt | -A txt])
+                 [--lines num [--marker txt]] [--overlong how]
+                 [--profile [--stacks file]]
+        {script} --tail num [FILE] [-D] [-w num]
+                 [-c | -f | -k] ([-i num] | [-I num]) [-l] [-u]
+                 ([-s] [-p txt | -P txt]) ([-S] [-a txt | -A txt])
+                 [--overlong how] [--profile [--stacks file]]
+        {script} --records [FILES...] [-z] [-C txt] [-D] [-w num]
+                 [-c | -f | -k] ([-i num] | [-I num]) [-l] [-n | -r] [-u]
                  ([-s] [-p txt | -P txt]) ([-S] [-a txt | -A txt])
+                 [--lines num [--marker txt]] [--overlong how]
+                 [--profile [--stacks file]]
+        {script} -m FILES... [-j num] [-o dir | -W] [-D] [-w num]
+                 [-c | -f | -k] [-e] ([-i num] | [-I num]) [-l] [-n | -r] [-u]
+                 ([-s] [-p txt | -P txt]) ([-S] [-a txt | -A txt])
+                 [--lines num [--marker txt]] [--overlong how]
+                 [--profile [--stacks file]]
 
     Options:
         WORDS                 : Words to format into a block.
                                 File names can be passed to read from a file.
                                 If not given, stdin is used instead.
+        FILE                  : File name to follow, with --follow, or to
+                                print the end of, with --tail.
+        FILES                 : File names to format separately, with -m,
+                                or to read records from, with --records.
+                                Files (and stdin) compressed with gzip,
+                                bzip2, or xz are decompressed as they are
+                                read.
         -a txt,--append txt   : Append this text before each line, after any
                                 indents.
         -A txt,--APPEND txt   : Same as --append, except the appended text
                                 is not included when calculating the width.
+        --cache dir           : Cache output in this directory, keyed by
+                                the input and options, for the `fmtblock`
+                                command.
+                                Default: $FMTBLOCK_CACHE, if set.
         -c,--chars            : Wrap on characters instead of spaces.
+        -C txt,--continuation txt
+                              : Prepend this text before every line after
+                                the first one in each record, with
+                                --records, instead of --prepend. It is not
+                                included when calculating the width.
         -D,--debug            : Show some debugging info.
         -e,--enumerate        : Print line numbers before each line.
         -f,--fill             : Insert spaces between words so that each line
                                 is the same width.
+        --follow              : Format FILE, and keep formatting the text
+                                that is appended to it, like `tail -f`,
+                                until interrupted. Lines are printed as
+                                soon as they are final. Use -n to print
+                                each line as soon as it ends.
         -h,--help             : Show this help message.
         -i num,--indent num   : Indention level, where 4 spaces is 1 indent.
                                 Maximum width includes any indention.
@@ -63,18 +110,73 @@ USAGESTR = """{versionstr}
         -I num,--INDENT num   : Same as --indent, except the indention is not
                                 included when calculating the width.
                                 Default: 0
+        -j num,--jobs num     : Number of files to read and format at once,
+                                with -m. Output order is always the same as
+                                the FILES order.
+                                Default: 1
+        -k,--shrink           : Shrink-to-fit. Keep runs of spaces between
+                                words (for pre-aligned text), collapsing
+                                them only as needed to fit the width.
         -l,--lstrip           : Remove leading spaces for each line, before
                                 indention.
+        --lines num           : Only print the first `num` lines (of each
+                                record, with --records). Only as much of
+                                the input as needed is formatted.
+        --marker txt          : Print this line after the last one, when
+                                lines were cut off by --lines.
+        -m,--multi            : Format each file separately, instead of
+                                joining them into one block.
         -n,--newlines         : Preserve newlines.
+        -o dir,--outdir dir   : Write each formatted file into this
+                                directory, with -m, instead of printing it.
+        --overlong how        : What to do with words that are wider than
+                                the width: `split` them into lines, or
+                                `truncate` them, ending the line with
+                                "...". Without it, they get a line of
+                                their own.
         -p txt,--prepend txt  : Prepend this text before each line, after any
                                 indents.
         -P txt,--PREPEND txt  : Same as --prepend, except the prepended text
                                 is not included when calculating the width.
+        --profile             : Run the job under cProfile and tracemalloc,
+                                and print a report of the hottest functions,
+                                and the time and memory used by each
+                                formatting stage, to stderr. Worker
+                                processes (-j) are not profiled.
+        --records             : Format each line of the input separately,
+                                like log records, without reading all of
+                                the input first. Files are read in order,
+                                or stdin when no FILES are given.
+        -r,--reflow           : Reflow paragraphs, keeping the blank lines
+                                between them.
         -s,--stripfirst       : Strip first --prepend.
         -S,--striplast        : Strip last --append.
+        --serve               : Run a formatting server on a Unix socket.
+                                When the server is running, the `fmtblock`
+                                command sends its work there, instead of
+                                starting up a new formatter each time.
+        --socket path         : Socket file for --serve.
+                                Default: $FMTBLOCK_SOCKET, or a file in
+                                $XDG_RUNTIME_DIR or the temp directory.
+        --stacks file         : Write call stacks sampled with --profile to
+                                this file, in the "collapsed" format that
+                                flame graph tools read.
+        --tail num            : Only print the last `num` lines of FILE (or
+                                stdin). Each line is formatted separately,
+                                like -n, so only the end of the file is
+                                read.
+        -u,--uax14            : Also break inside of words where Unicode
+                                line breaking (UAX #14) allows it, like
+                                after hyphens and slashes, or between
+                                CJK characters. Ignored with -c or -k.
         -v,--version          : Show version.
         -w num,--width num    : Maximum width for the block.
                                 Default: {defaultwidth}
+        -z,--null             : Records are separated by NUL characters
+                                instead of newlines, with --records. Each
+                                formatted record ends with a NUL too.
+        -W,--write            : Write each formatted file back to itself,
+                                with -m, instead of printing it.
 """.format(
     script=SCRIPT,
     versionstr=VERSIONSTR,
@@ -83,60 +185,17 @@ USAGESTR = """{versionstr}
 DEBUG = False
 
 
-def main():
-    """ Main entry point, expects doctopt arg dict as argd. """
+def main(argv=None):
+    """ Main entry point, parses `argv` (or sys.argv) with docopt. """
     global DEBUG
-    argd = docopt(USAGESTR, version=VERSIONSTR, script=SCRIPT)
+    argd = docopt(USAGESTR, argv=argv, version=VERSIONSTR, script=SCRIPT)
     DEBUG = argd['--debug']
 
-    width = parse_int(argd['--width'] or DEFAULT_WIDTH) or 1
-    indent = parse_int(argd['--indent'] or (argd['--INDENT'] or 0))
-    prepend = ' ' * (indent * 4)
-    if prepend and argd['--indent']:
-        # Smart indent, change max width based on indention.
-        width -= len(prepend)
-
-    userprepend = argd['--prepend'] or (argd['--PREPEND'] or '')
-    prepend = ''.join((prepend, userprepend))
-    if argd['--prepend']:
-        # Smart indent, change max width based on prepended text.
-        width -= len(userprepend)
-    userappend = argd['--append'] or (argd['--APPEND'] or '')
-    if argd['--append']:
-        width -= len(userappend)
-
-    if argd['WORDS']:
-        # Try each argument as a file name.
-        argd['WORDS'] = (
-            (try_read_file(w) if len(w) < 256 else w)
-            for w in argd['WORDS']
-        )
-        words = ' '.join((w for w in argd['WORDS'] if w))
-    else:
-        # No text/filenames provided, use stdin for input.
-        words = read_stdin()
-
-    block = FormatBlock(words).iter_format_block(
-        chars=argd['--chars'],
-        fill=argd['--fill'],
-        prepend=prepend,
-        strip_first=argd['--stripfirst'],
-        append=userappend,
-        strip_last=argd['--striplast'],
-        width=width,
-        newlines=argd['--newlines'],
-        lstrip=argd['--lstrip'],
-    )
-
-    for i, line in enumerate(block):
-        if argd['--enumerate']:
-            # Current line number format supports up to 999 lines before
-            # messing up. Who would format 1000 lines like this anyway?
-            print('{: >3}: {}'.format(i + 1, line))
-        else:
-            print(line)
-
-    return 0
+    if argd['--serve']:
+        return serve(socketpath=argd['--socket'])
+    if argd['--profile']:
+        return run_profiled(argd, stacksfile=argd['--stacks'])
+    return run(argd)
 
 
 def debug(*args, **kwargs):
@@ -177,6 +236,206 @@ def debug(*args, **kwargs):
     print_err(*pargs, **kwargs)
 
 
+def follow_file(filename, fmtargs):
+    """ Format a file, and the text that is appended to it, for --follow.
+        Runs until interrupted, and then prints the last line.
+        Returns an exit status code.
+    """
+    from .follow import get_libc, iter_follow
+    from .incremental import IncrementalFormatter
+    formatter = IncrementalFormatter(**fmtargs)
+    debug('Following: {} ({})'.format(
+        filename,
+        'inotify' if get_libc() else 'polling',
+    ))
+    try:
+        for line in iter_follow(filename, formatter=formatter):
+            print(line, flush=True)
+    except EnvironmentError as ex:
+        print_err('\nFailed to read file: {}\n  {}'.format(filename, ex))
+        return 1
+    except KeyboardInterrupt:
+        for line in formatter.flush():
+            print(line)
+    return 0
+
+
+def format_file(filename, fmtargs, enumerate_lines=False, outfile=None):
+    """ Read and format a single file, for --multi.
+        If `outfile` is set, the formatted text is written there.
+        Returns a tuple of (formatted_text, error_message), where
+        `formatted_text` is None if `outfile` was written or an error
+        occurred.
+    """
+    try:
+        with open_file(filename) as f:
+            text = f.read()
+    except EnvironmentError as ex:
+        return None, 'Failed to read file: {}\n  {}'.format(filename, ex)
+    output = '\n'.join(
+        iter_output_lines(text, fmtargs, enumerate_lines=enumerate_lines)
+    )
+    if outfile is None:
+        return output, None
+    try:
+        write_file(outfile, ''.join((output, '\n')))
+    except EnvironmentError as ex:
+        return None, 'Failed to write file: {}\n  {}'.format(outfile, ex)
+    return None, None
+
+
+def format_files(
+        filenames, fmtargs,
+        enumerate_lines=False, jobs=1, outdir=None, inplace=False):
+    """ Format several files separately, for --multi.
+        Files are read and formatted with `jobs` worker processes, but the
+        output is always printed in the same order as `filenames`.
+        Errors are printed as they come up, without stopping the batch.
+        Returns an exit status code, 1 if any file failed.
+    """
+    if inplace:
+        outfiles = list(filenames)
+    elif outdir:
+        outfiles = [get_outdir_path(outdir, s) for s in filenames]
+    else:
+        outfiles = [None] * len(filenames)
+    args = (
+        filenames,
+        repeat(fmtargs),
+        repeat(enumerate_lines),
+        outfiles,
+    )
+    errs = 0
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(format_file, *args)
+            errs = print_file_results(results)
+    else:
+        errs = print_file_results(map(format_file, *args))
+    debug('Formatted files: {}, Errors: {}'.format(len(filenames), errs))
+    return 1 if errs else 0
+
+
+def format_records(filenames, fmtargs, continuation=None, delimiter='\n'):
+    """ Format each record from files (or stdin) separately, for --records.
+        Records are read and printed one at a time, so memory use doesn't
+        grow with the input (compressed input is decompressed as it's
+        read, see compressed.py). Each formatted record ends with `delimiter`.
+        Returns an exit status code, 1 if any file failed.
+    """
+    errs = 0
+    write = sys.stdout.write
+    for filename in filenames or [None]:
+        try:
+            if filename is None:
+                stream = open_stdin()
+            else:
+                stream = open_file(filename)
+            with stream:
+                for block in iter_format_stream(
+                        stream,
+                        delimiter=delimiter,
+                        continuation=continuation,
+                        **fmtargs):
+                    write(block)
+                    write(delimiter)
+        except EnvironmentError as ex:
+            print_err('\nFailed to read file: {}\n  {}'.format(
+                filename or '<stdin>',
+                ex,
+            ))
+            errs += 1
+    return 1 if errs else 0
+
+
+def get_fmtargs(argd):
+    """ Build keyword arguments for FormatBlock.iter_format_block() from
+        a docopt arg dict.
+    """
+    width = parse_int(argd['--width'] or DEFAULT_WIDTH) or 1
+    indent = parse_int(argd['--indent'] or (argd['--INDENT'] or 0))
+    prepend = ' ' * (indent * 4)
+    if prepend and argd['--indent']:
+        # Smart indent, change max width based on indention.
+        width -= len(prepend)
+
+    userprepend = argd['--prepend'] or (argd['--PREPEND'] or '')
+    prepend = ''.join((prepend, userprepend))
+    if argd['--prepend']:
+        # Smart indent, change max width based on prepended text.
+        width -= len(userprepend)
+    userappend = argd['--append'] or (argd['--APPEND'] or '')
+    if argd['--append']:
+        width -= len(userappend)
+
+    return {
+        'chars': argd['--chars'],
+        'fill': argd['--fill'],
+        'prepend': prepend,
+        'strip_first': argd['--stripfirst'],
+        'append': userappend,
+        'strip_last': argd['--striplast'],
+        'width': width,
+        'newlines': argd['--newlines'],
+        'lstrip': argd['--lstrip'],
+        'shrink': argd['--shrink'],
+        'uax14': argd['--uax14'],
+        'paragraphs': argd['--reflow'],
+        'max_lines': (
+            None if argd['--lines'] is None
+            else max(parse_int(argd['--lines']), 0)
+        ),
+        'marker': argd['--marker'],
+        'overlong': parse_overlong(argd['--overlong']),
+    }
+
+
+def get_outdir_path(outdir, filename):
+    """ Get the output file path for `filename` inside `outdir`.
+        Relative paths are kept under `outdir`, absolute paths only keep
+        their base name.
+    """
+    if os.path.isabs(filename):
+        return os.path.join(outdir, os.path.basename(filename))
+    # Don't let '../' escape the output directory.
+    parts = os.path.normpath(filename).split(os.sep)
+    while parts and (parts[0] == os.pardir):
+        parts.pop(0)
+    return os.path.join(outdir, *parts)
+
+
+def iter_output_lines(text, fmtargs, enumerate_lines=False):
+    """ Format `text` like FormatBlock.iter_format_block(), using keyword
+        arguments from `fmtargs`. Returns an iterator of output lines, with
+        line numbers if `enumerate_lines` is truthy.
+    """
+    return Pipeline.preset_format_block(
+        enumerate_lines=enumerate_lines,
+        **fmtargs
+    ).iter_lines(text)
+
+
+def join_words(words, cwd=None, errors=None):
+    """ Join WORDS arguments into one string of text.
+        Each argument is tried as a file name (relative to `cwd` if given),
+        and the file's content is used instead when it exists.
+        Read errors are appended to `errors` if it is a list, otherwise
+        they are printed.
+    """
+    pcs = []
+    for w in words:
+        if len(w) < 256:
+            w, errmsg = read_file_arg(w, cwd=cwd)
+            if errmsg:
+                if errors is None:
+                    print_err('\n{}'.format(errmsg))
+                else:
+                    errors.append(errmsg)
+        if w:
+            pcs.append(w)
+    return ' '.join(pcs)
+
+
 def parse_int(s):
     """ Parse a string as an integer.
         Exit with a message on failure.
@@ -189,6 +448,19 @@ def parse_int(s):
     return val
 
 
+def parse_overlong(s):
+    """ Parse an --overlong policy, which may be None.
+        Exit with a message on failure.
+    """
+    if (s is None) or (s in OVERLONG_POLICIES):
+        return s
+    print_err('\nInvalid --overlong policy: {} (expected {})'.format(
+        s,
+        ' or '.join(OVERLONG_POLICIES),
+    ))
+    sys.exit(1)
+
+
 def print_err(*args, **kwargs):
     """ Print to stderr by default. """
     if kwargs.get('file', None) is None:
@@ -196,28 +468,179 @@ def print_err(*args, **kwargs):
     print(*args, **kwargs)
 
 
+def print_file_results(results):
+    """ Print results from format_file(), in order.
+        Returns the number of errors.
+    """
+    errs = 0
+    for output, errmsg in results:
+        if errmsg:
+            errs += 1
+            print_err('\n{}'.format(errmsg))
+        elif output:
+            print(output)
+    return errs
+
+
 def read_stdin():
     """ Read from stdin, but print a helpful message if it's a tty. """
     if sys.stdin.isatty() and sys.stdout.isatty():
         print('\nReading from stdin until end of file (Ctrl + D)...\n')
-    return sys.stdin.read()
+    return open_stdin().read()
 
 
-def try_read_file(s):
+def read_file_arg(s, cwd=None):
     """ If `s` is a file name, read the file and return it's content.
         Otherwise, return the original string.
-        Returns None if the file was opened, but errored during reading.
+        Relative file names are relative to `cwd`, when given.
+        Returns a tuple of (content, error_message), where content is None
+        if the file was opened, but errored during reading.
     """
+    filename = os.path.join(cwd, s) if cwd else s
     try:
-        with open(s, 'r') as f:
+        with open_file(filename) as f:
             data = f.read()
     except FileNotFoundError:
         # Not a file name.
-        return s
+        return s, None
     except EnvironmentError as ex:
-        print_err('\nFailed to read file: {}\n  {}'.format(s, ex))
-        return None
-    return data
+        return None, 'Failed to read file: {}\n  {}'.format(s, ex)
+    return data, None
+
+
+def run(argd):
+    """ Run the formatting job for a docopt arg dict.
+        Returns an exit status code.
+    """
+    fmtargs = get_fmtargs(argd)
+    if argd['--follow']:
+        return follow_file(argd['FILE'], fmtargs)
+    if argd['--tail'] is not None:
+        return tail_file(
+            argd['FILE'],
+            fmtargs,
+            max(parse_int(argd['--tail']), 0),
+        )
+    if argd['--records']:
+        return format_records(
+            argd['FILES'],
+            fmtargs,
+            continuation=argd['--continuation'],
+            delimiter='\0' if argd['--null'] else '\n',
+        )
+    if argd['--multi']:
+        return format_files(
+            argd['FILES'],
+            fmtargs,
+            enumerate_lines=argd['--enumerate'],
+            jobs=parse_int(argd['--jobs'] or 1),
+            outdir=argd['--outdir'],
+            inplace=argd['--write'],
+        )
+
+    if argd['WORDS']:
+        words = join_words(argd['WORDS'])
+    else:
+        # No text/filenames provided, use stdin for input.
+        words = read_stdin()
+
+    for line in iter_output_lines(
+            words,
+            fmtargs,
+            enumerate_lines=argd['--enumerate']):
+        print(line)
+
+    return 0
+
+
+def run_profiled(argd, stacksfile=None):
+    """ Run the formatting job for a docopt arg dict under the profiler,
+        for --profile, and print its report to stderr.
+        Sampled call stacks are written to `stacksfile`, if set.
+        Returns an exit status code.
+    """
+    from .profiler import Profiler
+    with Profiler() as profiler:
+        ret = run(argd)
+    print_err('\n{}'.format(profiler.format_report()))
+    if stacksfile:
+        try:
+            profiler.write_stacks(stacksfile)
+        except EnvironmentError as ex:
+            print_err('\nFailed to write file: {}\n  {}'.format(
+                stacksfile,
+                ex,
+            ))
+            return 1
+        debug('Wrote call stacks: {}'.format(stacksfile))
+    return ret
+
+
+def serve(socketpath=None):
+    """ Run the formatting server until it is interrupted. """
+    from .server import HAS_UNIX_SOCKETS, FormatServer, get_socket_path
+    if not HAS_UNIX_SOCKETS:
+        print_err('\nUnix sockets are not supported on this platform.')
+        return 1
+    socketpath = socketpath or get_socket_path()
+    # Exit cleanly (removing the socket file) when terminated.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with FormatServer(socketpath) as server:
+        print_err('Serving on: {}'.format(socketpath))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print_err('\nStopping server.')
+    return 0
+
+
+def tail_file(filename, fmtargs, count):
+    """ Print the last `count` formatted lines of a file (or stdin), for
+        --tail. Lines are formatted separately, like --newlines, and only
+        the end of a seekable, uncompressed file is read.
+        Returns an exit status code.
+    """
+    from .tail import tail_lines
+    kwargs = dict(fmtargs)
+    for key in ('max_lines', 'marker', 'newlines', 'paragraphs'):
+        kwargs.pop(key)
+    try:
+        if filename is None:
+            stream = sys.stdin.buffer
+        else:
+            stream = open(filename, 'rb')
+        with stream:
+            lines = tail_lines(open_binary(stream), count, **kwargs)
+    except EnvironmentError as ex:
+        print_err('\nFailed to read file: {}\n  {}'.format(
+            filename or '<stdin>',
+            ex,
+        ))
+        return 1
+    for line in lines:
+        print(line)
+    return 0
+
+
+def write_file(filename, data):
+    """ Write `data` to a file atomically, by writing a temporary file
+        in the same directory and then renaming it.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.fmtblock-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        with suppress(EnvironmentError):
+            # Keep the original file's permissions when overwriting it.
+            os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+        os.replace(tmpname, filename)
+    except BaseException:
+        with suppress(EnvironmentError):
+            os.remove(tmpname)
+        raise
+
 
 if __name__ == '__main__':
     sys.exit(main())
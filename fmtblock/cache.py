@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+""" FormatBlock - Cache
+    A content-addressed, on-disk cache for the `fmtblock` command's output,
+    for build scripts that format the same inputs over and over.
+
+    Entries are keyed by a hash of the input bytes (files or stdin), the
+    command-line options, and the FormatBlock version, so they never have
+    to be invalidated. The cache is pruned to a maximum size, removing the
+    least recently used entries first.
+    Entries are written to a temporary file and renamed into place, so any
+    number of `fmtblock` processes can share a cache directory.
+
+    Like client.py, this module only imports the standard library (and the
+    package's __version__, FormatBlock is imported lazily), so a cache hit
+    doesn't import the formatters or the command-line dependencies.
+"""
+
+import hashlib
+import io
+import os
+import sys
+import tempfile
+from contextlib import (
+    redirect_stderr,
+    redirect_stdout,
+    suppress,
+)
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from . import __version__
+
+# Default maximum size for a cache directory (in bytes).
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Command-line options that can be cached, and whether they take a value.
+# Any other option (--help, --multi, --serve, etc.) is never cached.
+SHORT_OPTS = {
+    'a': True, 'A': True, 'c': False, 'e': False, 'f': False, 'i': True,
+    'I': True, 'k': False, 'l': False, 'n': False, 'p': True, 'P': True,
+    'r': False, 's': False, 'S': False, 'u': False, 'w': True,
+}
+LONG_OPTS = {
+    '--append': True, '--APPEND': True, '--cache': True, '--chars': False,
+    '--enumerate': False, '--fill': False, '--indent': True,
+    '--INDENT': True, '--lines': True, '--lstrip': False,
+    '--marker': True, '--newlines': False, '--overlong': True,
+    '--prepend': True, '--PREPEND': True, '--reflow': False,
+    '--shrink': False, '--stripfirst': False, '--striplast': False,
+    '--uax14': False, '--width': True,
+}
+
+
+def get_cache_size() -> int:
+    """ Return the maximum cache size, from $FMTBLOCK_CACHE_SIZE or the
+        default.
+    """
+    try:
+        return int(os.environ.get('FMTBLOCK_CACHE_SIZE', CACHE_SIZE))
+    except ValueError:
+        return CACHE_SIZE
+
+
+def get_entry_path(cachedir: str, key: str) -> str:
+    """ Return the file path for a cache key. """
+    return os.path.join(cachedir, key[:2], key[2:])
+
+
+def get_key(options: List[str], inputs: List[bytes]) -> str:
+    """ Return the cache key for command-line options and input data. """
+    digest = hashlib.sha256()
+    for pc in [__version__.encode('utf-8')] + [
+            s.encode('utf-8', errors='surrogateescape') for s in options]:
+        digest.update(b'%d:' % len(pc))
+        digest.update(pc)
+    for data in inputs:
+        digest.update(b'%d;' % len(data))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def load(cachedir: str, key: str) -> Optional[bytes]:
+    """ Return the cached output for `key`, or None if it's not cached.
+        The entry is marked as recently used.
+    """
+    filepath = get_entry_path(cachedir, key)
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    with suppress(OSError):
+        # Pruned by another process in the meantime, that's okay.
+        os.utime(filepath)
+    return data
+
+
+def prune(cachedir: str, maxsize: Optional[int] = None) -> int:
+    """ Remove the least recently used entries until the cache is no
+        larger than `maxsize` bytes. Returns the number of bytes removed.
+    """
+    maxsize = get_cache_size() if maxsize is None else maxsize
+    entries = []
+    total = 0
+    with suppress(OSError), os.scandir(cachedir) as subdirs:
+        for subdir in subdirs:
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            with suppress(OSError), os.scandir(subdir.path) as files:
+                for entry in files:
+                    if entry.name.startswith('.'):
+                        # Another process is still writing it.
+                        continue
+                    with suppress(OSError):
+                        st = entry.stat(follow_symlinks=False)
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                        total += st.st_size
+    removed = 0
+    if total <= maxsize:
+        return removed
+    entries.sort()
+    for _, size, filepath in entries:
+        if total - removed <= maxsize:
+            break
+        with suppress(FileNotFoundError):
+            os.remove(filepath)
+        removed += size
+    return removed
+
+
+def read_inputs(
+        words: List[str], stdin: Optional[bytes] = None) -> List[bytes]:
+    """ Return the input data for WORDS arguments, reading the ones that
+        are file names, the same way the command-line interface does.
+        `stdin` is used when there are no WORDS.
+        Raises OSError for files that exist, but can't be read.
+    """
+    if not words:
+        return [b'\x00stdin', stdin or b'']
+    inputs = []
+    for word in words:
+        if len(word) < 256:
+            try:
+                with open(word, 'rb') as f:
+                    inputs.extend((b'\x00file', f.read()))
+                continue
+            except FileNotFoundError:
+                pass
+        inputs.extend((
+            b'\x00word',
+            word.encode('utf-8', errors='surrogateescape'),
+        ))
+    return inputs
+
+
+def run_argv(argv: List[str], runfunc: Callable[[List[str]], int]) -> (
+        Optional[int]):
+    """ Run command-line arguments through the cache, when a cache
+        directory is set with --cache or $FMTBLOCK_CACHE.
+        On a hit, the cached output is printed. On a miss, `runfunc(argv)`
+        is called and its output is printed and cached, if it succeeded
+        without errors.
+        Returns an exit status code, or None if the cache is not enabled
+        or these arguments can't be cached.
+    """
+    parsed = split_argv(argv)
+    if parsed is None:
+        return None
+    options, words, cachedir = parsed
+    cachedir = cachedir or os.environ.get('FMTBLOCK_CACHE', None)
+    if not cachedir:
+        return None
+    stdin = None
+    if not words:
+        stdinbuf = getattr(sys.stdin, 'buffer', None)
+        if (stdinbuf is None) or sys.stdin.isatty():
+            return None
+        stdin = stdinbuf.read()
+    try:
+        key = get_key(options, read_inputs(words, stdin=stdin))
+    except OSError:
+        # Let the command-line interface report it.
+        key = None
+    output = None if key is None else load(cachedir, key)
+    if output is not None:
+        sys.stdout.write(output.decode('utf-8'))
+        sys.stdout.flush()
+        return 0
+
+    if stdin is not None:
+        # Stdin was already read for the key.
+        sys.stdin = io.TextIOWrapper(
+            io.BytesIO(stdin),
+            encoding=sys.stdin.encoding,
+            errors=sys.stdin.errors,
+        )
+    outbuf = io.StringIO()
+    errbuf = io.StringIO()
+    try:
+        with redirect_stdout(outbuf), redirect_stderr(errbuf):
+            status = runfunc(argv)
+    finally:
+        # Write the output even when the command exits with sys.exit().
+        output = outbuf.getvalue()
+        errors = errbuf.getvalue()
+        sys.stdout.write(output)
+        sys.stderr.write(errors)
+    if (key is not None) and (not status) and (not errors):
+        with suppress(OSError):
+            store(cachedir, key, output.encode('utf-8'))
+            prune(cachedir)
+    return status
+
+
+def split_argv(
+        argv: List[str]) -> Optional[Tuple[List[str], List[str], str]]:
+    """ Split command-line arguments into (options, words, cachedir).
+        `options` holds everything that affects the output, in order.
+        Returns None if the arguments can't be cached.
+    """
+    options = []
+    words = []
+    cachedir = None
+    args = iter(argv)
+    for arg in args:
+        if arg == '--':
+            words.extend(args)
+            break
+        if (not arg.startswith('-')) or (arg == '-'):
+            words.append(arg)
+            continue
+        if arg.startswith('--'):
+            name, eq, val = arg.partition('=')
+            takesval = LONG_OPTS.get(name, None)
+            if (takesval is None) or (bool(eq) and not takesval):
+                return None
+            if takesval and not eq:
+                val = next(args, None)
+                if val is None:
+                    return None
+            if name == '--cache':
+                cachedir = val
+                continue
+            options.extend((name, val) if takesval else (name,))
+            continue
+        # Short options can be combined, like -fw 40 or -w40.
+        for i, char in enumerate(arg[1:], start=1):
+            takesval = SHORT_OPTS.get(char, None)
+            if takesval is None:
+                return None
+            if not takesval:
+                options.append('-' + char)
+                continue
+            val = arg[i + 1:] or next(args, None)
+            if val is None:
+                return None
+            options.extend(('-' + char, val))
+            break
+    return options, words, cachedir
+
+
+def store(cachedir: str, key: str, data: bytes) -> None:
+    """ Write a cache entry atomically, by writing a temporary file in the
+        same directory and then renaming it.
+    """
+    filepath = get_entry_path(cachedir, key)
+    dirname = os.path.dirname(filepath)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmpname, filepath)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmpname)
+        raise
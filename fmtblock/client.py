@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+""" FormatBlock - Client
+    A thin client for the formatting server (see server.py).
+    The package imports FormatBlock lazily, and this module only imports
+    the standard library and the server's protocol functions, so the
+    `fmtblock` command can hand its work to a running server without
+    importing the command-line dependencies.
+    The server is only used when its socket belongs to this user, in a
+    directory no other user can write to (see server.is_private()).
+"""
+
+import os
+import socket
+import sys
+from typing import (
+    Any,
+    List,
+    Optional,
+)
+
+from . import cache
+from .compressed import open_stdin
+from .server import (
+    get_socket_path,
+    is_private,
+    recv_message,
+    send_message,
+)
+
+
+class ServerError(Exception):
+    """ Raised when the server responds with an error. """
+    pass
+
+
+def connect(socketpath: Optional[str] = None) -> socket.socket:
+    """ Connect to the formatting server. Raises OSError on failure, or if
+        the socket isn't private (see server.is_private()).
+    """
+    socketpath = socketpath or get_socket_path()
+    if not (socketpath and is_private(socketpath)):
+        raise OSError('No private server socket: {}'.format(socketpath))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketpath)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def format_text(
+        text: str, socketpath: Optional[str] = None, **options: Any) -> str:
+    """ Format `text` on the server, with FormatBlock.format() options.
+        Raises OSError if the server is not running, or ServerError if the
+        server could not format the text.
+    """
+    with connect(socketpath) as sock:
+        send_message(sock, {'text': text, 'options': options})
+        response = recv_message(sock)
+    if 'error' in response:
+        raise ServerError(response['error'])
+    return response['output']
+
+
+def main() -> int:
+    """ Entry point for the `fmtblock` command.
+        Output is served from the cache when it's enabled (see cache.py).
+        Otherwise, the arguments are sent to the server when it's running,
+        or the normal command-line interface is used.
+    """
+    argv = sys.argv[1:]
+    status = cache.run_argv(argv, run_command)
+    if status is None:
+        return run_command(argv)
+    return status
+
+
+def run_command(argv: List[str]) -> int:
+    """ Run command-line arguments on the server when it's running,
+        otherwise use the normal command-line interface.
+    """
+    status = run_argv(argv)
+    if status is None:
+        from .__main__ import main as cli_main
+        return cli_main(argv=argv)
+    return status
+
+
+def run_argv(
+        argv: List[str], socketpath: Optional[str] = None) -> Optional[int]:
+    """ Run command-line arguments on the server, printing the output.
+        Returns an exit status code, or None if the server is not running
+        (or its socket isn't private), or can't handle these arguments.
+    """
+    socketpath = socketpath or get_socket_path()
+    if not (socketpath and is_private(socketpath)):
+        return None
+    readstdin = False
+    try:
+        with connect(socketpath) as sock:
+            send_message(sock, {'argv': argv, 'cwd': os.getcwd()})
+            response = recv_message(sock)
+            if response.get('stdin', False):
+                if sys.stdin.isatty() and sys.stdout.isatty():
+                    print(
+                        '\nReading from stdin until end of file',
+                        '(Ctrl + D)...\n',
+                    )
+                readstdin = True
+                send_message(sock, {'stdin': open_stdin().read()})
+                response = recv_message(sock)
+    except (EOFError, OSError, ValueError) as ex:
+        if not readstdin:
+            return None
+        response = {'error': str(ex)}
+    if response.get('fallback', False) and not readstdin:
+        return None
+    if 'error' in response:
+        print('\nServer error: {}'.format(response['error']), file=sys.stderr)
+        return 1
+    for errmsg in response.get('errors', None) or []:
+        print('\n{}'.format(errmsg), file=sys.stderr)
+    if 'output' in response:
+        print(response['output'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1523 @@
+#!/usr/bin/env python3
+""" FormatBlock - Core
+    Stateless formatting functions. FormatBlock delegates to these.
+
+    Thread safety:
+        Every function here only works on its arguments and local state.
+        The only shared state is compiled regular expressions (which are
+        safe to share) and lookup tables that are built once and never
+        modified afterwards. So these functions, and Pipelines built from
+        their stages, can be called from many threads at once without
+        locking. This includes free-threaded (no-GIL) builds of CPython.
+        A FormatBlock instance can be shared between threads too, as long
+        as its `text` attribute isn't reassigned while another thread is
+        formatting with it.
+"""
+
+import re
+from array import array
+from heapq import merge
+from itertools import chain, islice
+
+from . import npengine, pipeline
+from .escapecodes import (
+    codegrabpat,
+    get_codes,
+    get_indices,
+    strip_codes,
+)
+from .widths import (
+    ZWJ,
+    char_width,
+    get_width,
+    specialpat,
+)
+
+# Used to find gaps between words, to fix the ones that aren't all spaces.
+_gapspat = re.compile(r'\s+')
+# Used to find words, and the whitespace before them, for shrink mode.
+_gapwordpat = re.compile(r'(\s*)(\S+)')
+# Used to find runs of spaces that can be squeezed.
+_spacespat = re.compile(r' {2,}')
+# Used to find words for space wrapping.
+_wordpat = re.compile(r'\S+')
+
+# Input tiers, from get_tier(). Each one has its own engines.
+# Plain text, see is_plain().
+TIER_PLAIN = 'plain'
+# ASCII text without escape codes.
+TIER_ASCII = 'ascii'
+# Unicode text where every character is one column wide, without escape
+# codes.
+TIER_TEXT = 'text'
+# Unicode text with wide or zero width characters, but no escape codes.
+# Words are measured by their display width (see fmtblock.widths).
+TIER_WIDE = 'wide'
+# Text with escape codes.
+TIER_CODES = 'codes'
+
+# Policies for words that are wider than the line (`overlong`). By default
+# they are kept whole, on a line of their own.
+# Split the word into lines of `width` columns.
+OVERLONG_SPLIT = 'split'
+# Cut the word off, and end the line with TRUNCATED.
+OVERLONG_TRUNCATE = 'truncate'
+OVERLONG_POLICIES = (OVERLONG_SPLIT, OVERLONG_TRUNCATE)
+TRUNCATED = '...'
+
+
+def _fix_gap(match):
+    """ Replace a gap between words with a single space, unless it is only
+        spaces. Used with _gapspat.sub() for shrink mode.
+    """
+    gap = match.group()
+    return gap if gap.strip(' ') == '' else ' '
+
+
+def _iter_code_offsets(offsets, codes):
+    """ Map `offsets` in text with its escape codes removed back to offsets
+        in the text, where `codes` are the code offsets from
+        get_code_spans(). An offset with codes at it stays before them.
+    """
+    removed = 0
+    i = 0
+    count = len(codes)
+    for offset in offsets:
+        while (i < count) and (codes[i] - removed < offset):
+            removed += codes[i + 1] - codes[i]
+            i += 2
+        yield offset + removed
+
+
+def expand_words(line, width=60, linewidth=None):
+    """ Insert spaces between words until it is wide enough for `width`.
+        If the visible width of `line` is already known, it can be passed
+        as `linewidth` to save measuring it again.
+    """
+    if not line.strip():
+        return line
+    if linewidth is None:
+        linewidth = get_width(strip_codes(line))
+    # Word index, which word to insert on (cycles between 1->len(words))
+    wordi = 1
+    while linewidth < width:
+        # Every pass inserts exactly one space.
+        linewidth += 1
+        wordendi = find_word_end(line, wordi)
+        if wordendi < 0:
+            # Reached the end?, try starting at the front again.
+            wordi = 1
+            wordendi = find_word_end(line, wordi)
+        if wordendi < 0:
+            # There are no spaces to expand, just prepend one.
+            line = ''.join((' ', line))
+        else:
+            line = ' '.join((line[:wordendi], line[wordendi:]))
+            wordi += 1
+
+    # Don't push a single word all the way to the right.
+    if ' ' not in strip_codes(line).strip():
+        return line.replace(' ', '')
+    return line
+
+
+def find_word_end(text, count=1):
+    """ This is a helper function for expand_words().
+        Finds the index of word endings (default is first word).
+        The last word doesn't count.
+        If there are no words, or there are no spaces in the word, it
+        returns -1.
+
+        This method ignores escape codes.
+        Example:
+            s = 'this is a test'
+            i = find_word_end(s, count=1)
+            print('-'.join((s[:i], s[i:])))
+            # 'this- is a test'
+            i = find_word_end(s, count=2)
+            print('-'.join((s[:i], s[i:])))
+            # 'this is- a test'
+    """
+    if not text:
+        return -1
+    elif ' ' not in text:
+        return 0
+    elif not text.strip():
+        return -1
+    count = count or 1
+    found = 0
+    foundindex = -1
+    inword = False
+    indices = get_indices(str(text))
+    sortedindices = sorted(indices)
+    for i in sortedindices:
+        c = indices[i]
+        if inword and c.isspace():
+            # Found space.
+            inword = False
+            foundindex = i
+            found += 1
+            # Was there an escape code before this space?
+            testindex = i
+            while testindex > 0:
+                testindex -= 1
+                s = indices.get(testindex, None)
+                if s is None:
+                    # Must be in the middle of an escape code.
+                    continue
+                if len(s) == 1:
+                    # Test index was a char.
+                    foundindex = testindex + 1
+                    break
+
+            if found == count:
+                return foundindex
+        elif not c.isspace():
+            inword = True
+    # We ended in a word/escape-code, or there were no words.
+    lastindex = sortedindices[-1]
+    if len(indices[lastindex]) > 1:
+        # Last word included an escape code. Rewind a bit.
+        while lastindex > 0:
+            lastindex -= 1
+            s = indices.get(lastindex, None)
+            if s is None:
+                # Must be in the middle of an escape code.
+                continue
+            if len(s) == 1:
+                # Found last char.
+                return lastindex + 1
+
+    return -1 if inword else foundindex
+
+
+def format_block(
+        text, width=60, chars=False, fill=False, newlines=False,
+        prepend=None, append=None, strip_first=False, strip_last=False,
+        lstrip=False, shrink=False, paragraphs=False, max_lines=None,
+        marker=None, tokens=None, uax14=False, overlong=None):
+    """ Format a long string into a block of newline seperated text.
+        Arguments:
+            See iter_format_block().
+    """
+    # Basic usage of iter_format_block(), for convenience.
+    return '\n'.join(
+        iter_format_block(
+            text or '',
+            prepend=prepend,
+            append=append,
+            strip_first=strip_first,
+            strip_last=strip_last,
+            width=width,
+            chars=chars,
+            fill=fill,
+            newlines=newlines,
+            lstrip=lstrip,
+            shrink=shrink,
+            uax14=uax14,
+            overlong=overlong,
+            paragraphs=paragraphs,
+            max_lines=max_lines,
+            marker=marker,
+            tokens=tokens,
+        )
+    )
+
+
+def get_breaks(
+        text, width=60, chars=False, shrink=False, lstrip=False,
+        tokens=None, uax14=False, overlong=None):
+    """ Return where the lines break when wrapping `text`, without creating
+        any line strings, as an array('Q') of offsets into `text`:
+            [start0, end0, start1, end1, ...]
+        so `text[breaks[i * 2]:breaks[i * 2 + 1]]` is the source of line
+        `i`. Escape codes are not counted in the width.
+        Arguments:
+            text     : String to wrap.
+            width    : Maximum width for each line.
+            chars    : Wrap on characters instead of spaces.
+            shrink   : Shrink-to-fit, see iter_block().
+            lstrip   : Skip leading whitespace in each line (only lines
+                       wrapped on characters can have it).
+            tokens   : A Tokens for `text` (see fmtblock.tokens).
+            uax14    : Also break inside of words, where UAX #14 allows it
+                       (see iter_uax14_spans()).
+            overlong : Policy for words wider than `width`, see
+                       iter_format_block().
+    """
+    if (overlong is not None) and (overlong not in OVERLONG_POLICIES):
+        raise ValueError('Unknown overlong policy: {!r}'.format(overlong))
+    text = text or ''
+    uax14 = uax14 and not (chars or shrink)
+    spans = None
+    if (tokens is not None) and not uax14:
+        spans = tokens.iter_spans(width=width, chars=chars, shrink=shrink)
+    if spans is None:
+        if chars:
+            spans = iter_char_spans(text, width=width)
+        elif shrink:
+            spans = iter_shrink_spans(text, width=width)
+        elif uax14:
+            spans = iter_uax14_spans(text, width=width)
+        else:
+            spans = iter_space_spans(text, width=width)
+    if overlong and not chars:
+        spans = iter_overlong_spans(
+            text,
+            spans,
+            width=width,
+            truncate=overlong == OVERLONG_TRUNCATE,
+        )
+    breaks = array('Q')
+    append = breaks.append
+    for span in spans:
+        start, end = span[0], span[1]
+        if lstrip:
+            while (start < end) and text[start].isspace():
+                start += 1
+        append(start)
+        append(end)
+    return breaks
+
+
+def get_code_spans(text):
+    """ Return the offsets of the escape codes in `text` (the ones that
+        get_codes() finds), as an array('Q'):
+            [start0, end0, start1, end1, ...]
+    """
+    spans = array('Q')
+    if '\x1b' not in text:
+        return spans
+    for match in codegrabpat.finditer(text):
+        spans.extend(match.span())
+    return spans
+
+
+def get_tier(text):
+    """ Profile `text` with a few cheap checks, and return its tier (one of
+        the TIER_ constants), which picks the engines that wrap it.
+        Only one pass over `text` is needed for most tiers.
+    """
+    if '\x1b' in text:
+        return TIER_CODES
+    if text.isascii():
+        return TIER_PLAIN if is_plain(text) else TIER_ASCII
+    if has_wide(text):
+        return TIER_WIDE
+    return TIER_PLAIN if is_plain(text) else TIER_TEXT
+
+
+def has_wide(text):
+    """ Returns True if `text` has any characters that aren't one column
+        wide: wide (two column) characters, or zero width characters like
+        combining marks (see fmtblock.widths). Characters past U+FFFF are
+        always measured, so they count too.
+    """
+    try:
+        # Latin-1 text is stored with one byte per character, so this is
+        # only a copy, and much faster than searching it.
+        text.encode('latin-1')
+    except UnicodeEncodeError:
+        return specialpat.search(text) is not None
+    return False
+
+
+def is_plain(text):
+    """ Returns True if `text` only has single spaces between words, and no
+        other whitespace or escape codes. str.isprintable() is False for
+        every whitespace character except the ASCII space, and for escape
+        codes.
+    """
+    return text.isprintable() and ('  ' not in text)
+
+
+def iter_add_text(lines, prepend=None, append=None):
+    """ Prepend or append text to lines. Yields each line. """
+    if (prepend is None) and (append is None):
+        yield from lines
+    else:
+        # Build up a format string, with optional {prepend}/{append}
+        fmtpcs = ['{prepend}'] if prepend else []
+        fmtpcs.append('{line}')
+        if append:
+            fmtpcs.append('{append}')
+        fmtstr = ''.join(fmtpcs)
+        yield from (
+            fmtstr.format(prepend=prepend, line=line, append=append)
+            for line in lines
+        )
+
+
+def iter_block(
+        text, width=60, chars=False, newlines=False, lstrip=False,
+        shrink=False, paragraphs=False, max_lines=None, marker=None,
+        tokens=None, uax14=False, overlong=None):
+    """ Iterator that turns a long string into lines no greater than
+        'width' in length.
+        It can wrap on spaces or characters. It only does basic blocks.
+        For prepending see `iter_format_block()`.
+
+        Arguments:
+            text       : String to format.
+            width      : Maximum width for each line.
+                         Default: 60
+            chars      : Wrap on characters if true, otherwise on spaces.
+                         Default: False
+            newlines   : Preserve newlines when True.
+                         Default: False
+            lstrip     : Whether to remove leading spaces from each line.
+                         Default: False
+            shrink     : Keep runs of spaces between words, only
+                         collapsing them when a line is too wide.
+                         This is ignored when `chars` is used.
+                         Default: False
+            uax14      : Also break inside of words, where Unicode line
+                         breaking (UAX #14) allows it, like after hyphens
+                         or between CJK characters. This is ignored when
+                         `chars` or `shrink` is used.
+                         Default: False
+            overlong   : What to do with a word that is wider than
+                         `width`, see iter_format_block().
+                         Default: None
+            paragraphs : Reflow paragraphs, keeping blank lines between
+                         them. This overrides `newlines`.
+                         Default: False
+            max_lines  : Stop after this many lines. Only as much of
+                         `text` as needed for them is wrapped.
+                         Default: None
+            marker     : Line to add when lines were cut off by
+                         `max_lines`, like '...'.
+                         Default: None
+            tokens     : A Tokens for `text` (see fmtblock.tokens), so it
+                         isn't split into words again.
+                         Default: None
+    """
+    text = text or ''
+    yield from pipeline.Pipeline.preset_block(
+        width=max(width, 1),
+        chars=chars,
+        newlines=newlines,
+        lstrip=lstrip,
+        shrink=shrink,
+        uax14=uax14,
+        overlong=overlong,
+        paragraphs=paragraphs,
+        max_lines=max_lines,
+        marker=marker,
+        tokens=tokens,
+    ).iter_lines(text)
+
+
+def iter_char_block(text, width=60, fmtfunc=str, tokens=None):
+    """ Format block by splitting on individual characters.
+        `tokens` can be a Tokens for `text` (see fmtblock.tokens).
+    """
+    text = text or ''
+    spans = None
+    if tokens is not None:
+        spans = tokens.iter_spans(width=width, chars=True)
+    for info in iter_char_lines(text, width=width, spans=spans):
+        yield fmtfunc(info[0])
+
+
+def iter_char_lines(text, width=60, spans=None):
+    """ Split `text` on individual characters (newlines are treated as
+        spaces), yielding a line info tuple for each line:
+            (line, start, end, words, linewidth)
+        `start` and `end` are the offsets of the line in `text`, `words`
+        is the number of words in the line, and `linewidth` is the visible
+        width of the line.
+        Lines are sliced from `text` at the offsets from iter_char_spans(),
+        or from `spans` when given (like the ones from Tokens.iter_spans()).
+    """
+    # Replacing newlines doesn't move any offsets.
+    text = (text or '').replace('\n', ' ')
+    if (spans is None) and (
+            ('\x1b' not in text) or not get_codes(text)) and (
+            text.isascii() or not has_wide(text)):
+        # No escape codes or wide characters, the spans are simple enough
+        # to inline.
+        width = max(width, 1)
+        for i in range(0, len(text), width):
+            line = text[i:i + width]
+            yield line, i, i + len(line), len(line.split()), len(line)
+        return None
+    if spans is None:
+        spans = iter_char_spans(text, width=width)
+    for start, end, linewidth in spans:
+        line = text[start:end]
+        yield line, start, end, len(strip_codes(line).split()), linewidth
+
+
+def iter_char_spans(text, width=60, codes=None):
+    """ Like iter_char_lines(), but only yield (start, end, linewidth)
+        for each line, without creating any line strings.
+        `codes` can hold the escape code offsets in `text`, from
+        get_code_spans(), so they aren't searched for again.
+    """
+    if width < 1:
+        width = 1
+    text = text or ''
+    if codes is None:
+        codes = get_code_spans(text)
+    if (not text.isascii()) and has_wide(text):
+        # Characters aren't all one column wide.
+        yield from iter_column_spans(text, width=width, codes=codes)
+        return None
+    length = len(text)
+    if not codes:
+        # No escape codes, use simple method.
+        for start in range(0, length, width):
+            end = min(start + width, length)
+            yield start, end, end - start
+        return None
+    # Ignore escape codes when counting. Each code ends a run of chars.
+    bounds = list(zip(codes[::2], codes[1::2]))
+    if codes[-1] < length - 1:
+        # A single char after the last code has always been dropped.
+        bounds.append((length, length))
+    blockwidth = 0
+    start = end = pos = 0
+    for runend, codeend in bounds:
+        while pos < runend:
+            count = min(width - blockwidth, runend - pos)
+            pos += count
+            blockwidth += count
+            if blockwidth == width:
+                yield start, pos, width
+                blockwidth = 0
+                start = pos
+        end = pos = codeend
+    if end > start:
+        yield start, end, blockwidth
+
+
+def iter_column_spans(text, width=60, codes=None):
+    """ The engine for iter_char_spans() on text with characters that
+        aren't one column wide (see has_wide()). Lines are filled by
+        display width: wide characters are never split between lines, and
+        zero width characters stay with the character before them.
+        `codes` can hold the escape code offsets, like iter_char_spans().
+    """
+    if width < 1:
+        width = 1
+    if codes is None:
+        codes = get_code_spans(text)
+    length = len(text)
+    if codes and (codes[-1] == length - 1):
+        # A single char after the last code has always been dropped.
+        length -= 1
+    # Everything but runs of one column characters, as
+    # (start, end, charwidth), where escape codes have no `charwidth`.
+    events = sorted(chain(
+        ((start, end, None) for start, end in zip(codes[::2], codes[1::2])),
+        (
+            (match.start(), match.end(), char_width(match.group()))
+            for match in specialpat.finditer(text, 0, length)
+        ),
+    ))
+    events.append((length, length, None))
+    blockwidth = 0
+    start = pos = 0
+    # End of the last zero width joiner.
+    joinend = -1
+    for eventstart, eventend, charwidth in events:
+        while pos < eventstart:
+            if blockwidth >= width:
+                yield start, pos, blockwidth
+                start = pos
+                blockwidth = 0
+            count = min(width - blockwidth, eventstart - pos)
+            pos += count
+            blockwidth += count
+        if charwidth is None:
+            # Escape codes after a full line start the next one.
+            if blockwidth >= width:
+                yield start, eventstart, blockwidth
+                start = eventstart
+                blockwidth = 0
+        elif charwidth and (eventstart != joinend):
+            if blockwidth and (blockwidth + charwidth > width):
+                yield start, eventstart, blockwidth
+                start = eventstart
+                blockwidth = 0
+            blockwidth += charwidth
+        elif text[eventstart] == ZWJ:
+            joinend = eventend
+        pos = eventend
+    if length > start:
+        yield start, length, blockwidth
+
+
+def iter_delimited(stream, delimiter='\n', chunksize=65536):
+    """ Lazily yield records from a text stream, separated by `delimiter`
+        (which is not included). A trailing delimiter doesn't start a new
+        record. Memory use only depends on the size of the longest record.
+    """
+    if delimiter == '\n':
+        for line in stream:
+            yield line[:-1] if line.endswith('\n') else line
+        return None
+    pending = []
+    while True:
+        chunk = stream.read(chunksize)
+        if not chunk:
+            break
+        pcs = chunk.split(delimiter)
+        if len(pcs) == 1:
+            pending.append(chunk)
+            continue
+        pending.append(pcs[0])
+        yield ''.join(pending)
+        yield from pcs[1:-1]
+        pending = [pcs[-1]]
+    last = ''.join(pending)
+    if last:
+        yield last
+
+
+def iter_format_block(
+        text, width=60, chars=False, fill=False, newlines=False,
+        append=None, prepend=None, strip_first=False, strip_last=False,
+        lstrip=False, shrink=False, paragraphs=False, max_lines=None,
+        marker=None, tokens=None, uax14=False, overlong=None):
+    """ Iterate over lines in a formatted block of text.
+        This iterator allows you to prepend to each line.
+        For basic blocks see iter_block().
+
+
+        Arguments:
+            text        : String to format.
+
+            width       : Maximum width for each line. The prepend string
+                          is not included in this calculation.
+                          Default: 60
+
+            chars       : Whether to wrap on characters instead of spaces.
+                          Default: False
+            fill        : Insert spaces between words so that each line is
+                          the same width (not counting `prepend` or
+                          `append`). This overrides `chars`.
+                          Default: False
+
+            newlines    : Whether to preserve newlines in the original
+                          string. Blank lines are not kept.
+                          Default: False
+
+            paragraphs  : Reflow paragraphs (lines separated by blank
+                          lines), keeping the blank lines between them.
+                          This overrides `newlines`.
+                          Default: False
+
+            append      : String to append after each line.
+
+            prepend     : String to prepend before each line.
+
+            strip_first : Whether to omit the prepend string for the first
+                          line.
+                          Default: False
+
+                          Example (when using prepend='$'):
+                           Without strip_first -> '$this', '$that'
+                           With strip_first -> 'this', '$that'
+
+            strip_last  : Whether to omit the append string for the last
+                          line (like strip_first does for prepend).
+                          Default: False
+
+            lstrip      : Whether to remove leading spaces from each line.
+                          This doesn't include any spaces in `prepend`.
+                          Default: False
+
+            shrink      : Shrink-to-fit, for pre-aligned text. Runs of
+                          spaces between words are kept, and only
+                          collapsed as much as needed to fit `width`.
+                          Default: False
+
+            uax14       : Also break inside of words, where Unicode line
+                          breaking (UAX #14) allows it, like after hyphens
+                          or between CJK characters (see
+                          iter_uax14_spans()). This is ignored when `chars`
+                          or `shrink` is used.
+                          Default: False
+
+            overlong    : What to do with a word that is wider than
+                          `width`. By default it gets a line of its own.
+                          'split' : Split it into lines of `width`
+                                    columns.
+                          'truncate' : Cut it off, ending the line with
+                                       TRUNCATED ('...').
+                          Either way, only the part that is kept is ever
+                          copied from `text`. This is ignored when `chars`
+                          is used.
+                          Default: None
+
+            max_lines   : Stop after this many lines. Only as much of
+                          `text` as needed for them is wrapped, so a
+                          preview of huge text is cheap.
+                          Default: None
+
+            marker      : Line to add after the last line when lines were
+                          cut off by `max_lines`, like '...'. It gets the
+                          same prepend/append as other lines.
+                          Default: None
+
+            tokens      : A Tokens for `text` (see fmtblock.tokens), so
+                          it isn't split into words or searched for
+                          escape codes again. FormatBlock passes its own.
+                          Default: None
+    """
+    yield from pipeline.Pipeline.preset_format_block(
+        width=width,
+        chars=chars,
+        fill=fill,
+        newlines=newlines,
+        append=append,
+        prepend=prepend,
+        strip_first=strip_first,
+        strip_last=strip_last,
+        lstrip=lstrip,
+        shrink=shrink,
+        uax14=uax14,
+        overlong=overlong,
+        paragraphs=paragraphs,
+        max_lines=max_lines,
+        marker=marker,
+        tokens=tokens,
+    ).iter_lines(text or '')
+
+
+def iter_format_records(
+        text, width=60, chars=False, fill=False, newlines=False,
+        append=None, prepend=None, strip_first=False, strip_last=False,
+        lstrip=False, shrink=False, paragraphs=False, max_lines=None,
+        marker=None, tokens=None, uax14=False, overlong=None):
+    """ Like iter_format_block(), but yield pipeline.LineRecords instead
+        of strings. Each record has the line's text, its visible width,
+        its start/end offsets in `text`, and its word count, all found
+        while wrapping. Use `record.render()` to get the decorated line.
+        Arguments:
+            See iter_format_block().
+    """
+    yield from pipeline.Pipeline.preset_format_block(
+        width=width,
+        chars=chars,
+        fill=fill,
+        newlines=newlines,
+        append=append,
+        prepend=prepend,
+        strip_first=strip_first,
+        strip_last=strip_last,
+        lstrip=lstrip,
+        shrink=shrink,
+        uax14=uax14,
+        overlong=overlong,
+        paragraphs=paragraphs,
+        max_lines=max_lines,
+        marker=marker,
+        records=True,
+        tokens=tokens,
+    ).iter_lines(text or '')
+
+
+def iter_format_stream(
+        stream, delimiter='\n', continuation=None, width=60, chars=False,
+        fill=False, newlines=False, append=None, prepend=None,
+        strip_first=False, strip_last=False, lstrip=False, shrink=False,
+        paragraphs=False, max_lines=None, marker=None, uax14=False,
+        overlong=None):
+    """ Format each record from a text stream separately, like log
+        messages, yielding one formatted block (a newline separated string)
+        for each record. Records are read lazily (see iter_delimited()),
+        and one Pipeline is built up front and shared by all of them, so
+        memory use doesn't grow with the stream.
+        Arguments:
+            stream       : A text file object to read records from.
+            delimiter    : String that separates records, like '\0'.
+                           Default: '\n'
+            continuation : String to prepend before the lines after the
+                           first one in each record, instead of `prepend`.
+            The rest are the same as iter_format_block(), and apply to
+            each record (`max_lines` limits the lines for each record).
+    """
+    run = pipeline.Pipeline.preset_format_block(
+        width=width,
+        chars=chars,
+        fill=fill,
+        newlines=newlines,
+        append=append,
+        prepend=prepend,
+        strip_first=strip_first,
+        strip_last=strip_last,
+        lstrip=lstrip,
+        shrink=shrink,
+        uax14=uax14,
+        overlong=overlong,
+        paragraphs=paragraphs,
+        max_lines=max_lines,
+        marker=marker,
+        continuation=continuation,
+    ).run
+    for record in iter_delimited(stream, delimiter=delimiter):
+        yield run(record)
+
+
+def iter_gapword_spans(text, width=60, wide=False):
+    """ The general engine for iter_shrink_spans(), which looks at every
+        word in `text`, and the gap before it.
+        Escape codes are not counted in the width. Words are measured by
+        their display width when `wide` is truthy (see has_wide()).
+    """
+    if width < 1:
+        width = 1
+    words = 0
+    start = end = 0
+    # Width of the line with single spaces between words.
+    curwidth = 0
+    # Width of the line with the original spacing.
+    rawwidth = 0
+    clean = True
+    for match in _gapwordpat.finditer(text):
+        gap, word = match.groups()
+        visible = strip_codes(word) if '\x1b' in word else word
+        wordwidth = get_width(visible) if wide else len(visible)
+        if words and (curwidth + 1 + wordwidth <= width):
+            # Only runs of plain spaces are kept.
+            if gap.strip(' '):
+                clean = False
+                rawwidth += 1 + wordwidth
+            else:
+                rawwidth += len(gap) + wordwidth
+            words += 1
+            curwidth += 1 + wordwidth
+            end = match.end()
+            continue
+        if words:
+            yield (
+                start,
+                end,
+                words,
+                min(rawwidth, max(width, curwidth)),
+                clean,
+            )
+        words = 1
+        end = match.end()
+        start = end - len(word)
+        curwidth = rawwidth = wordwidth
+        clean = True
+    if words:
+        yield start, end, words, min(rawwidth, max(width, curwidth)), clean
+
+
+def iter_lines(text):
+    """ Lazily yield each line in `text`, like `text.split('\\n')` without
+        building the whole list.
+    """
+    find = text.find
+    start = 0
+    while True:
+        end = find('\n', start)
+        if end < 0:
+            yield text[start:]
+            return None
+        yield text[start:end]
+        start = end + 1
+
+
+def iter_overlong_lines(text, spans, width=60, engine=None, truncate=False):
+    """ Yield line info tuples (see iter_char_lines()) from a space wrapping
+        engine (iter_space_lines() by default, or iter_shrink_lines() or
+        iter_uax14_lines()), for `spans` from the matching spans engine,
+        with words that are wider than `width` split or truncated (see
+        iter_overlong_spans()).
+        Only the part of a word that is kept is ever sliced from `text`.
+    """
+    if engine is None:
+        engine = iter_space_lines
+    # Text to add to the end of the last truncated line. The engines make
+    # each line as soon as they get its span, so there is only ever one.
+    ends = []
+
+    def iter_marked():
+        for span in iter_overlong_spans(
+                text, spans, width=width, truncate=truncate):
+            if span[4].__class__ is str:
+                ends.append(span[4])
+            yield span
+
+    for line, start, end, words, linewidth in engine(
+            text, width=width, spans=iter_marked()):
+        if ends:
+            line = ''.join((line, ends.pop()))
+        yield line, start, end, words, linewidth
+
+
+def iter_overlong_spans(text, spans, width=60, truncate=False):
+    """ Apply a policy for words that are wider than `width` to `spans`
+        from iter_space_spans() (or iter_shrink_spans(), or
+        iter_uax14_spans()) for `text`. A line that is only one word that is
+        too wide is split into lines of `width` columns (see
+        iter_split_spans()), or, with `truncate`, cut off so that TRUNCATED
+        fits after it. Either way, its lines aren't shared with other words.
+        The `clean` of a truncated line is the text to add to the end of
+        it instead: TRUNCATED, after the escape codes that were cut off.
+        Its `linewidth` includes TRUNCATED.
+        The empty line that comes before an overlong first word is
+        dropped. The time spent on a word is linear in its length, and
+        none of it is copied.
+    """
+    width = max(width, 1)
+    # A marker that doesn't leave room for any of the word isn't used.
+    marker = TRUNCATED if len(TRUNCATED) < width else ''
+    for span in spans:
+        start, end, words, linewidth, clean = span
+        if linewidth <= width:
+            if words:
+                yield span
+            continue
+        if words != 1:
+            # Glued to another word (UAX #14), there's no telling where
+            # the pieces would start.
+            yield span
+            continue
+        pieces = iter_split_spans(
+            text,
+            start,
+            end,
+            width=width - len(marker) if truncate else width,
+        )
+        if not truncate:
+            for piecestart, pieceend, piecewidth in pieces:
+                yield piecestart, pieceend, 1, piecewidth, True
+            continue
+        piecestart, pieceend, piecewidth = next(pieces)
+        if marker and (piecewidth > width - len(marker)):
+            # A wide character that doesn't fit with the marker.
+            pieceend = piecestart
+            piecewidth = 0
+        yield (
+            piecestart,
+            pieceend,
+            1,
+            piecewidth + len(marker),
+            ''.join(chain(
+                codegrabpat.findall(text, pieceend, end),
+                (marker,),
+            )),
+        )
+
+
+def iter_paragraphs(text, continued=False):
+    """ Lazily yield paragraphs from `text`, as (offset, paragraph) tuples,
+        where `paragraph` is the slice of `text` (including its newlines)
+        starting at `offset`.
+        A paragraph of None is yielded for every blank line (a line with
+        only whitespace), so blank lines can be kept.
+        If `continued` is truthy, `text` starts in the middle of a
+        paragraph, so the first line is part of it even when it's blank.
+    """
+    parastart = None
+    offset = 0
+    for line in iter_lines(text):
+        if continued or (line and not line.isspace()):
+            continued = False
+            if parastart is None:
+                parastart = offset
+        else:
+            if parastart is not None:
+                yield parastart, text[parastart:offset - 1]
+                parastart = None
+            yield offset, None
+        offset += len(line) + 1
+    if parastart is not None:
+        yield parastart, text[parastart:]
+
+
+def iter_plain_spans(text, width=60):
+    """ Fast path for iter_space_spans(), for "plain" text with single
+        spaces between words, and no other whitespace or escape codes (see
+        is_plain()). Each line is found with one str.rfind(), instead of
+        looking at every word.
+    """
+    if width < 1:
+        width = 1
+    # Skip a leading or trailing space.
+    start = 1 if text.startswith(' ') else 0
+    length = len(text) - 1 if text.endswith(' ') else len(text)
+    if start >= length:
+        return None
+    firstend = text.find(' ', start, length)
+    if ((firstend if firstend >= 0 else length) - start) > width:
+        # Same empty line as iter_space_spans(), for an overlong first
+        # word.
+        yield start, start, 0, 0, True
+    count = text.count
+    while start < length:
+        end = start + width
+        if end >= length:
+            yield (
+                start,
+                length,
+                count(' ', start, length) + 1,
+                length - start,
+                True,
+            )
+            return None
+        # The last space that still fits (a space right at `end` does).
+        cut = text.rfind(' ', start, end + 1)
+        if cut < 0:
+            # Overlong word, it gets a line to itself.
+            cut = text.find(' ', end, length)
+            if cut < 0:
+                cut = length
+        yield start, cut, count(' ', start, cut) + 1, cut - start, True
+        start = cut + 1
+
+
+def iter_plain_widths(text, width=60):
+    """ Like iter_plain_spans(), but only yield the width of each line,
+        without counting its words. Used by measure().
+    """
+    if width < 1:
+        width = 1
+    start = 1 if text.startswith(' ') else 0
+    length = len(text) - 1 if text.endswith(' ') else len(text)
+    if start >= length:
+        return None
+    firstend = text.find(' ', start, length)
+    if ((firstend if firstend >= 0 else length) - start) > width:
+        yield 0
+    find = text.find
+    rfind = text.rfind
+    while start < length:
+        end = start + width
+        if end >= length:
+            yield length - start
+            return None
+        cut = rfind(' ', start, end + 1)
+        if cut < 0:
+            cut = find(' ', end, length)
+            if cut < 0:
+                cut = length
+        yield cut - start
+        start = cut + 1
+
+
+def iter_shrink_block(text, width=60, fmtfunc=str, tokens=None):
+    """ Format block by wrapping on spaces, like iter_space_block(),
+        but keep runs of spaces between words. Lines that are too wide
+        are squeezed with squeeze_words().
+        `tokens` can be a Tokens for `text` (see fmtblock.tokens).
+    """
+    text = text or ''
+    spans = None
+    if tokens is not None:
+        spans = tokens.iter_spans(width=width, shrink=True)
+    for info in iter_shrink_lines(text, width=width, spans=spans):
+        yield fmtfunc(info[0])
+
+
+def iter_shrink_lines(text, width=60, spans=None):
+    """ Wrap `text` like iter_shrink_block(), yielding a line info tuple
+        for each line (see iter_char_lines()).
+        Lines are sliced from `text` at the offsets from
+        iter_shrink_spans() (or `spans`), and squeezed to fit.
+    """
+    text = text or ''
+    if spans is None:
+        spans = iter_shrink_spans(text, width=width)
+    for start, end, words, linewidth, clean in spans:
+        line = text[start:end]
+        if not clean:
+            line = _gapspat.sub(_fix_gap, line)
+        yield squeeze_words(line, width=width), start, end, words, linewidth
+
+
+def iter_shrink_spans(text, width=60, tier=None):
+    """ Like iter_shrink_lines(), but only yield
+        (start, end, words, linewidth, clean) for each line, without
+        creating any line strings. `clean` is False when some of the gaps
+        between words have whitespace other than spaces, which is
+        replaced with a single space in the line.
+        This picks the engine for the `tier` of `text` (see get_tier()),
+        and returns its iterator.
+    """
+    text = text or ''
+    if tier is None:
+        tier = get_tier(text)
+    if tier == TIER_CODES:
+        return iter_gapword_spans(
+            text,
+            width=width,
+            wide=not text.isascii() and has_wide(text),
+        )
+    return iter_shrink_space_spans(text, width=width, tier=tier)
+
+
+def iter_shrink_space_spans(text, width=60, tier=None):
+    """ Fast path for iter_shrink_spans(), for text without escape codes.
+        Lines break at the same places as iter_space_spans() (without its
+        empty line before an overlong first word), so its engines are
+        reused, and only lines with runs of whitespace are measured again.
+    """
+    width = max(width, 1)
+    for start, end, words, linewidth, clean in iter_space_spans(
+            text, width=width, tier=tier):
+        if not words:
+            continue
+        if clean:
+            # Single spaces, nothing to shrink.
+            yield start, end, words, linewidth, True
+            continue
+        line = text[start:end]
+        clean = True
+        if line.isprintable():
+            rawwidth = linewidth + line.count(' ') - words + 1
+        else:
+            # Only runs of plain spaces are kept, other gaps become one
+            # space.
+            rawwidth = linewidth
+            for gap in _gapspat.findall(line):
+                if gap.strip(' '):
+                    clean = False
+                else:
+                    rawwidth += len(gap) - 1
+        yield start, end, words, min(rawwidth, max(width, linewidth)), clean
+
+
+def iter_space_block(text, width=60, fmtfunc=str, tokens=None):
+    """ Format block by wrapping on spaces.
+        `tokens` can be a Tokens for `text` (see fmtblock.tokens).
+    """
+    text = text or ''
+    spans = None
+    if tokens is not None:
+        spans = tokens.iter_spans(width=width)
+    for info in iter_space_lines(text, width=width, spans=spans):
+        yield fmtfunc(info[0])
+
+
+def iter_space_lines(text, width=60, spans=None):
+    """ Wrap `text` on spaces, yielding a line info tuple for each line
+        (see iter_char_lines()).
+        Lines are sliced from `text` at the offsets from iter_space_spans()
+        (or `spans`), and only rebuilt when the words in them are not
+        separated by single spaces.
+    """
+    text = text or ''
+    if spans is None:
+        spans = iter_space_spans(text, width=width)
+    for start, end, words, linewidth, clean in spans:
+        line = text[start:end]
+        yield (
+            line if clean else ' '.join(line.split()),
+            start,
+            end,
+            words,
+            linewidth,
+        )
+
+
+def iter_space_spans(text, width=60, tier=None):
+    """ Like iter_space_lines(), but only yield
+        (start, end, words, linewidth, clean) for each line, without
+        creating any line strings. `clean` is False when the words in the
+        line are not all separated by single spaces.
+        This picks the engine for the `tier` of `text` (see get_tier()),
+        and returns its iterator.
+    """
+    text = text or ''
+    if tier is None:
+        tier = get_tier(text)
+    if tier == TIER_PLAIN:
+        return iter_plain_spans(text, width=width)
+    if (tier == TIER_ASCII) and npengine.accepts(text):
+        # Large ASCII text, use the vectorized engine.
+        return npengine.iter_space_spans(text, width=width)
+    hascodes = tier == TIER_CODES
+    return iter_word_spans(
+        text,
+        width=width,
+        hascodes=hascodes,
+        wide=(tier == TIER_WIDE) or (
+            hascodes and not text.isascii() and has_wide(text)
+        ),
+    )
+
+
+def iter_split_spans(text, start=0, stop=None, width=60):
+    """ Split `text[start:stop]` into (start, end, linewidth) spans of at
+        most `width` columns, like iter_char_spans(), without slicing it.
+        Wide characters are not split, zero width characters stay with the
+        character before them, and escape codes go with the text after
+        them, except at the end.
+    """
+    if width < 1:
+        width = 1
+    if stop is None:
+        stop = len(text)
+    wide = (not text.isascii()) and (
+        specialpat.search(text, start, stop) is not None
+    )
+    if (text.find('\x1b', start, stop) < 0) and not wide:
+        for linestart in range(start, stop, width):
+            lineend = min(linestart + width, stop)
+            yield linestart, lineend, lineend - linestart
+        return None
+    # Everything but runs of one column characters, as
+    # (start, end, charwidth), where escape codes have no `charwidth`.
+    events = (
+        (match.start(), match.end(), None)
+        for match in codegrabpat.finditer(text, start, stop)
+    )
+    if wide:
+        events = merge(events, (
+            (match.start(), match.end(), char_width(match.group()))
+            for match in specialpat.finditer(text, start, stop)
+        ))
+    linestart = pos = visend = start
+    linewidth = 0
+    # End of the last zero width joiner.
+    joinend = -1
+    for eventstart, eventend, charwidth in chain(events, ((stop, stop, 0),)):
+        while pos < eventstart:
+            if linewidth >= width:
+                yield linestart, visend, linewidth
+                linestart = visend
+                linewidth = 0
+            count = min(width - linewidth, eventstart - pos)
+            pos += count
+            linewidth += count
+            visend = pos
+        if charwidth is None:
+            pos = eventend
+            continue
+        if charwidth and (eventstart != joinend):
+            if linewidth and (linewidth + charwidth > width):
+                yield linestart, visend, linewidth
+                linestart = visend
+                linewidth = 0
+            linewidth += charwidth
+        elif text.startswith(ZWJ, eventstart):
+            joinend = eventend
+        pos = visend = eventend
+    if stop > linestart:
+        yield linestart, stop, linewidth
+
+
+def iter_uax14_breaks(text):
+    """ Yield each offset in `text` where a line can start, at Unicode line
+        break opportunities (see fmtblock.linebreak.iter_breaks()).
+        Escape codes can't be broken, and don't change the breaks. An
+        offset with codes at it stays before them.
+    """
+    # The break tables are only loaded when they are needed.
+    from .linebreak import iter_breaks
+    if '\x1b' not in text:
+        return iter_breaks(text)
+    return _iter_code_offsets(
+        iter_breaks(codegrabpat.sub('', text)),
+        get_code_spans(text),
+    )
+
+
+def iter_uax14_lines(text, width=60, spans=None):
+    """ Wrap `text` at Unicode line break opportunities (see
+        fmtblock.linebreak), yielding a line info tuple for each line (see
+        iter_char_lines()).
+        Lines are built like iter_space_lines() does, from the offsets
+        from iter_uax14_spans() (or `spans`).
+    """
+    text = text or ''
+    if spans is None:
+        spans = iter_uax14_spans(text, width=width)
+    return iter_space_lines(text, width=width, spans=spans)
+
+
+def iter_uax14_spans(text, width=60):
+    """ Like iter_space_spans(), but lines can also break inside of words,
+        where UAX #14 allows it (after hyphens and slashes, between CJK
+        characters, and so on). Whitespace between words still counts as
+        a single space. A piece of text with no break opportunity that is
+        wider than `width` gets a line of its own.
+        A word that is split between lines counts as a word in each line.
+    """
+    text = text or ''
+    width = max(width, 1)
+    hascodes = '\x1b' in text
+    wide = (not text.isascii()) and has_wide(text)
+    breaks = iter_uax14_breaks(text)
+    start = end = 0
+    words = linewidth = 0
+    clean = True
+    last = 0
+    for stop in chain(breaks, (len(text),)):
+        # The words in this piece, and its width with single spaces.
+        first = None
+        piecewords = piecewidth = 0
+        piececlean = True
+        for match in _wordpat.finditer(text, last, stop):
+            wordstart, wordend = match.span()
+            wordwidth = wordend - wordstart
+            if wide or hascodes:
+                word = match.group()
+                if wide and not word.isascii():
+                    wordwidth = get_width(word)
+                if hascodes:
+                    wordwidth -= sum(len(code) for code in get_codes(word))
+            if first is None:
+                first = wordstart
+            else:
+                piecewidth += 1
+                if piececlean and ((wordstart - pieceend != 1) or (
+                        text[pieceend] != ' ')):
+                    piececlean = False
+            piecewords += 1
+            piecewidth += wordwidth
+            pieceend = wordend
+        last = stop
+        if first is None:
+            continue
+        # Without whitespace before it, the piece continues the last word.
+        gap = int(first != end)
+        if words and (linewidth + gap + piecewidth <= width):
+            if gap:
+                if clean and ((first - end != 1) or (text[end] != ' ')):
+                    clean = False
+                words += piecewords
+            else:
+                words += piecewords - 1
+            linewidth += gap + piecewidth
+            clean = clean and piececlean
+            end = pieceend
+            continue
+        if words:
+            yield start, end, words, linewidth, clean
+        start, end = first, pieceend
+        words, linewidth, clean = piecewords, piecewidth, piececlean
+    if words:
+        yield start, end, words, linewidth, clean
+
+
+def iter_word_spans(text, width=60, hascodes=True, wide=False):
+    """ The general engine for iter_space_spans(), which looks at every
+        word in `text`. Any whitespace can separate words, and escape
+        codes are not counted in the width, unless `hascodes` is False
+        (when `text` is known to have none). Words are measured by their
+        display width when `wide` is truthy (see has_wide()).
+    """
+    if width < 1:
+        width = 1
+    start = end = 0
+    words = 0
+    linewidth = 0
+    # Whether all gaps in the line are single spaces.
+    clean = True
+    for match in _wordpat.finditer(text):
+        wordstart, wordend = match.span()
+        wordwidth = wordend - wordstart
+        if wide:
+            word = match.group()
+            if not word.isascii():
+                # Escape codes are ASCII, and one column per character.
+                wordwidth = get_width(word)
+        if hascodes:
+            # Ignore escape codes.
+            wordwidth -= sum(len(s) for s in get_codes(match.group()))
+        if words and (linewidth + 1 + wordwidth <= width):
+            if clean and (
+                    (wordstart - end != 1) or (text[end] != ' ')):
+                clean = False
+            end = wordend
+            words += 1
+            linewidth += 1 + wordwidth
+            continue
+        if words:
+            yield start, end, words, linewidth, clean
+        elif wordwidth > width:
+            # The first word is too long, this has always started with an
+            # empty line.
+            yield wordstart, wordstart, 0, 0, True
+        start, end = wordstart, wordend
+        words = 1
+        linewidth = wordwidth
+        clean = True
+    if words:
+        yield start, end, words, linewidth, clean
+
+
+def measure(
+        text, width=60, chars=False, fill=False, newlines=False,
+        prepend=None, append=None, strip_first=False, strip_last=False,
+        lstrip=False, shrink=False, paragraphs=False, max_lines=None,
+        marker=None, tokens=None, uax14=False, overlong=None):
+    """ Measure the lines that format_block() would make, from the widths
+        the engines find, without creating any line strings (only `fill`
+        mode on text with escape codes still has to build them).
+        Returns a tuple of (lines, maxwidth, widths), where `lines` is the
+        number of lines, `maxwidth` is the visible width of the widest
+        line, and `widths` is an array('Q') of each line's visible width,
+        including `prepend` and `append`.
+        Arguments:
+            See iter_format_block().
+    """
+    if (overlong is not None) and (overlong not in OVERLONG_POLICIES):
+        raise ValueError('Unknown overlong policy: {!r}'.format(overlong))
+    text = text or ''
+    if fill:
+        chars = False
+    uax14 = uax14 and not (chars or shrink)
+    fillwidth = width
+    width = max(width, 1)
+    # One extra line, to know whether there are more.
+    stop = None if max_lines is None else max_lines + 1
+    widths = array('Q')
+    add = widths.append
+    segments = pipeline.tokenize(
+        chars=chars,
+        newlines=newlines,
+        paragraphs=paragraphs,
+    )(text)
+    for offset, segment in segments:
+        if (stop is not None) and (len(widths) >= stop):
+            break
+        if segment is None:
+            add(0)
+            continue
+        if fill and ('\x1b' in segment):
+            # Justified lines with escape codes are measured after
+            # justifying them, like the pipeline does.
+            records = pipeline.break_lines(
+                width=width,
+                shrink=shrink,
+                uax14=uax14,
+                overlong=overlong,
+                max_lines=None if stop is None else stop - len(widths),
+                tokens=tokens,
+            )(((offset, segment),))
+            widths.extend(
+                record.width
+                for record in pipeline.justify(width=fillwidth)(records)
+            )
+            continue
+        if (not shrink) and (len(segment) <= width) and (
+                '\x1b' not in segment) and (
+                segment.isascii() or not has_wide(segment)):
+            # Short segments make one line, like pipeline.break_lines().
+            if chars:
+                if segment:
+                    add(len(segment.lstrip() if lstrip else segment))
+                continue
+            words = segment.split()
+            if words:
+                linewidth = sum(map(len, words)) + len(words) - 1
+                if fill and (len(words) > 1) and (linewidth < fillwidth):
+                    linewidth = fillwidth
+                add(linewidth)
+            continue
+        tier = None
+        if not chars:
+            if tokens is None:
+                tier = get_tier(segment)
+            else:
+                tier = tokens.get_tier()
+            if (tier == TIER_PLAIN) and not (fill or uax14 or overlong):
+                # Single spaces, the widths are all that's needed.
+                linewidths = iter_plain_widths(segment, width=width)
+                if shrink:
+                    # Without the empty line before an overlong first
+                    # word, like iter_shrink_space_spans().
+                    linewidths = filter(None, linewidths)
+                if stop is not None:
+                    linewidths = islice(linewidths, stop - len(widths))
+                widths.extend(linewidths)
+                continue
+        spans = None
+        if (tokens is not None) and not uax14:
+            spans = tokens.iter_spans(
+                offset,
+                offset + len(segment),
+                width=width,
+                chars=chars,
+                shrink=shrink,
+            )
+        if spans is None:
+            if chars:
+                spans = iter_char_spans(segment, width=width)
+            elif shrink:
+                spans = iter_shrink_spans(segment, width=width, tier=tier)
+            elif uax14:
+                spans = iter_uax14_spans(segment, width=width)
+            else:
+                spans = iter_space_spans(segment, width=width, tier=tier)
+        if overlong and not chars:
+            spans = iter_overlong_spans(
+                segment,
+                spans,
+                width=width,
+                truncate=overlong == OVERLONG_TRUNCATE,
+            )
+        if stop is not None:
+            spans = islice(spans, stop - len(widths))
+        if chars:
+            for start, end, linewidth in spans:
+                if lstrip:
+                    while (start < end) and segment[start].isspace():
+                        linewidth -= char_width(segment[start])
+                        start += 1
+                add(linewidth)
+        elif fill:
+            for span in spans:
+                linewidth = span[3]
+                if (span[2] > 1) and (linewidth < fillwidth):
+                    linewidth = fillwidth
+                add(linewidth)
+        else:
+            widths.extend(span[3] for span in spans)
+    if (max_lines is not None) and (len(widths) > max_lines):
+        del widths[max_lines:]
+        if marker:
+            add(pipeline.get_width(marker))
+    if widths and (prepend or append):
+        prependwidth = pipeline.get_width(prepend) if prepend else 0
+        appendwidth = pipeline.get_width(append) if append else 0
+        extra = prependwidth + appendwidth
+        if extra:
+            widths = array('Q', [w + extra for w in widths])
+        if strip_first:
+            widths[0] -= prependwidth
+        if strip_last:
+            widths[-1] -= appendwidth
+    return len(widths), max(widths, default=0), widths
+
+
+def squeeze_words(line, width=60):
+    """ Remove spaces in between words until it is small enough for
+        `width`.
+        This will always leave at least one space between words,
+        so it may not be able to get below `width` characters.
+        Runs of spaces are collapsed starting with the last one.
+        Escape codes are not counted in the width.
+    """
+    if '\x1b' in line:
+        excess = get_width(strip_codes(line)) - width
+    else:
+        excess = get_width(line) - width
+    if excess <= 0:
+        return line
+    runs = [m.span() for m in _spacespat.finditer(line)]
+    if not runs:
+        return line
+    # Collapse runs from the end, only as much as needed.
+    pcs = []
+    end = len(line)
+    for runstart, runend in reversed(runs):
+        remove = min(excess, runend - runstart - 1)
+        pcs.append(line[runend:end])
+        pcs.append(line[runstart:runend - remove])
+        end = runstart
+        excess -= remove
+        if not excess:
+            break
+    pcs.append(line[:end])
+    return ''.join(reversed(pcs))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+""" FormatBlock - Follow
+    Follows a growing file, like `tail -f`, formatting the text as it is
+    appended. Only the new bytes are read and fed to an
+    IncrementalFormatter, so each change costs O(new bytes + width), no
+    matter how large the file is, and lines are printed as soon as they
+    are final. With `newlines`, that's as soon as each line ends.
+
+    Changes are waited for with inotify on Linux (through ctypes, so there
+    is no extra dependency), and by checking the file every `interval`
+    seconds everywhere else. A file that is truncated is formatted again
+    from the start.
+
+    Example:
+        stop = threading.Event()
+        for line in iter_follow('app.log', stop=stop.is_set, width=80):
+            print(line, flush=True)
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from typing import (
+    Callable,
+    Iterator,
+    Optional,
+)
+
+from .incremental import IncrementalFormatter
+
+# Default number of seconds between checks for a change, when polling.
+# With inotify, it's the longest wait before `stop` is checked.
+POLL_INTERVAL = 0.25
+# Number of bytes to read from the file at a time.
+CHUNK_SIZE = 65536
+
+# inotify events that mean the file may have changed (from inotify.h).
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_EVENTS = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# The C library, once it's loaded, or False if it has no inotify.
+_libc = None
+
+
+class PollWatcher(object):
+    """ Waits for a file to change, by sleeping for `interval` seconds.
+        Use it as a context manager to close it when done.
+    """
+    name = 'poll'
+
+    def __init__(self, filename: str, interval: float = POLL_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '{}({!r}, interval={})'.format(
+            type(self).__name__,
+            self.filename,
+            self.interval,
+        )
+
+    def close(self) -> None:
+        """ Stop watching the file. """
+        return None
+
+    def wait(self) -> None:
+        """ Wait until the file may have changed. """
+        time.sleep(self.interval)
+
+
+class InotifyWatcher(PollWatcher):
+    """ Waits for a file to change with inotify, waking up as soon as it
+        does, or after `interval` seconds.
+        Raises OSError if inotify is not available.
+    """
+    name = 'inotify'
+
+    def __init__(self, filename: str, interval: float = POLL_INTERVAL):
+        super().__init__(filename, interval=interval)
+        self.fd = None
+        libc = get_libc()
+        if not libc:
+            raise OSError('inotify is not available.')
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        wd = libc.inotify_add_watch(fd, os.fsencode(filename), IN_EVENTS)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, os.strerror(err), filename)
+        self.fd = fd
+
+    def close(self) -> None:
+        """ Stop watching the file. """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def wait(self) -> None:
+        """ Wait until the file may have changed. """
+        readable, _, _ = select.select([self.fd], [], [], self.interval)
+        if not readable:
+            return None
+        # The events don't matter, the file is checked either way.
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+def get_libc():
+    """ Return the C library, loaded with ctypes, if it has inotify.
+        Otherwise, returns False.
+    """
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(
+                ctypes.util.find_library('c'),
+                use_errno=True,
+            )
+        except (OSError, TypeError):
+            # No C library to load (Windows).
+            libc = False
+        if not (libc and hasattr(libc, 'inotify_add_watch')):
+            libc = False
+        _libc = libc
+    return _libc
+
+
+def get_watcher(
+        filename: str,
+        interval: float = POLL_INTERVAL,
+        inotify: bool = True) -> PollWatcher:
+    """ Return an InotifyWatcher for `filename`, if `inotify` is truthy and
+        it's available, otherwise a PollWatcher.
+    """
+    if inotify:
+        try:
+            return InotifyWatcher(filename, interval=interval)
+        except OSError:
+            pass
+    return PollWatcher(filename, interval=interval)
+
+
+def iter_follow(
+        filename: str,
+        formatter: Optional[IncrementalFormatter] = None,
+        interval: float = POLL_INTERVAL,
+        stop: Optional[Callable[[], bool]] = None,
+        inotify: bool = True,
+        **kwargs) -> Iterator[str]:
+    """ Format a file, and keep formatting the text that is appended to it,
+        yielding each output line as soon as it's final.
+        Lines are formatted with `formatter`, or a new IncrementalFormatter
+        with `kwargs` (FormatBlock.format() arguments).
+        This never ends, unless `stop` is given. It's called whenever the
+        end of the file is reached, and when it returns True, the rest of
+        the lines are flushed and the iterator ends.
+        When interrupted without `stop`, `formatter.flush()` returns the
+        rest of the lines.
+    """
+    if formatter is None:
+        formatter = IncrementalFormatter(**kwargs)
+    with open(filename, 'rb') as f, get_watcher(
+            filename,
+            interval=interval,
+            inotify=inotify) as watcher:
+        pos = 0
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk:
+                pos += len(chunk)
+                yield from formatter.feed(chunk)
+                continue
+            if (stop is not None) and stop():
+                break
+            if os.fstat(f.fileno()).st_size < pos:
+                # Truncated, start over.
+                yield from formatter.flush()
+                f.seek(0)
+                pos = 0
+                continue
+            watcher.wait()
+    yield from formatter.flush()
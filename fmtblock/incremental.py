@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+""" FormatBlock - Incremental
+    A push-based formatter, for text that arrives a piece at a time (a
+    socket, or a subprocess's output) and can't be collected first.
+
+    Each chunk is fed in with `feed()`, which returns the lines that are
+    final now. Wrapping is greedy, so every line but the last one is final
+    once the words after it are known. Only the last (unfinished) line and
+    a partial word are kept between chunks, so memory use is bounded by
+    the current line, and each chunk only costs O(chunk size + width).
+    `flush()` returns the rest, at the end of the input.
+    Words, escape codes, and (for bytes) multi-byte characters can be split
+    across chunks. The output is the same as FormatBlock.format() on all of
+    the text at once.
+
+    Example:
+        formatter = IncrementalFormatter(width=60, prepend='> ')
+        for chunk in iter(lambda: sock.recv(4096), b''):
+            for line in formatter.feed(chunk):
+                print(line)
+        for line in formatter.flush():
+            print(line)
+"""
+
+import codecs
+import re
+from typing import (
+    List,
+    Union,
+)
+
+from . import core
+from .escapecodes import strip_codes
+from .pipeline import LineRecord, break_lines, justify
+
+# Longest escape code that is looked for at the end of a chunk. Longer
+# partial codes are just text.
+MAX_CODE = 32
+
+# Used to find an escape code that was cut off at the end of a chunk.
+_partialcodepat = re.compile(r'\x1b(\[[\d;]*)?\Z')
+# Used to find the last whitespace in a chunk, which ends the last
+# complete word.
+_lastspacepat = re.compile(r'\s\S*\Z')
+
+
+class IncrementalFormatter(object):
+    """ Formats text fed in a chunk at a time, with FormatBlock.format()
+        arguments. See the module docs.
+        Chunks can be strings, or bytes in `encoding`.
+    """
+    __slots__ = (
+        'width', 'chars', 'fill', 'newlines', 'prepend', 'append',
+        'strip_first', 'strip_last', 'paragraphs', 'max_lines', 'marker',
+        'encoding', 'errors', 'overlong',
+        '_breaker', '_breaks', '_decoder', '_buffer', '_started', '_line',
+        '_blank', '_inpara', '_lines', '_held', '_done',
+    )
+
+    def __init__(
+            self, width=60, chars=False, fill=False, newlines=False,
+            prepend=None, append=None, strip_first=False, strip_last=False,
+            lstrip=False, shrink=False, paragraphs=False, max_lines=None,
+            marker=None, encoding='utf-8', errors='strict', uax14=False,
+            overlong=None):
+        if fill:
+            chars = False
+        self.width = width
+        self.chars = chars
+        self.fill = fill
+        self.newlines = newlines
+        self.prepend = prepend
+        self.append = append
+        self.strip_first = strip_first
+        self.strip_last = strip_last
+        self.paragraphs = paragraphs
+        self.max_lines = max_lines
+        self.marker = marker
+        self.encoding = encoding
+        self.errors = errors
+        self.overlong = overlong
+        self._breaker = break_lines(
+            width=width,
+            chars=chars,
+            lstrip=lstrip,
+            shrink=shrink,
+            uax14=uax14,
+            overlong=overlong,
+        )
+        # Where lines can break, when it isn't at any whitespace.
+        self._breaks = None
+        if uax14 and not (chars or shrink):
+            self._breaks = core.iter_uax14_breaks
+        self.reset()
+
+    def __repr__(self):
+        return '{}(width={}, lines={}, buffered={})'.format(
+            type(self).__name__,
+            self.width,
+            self._lines,
+            len(self._buffer) + len(self._line),
+        )
+
+    def _add_line(self, record: LineRecord, lines: List[str]) -> None:
+        """ Decorate a final LineRecord, and add it to `lines`. When the
+            last line doesn't get `append`, each line is held back until
+            the next one shows that it wasn't the last.
+        """
+        if self.prepend and not (self.strip_first and not self._lines):
+            record.prepend = self.prepend
+        self._lines += 1
+        if not (self.append and self.strip_last):
+            if self.append:
+                record.append = self.append
+            lines.append(record.render())
+            return None
+        if self._held is not None:
+            self._held.append = self.append
+            lines.append(self._held.render())
+        self._held = record
+
+    def _add_text(self, text: str, records: List[LineRecord]) -> None:
+        """ Add text (without newlines in `newlines` or `paragraphs` mode)
+            to the current line, wrapping the words that are complete.
+        """
+        if not text:
+            return None
+        if self.paragraphs and self._blank:
+            # A line only starts (or continues) a paragraph once it has
+            # something other than whitespace.
+            self._line += text
+            if self._line.isspace():
+                return None
+            text = self._line
+            self._line = ''
+            self._blank = False
+            if self._inpara:
+                text = '\n' + text
+            self._inpara = True
+        start = len(self._buffer)
+        self._buffer += text
+        self._wrap(records, start=start)
+
+    def _end_line(self, records: List[LineRecord]) -> None:
+        """ End the current input line, in `newlines` or `paragraphs` mode.
+        """
+        if not self.paragraphs:
+            self._wrap(records, final=True)
+            return None
+        if self._blank:
+            # A blank line ends the paragraph, and is kept.
+            self._line = ''
+            if self._inpara:
+                self._wrap(records, final=True)
+                self._inpara = False
+            records.append(LineRecord('', width=0, words=0))
+        self._blank = True
+
+    def _is_resumable(self, text: str, record: LineRecord) -> bool:
+        """ Returns True if wrapping `text` can resume at the line for
+            `record`, so it can start the buffer.
+        """
+        start = record.start
+        if self.overlong and start and not text[start - 1].isspace():
+            # The last piece of a split word is wrapped again with the
+            # rest of the word.
+            return False
+        if (self._breaks is not None) and text.startswith('\x1b', start):
+            # A break after escape codes and whitespace that start a line
+            # depends on the text before the line.
+            plain = strip_codes(text[start:record.end])
+            return bool(plain) and not plain[0].isspace()
+        return True
+
+    def _render(
+            self, records: List[LineRecord], last: bool = False) -> List[str]:
+        """ Justify, limit, and decorate final LineRecords, returning the
+            output lines. Everything held back is returned when `last` is
+            truthy.
+        """
+        lines = []
+        if self.fill:
+            records = justify(width=self.width)(records)
+        for record in records:
+            if self._done:
+                break
+            if (self.max_lines is not None) and (
+                    self._lines >= self.max_lines):
+                # There are more lines, nothing else is needed.
+                self._done = True
+                self._buffer = self._line = ''
+                if not self.marker:
+                    break
+                record = LineRecord(
+                    self.marker,
+                    start=record.start,
+                    end=record.start,
+                    words=len(self.marker.split()),
+                )
+            self._add_line(record, lines)
+        if (last or self._done) and (self._held is not None):
+            lines.append(self._held.render())
+            self._held = None
+        return lines
+
+    def _wrap(
+            self, records: List[LineRecord], start: int = 0,
+            final: bool = False) -> None:
+        """ Wrap the buffered text, adding the final LineRecords to
+            `records`, and keeping the text of the last line. `start` is
+            where the text that was just added starts.
+            With `final`, the segment has ended, and every line is final.
+        """
+        text = self._buffer
+        if final:
+            cut = len(text)
+        elif self.chars or (self._breaks is not None):
+            # Every character is complete, but escape codes might not be.
+            cut = len(text)
+            match = _partialcodepat.search(text, max(cut - MAX_CODE, 0))
+            if match is not None:
+                cut = match.start()
+            if self._breaks is not None:
+                # Only complete pieces are wrapped. A break only depends on
+                # the text before it, so the last one is final.
+                offset = 0
+                for offset in self._breaks(text[:cut]):
+                    pass
+                if not offset:
+                    return None
+                cut = offset
+        else:
+            # Only complete words are wrapped.
+            match = _lastspacepat.search(text, start)
+            if match is None:
+                return None
+            cut = match.start()
+        wrapped = list(self._breaker(((0, text[:cut]),)))
+        if wrapped and self._started and not (
+                self.chars or wrapped[0].words):
+            # Resuming on an overlong word adds an empty line before it,
+            # that wasn't there originally.
+            del wrapped[0]
+        if final:
+            self._buffer = ''
+            self._started = False
+        elif wrapped:
+            # The last line might get more words.
+            last = wrapped.pop()
+            while wrapped and not self._is_resumable(text, last):
+                last = wrapped.pop()
+            if self.chars:
+                # Lines wrapped on characters follow each other, and with
+                # `lstrip` they start after their leading whitespace.
+                self._buffer = text[wrapped[-1].end if wrapped else 0:]
+            elif self._is_resumable(text, last):
+                # Otherwise the buffer already starts where it can resume.
+                self._buffer = text[last.start:]
+            self._started = self._started or bool(wrapped)
+        elif not self.chars:
+            # Only whitespace so far.
+            self._buffer = text[cut:]
+        records.extend(wrapped)
+
+    def feed(self, chunk: Union[str, bytes]) -> List[str]:
+        """ Add a chunk of text, and return the output lines that are final
+            now (possibly none).
+        """
+        if self._done:
+            return []
+        if not isinstance(chunk, str):
+            if self._decoder is None:
+                self._decoder = codecs.getincrementaldecoder(
+                    self.encoding
+                )(errors=self.errors)
+            chunk = self._decoder.decode(chunk)
+        records = []
+        if self.newlines or self.paragraphs:
+            pcs = chunk.split('\n')
+            for pc in pcs[:-1]:
+                self._add_text(pc, records)
+                self._end_line(records)
+            self._add_text(pcs[-1], records)
+        else:
+            self._add_text(chunk, records)
+        return self._render(records)
+
+    def flush(self) -> List[str]:
+        """ End the input, and return the rest of the output lines.
+            The formatter is reset afterwards, so it can be used again.
+        """
+        records = []
+        if not self._done:
+            if self._decoder is not None:
+                self._add_text(self._decoder.decode(b'', final=True), records)
+            if self.paragraphs and not self._blank:
+                self._wrap(records, final=True)
+            elif self.newlines or self.paragraphs:
+                self._end_line(records)
+            else:
+                self._wrap(records, final=True)
+        lines = self._render(records, last=True)
+        self.reset()
+        return lines
+
+    def get_buffered(self) -> int:
+        """ Return the number of characters kept for the unfinished line.
+        """
+        return len(self._buffer) + len(self._line)
+
+    def reset(self) -> None:
+        """ Drop any buffered text, and start over. """
+        self._decoder = None
+        self._buffer = ''
+        # Start of the current input line, while it's blank (paragraphs).
+        self._line = ''
+        self._blank = True
+        self._inpara = False
+        # Whether the current segment has had any final lines.
+        self._started = False
+        # Number of output lines so far.
+        self._lines = 0
+        self._held = None
+        self._done = False
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+""" FormatBlock - Index
+    A checkpoint index over the formatted lines of a text, so a window of
+    lines deep inside huge text (like a pager showing lines K..K+H of a
+    log) can be formatted without formatting everything before it.
+
+    Every `interval` output lines, the index records the source span of
+    that line. Wrapping is greedy, so formatting resumed at a line's start
+    offset produces the same lines that followed it originally. A line
+    that is the rest of a split word (overlong='split') can't be resumed
+    at, so the span of the line where that word started is recorded,
+    with the number of lines between them. Formatting
+    a window only starts at the nearest checkpoint, and only reads as much
+    text as the window needs, so after indexing a random jump costs
+    O(interval + count) instead of O(start_line).
+
+    Example:
+        index = LineIndex(text, width=60, prepend='> ')
+        index.build()
+        index.save('text.idx')
+        for line in index.format_window(100000, 40):
+            print(line)
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from contextlib import suppress
+from itertools import islice
+from typing import (
+    Any,
+    Iterator,
+    List,
+    Optional,
+)
+
+from . import core
+from .escapecodes import strip_codes
+from .formatters import __version__
+from .pipeline import LineRecord, Pipeline, tokenize
+from .widths import get_width
+
+# Default number of output lines between checkpoints.
+INTERVAL = 1000
+
+# Number of characters from each end of the text used for fingerprints.
+FINGERPRINT_SIZE = 65536
+
+# Used to end a text prefix right after a word, so no word is cut and the
+# last (partial) line of the prefix is never blank.
+_wordendpat = re.compile(r'\S(?=\s)')
+
+
+def get_fingerprint(text: str) -> str:
+    """ Return a cheap fingerprint for `text`, from its length and both
+        ends, to check that a saved index belongs to it.
+    """
+    digest = hashlib.sha256(b'%d:' % len(text))
+    for pc in (text[:FINGERPRINT_SIZE], text[-FINGERPRINT_SIZE:]):
+        digest.update(pc.encode('utf-8', errors='surrogatepass'))
+    return digest.hexdigest()
+
+
+def lstrip_record(record: LineRecord) -> LineRecord:
+    """ Remove leading whitespace from a record's text, like `lstrip` does,
+        but keep its start offset where the line was wrapped.
+    """
+    text = record.text.lstrip()
+    record.width -= get_width(record.text[:len(record.text) - len(text)])
+    record.text = text
+    return record
+
+
+class LineIndex(object):
+    """ Checkpoint index for `text`, formatted with FormatBlock.format()
+        keyword arguments (`options`). See the module docs.
+        Attributes:
+            checkpoints : (start, end, back) for lines 0, interval,
+                          2 * interval, and so on. The source span of the
+                          line to resume at, `back` lines before it.
+            lines       : Number of lines indexed so far.
+            complete    : Whether all of the text has been indexed.
+    """
+    __slots__ = (
+        'text', 'options', 'interval', 'checkpoints', 'lines', 'complete',
+    )
+
+    # Options that change which lines are made (decoration does not).
+    line_options = (
+        'chars', 'fill', 'lstrip', 'newlines', 'paragraphs', 'shrink',
+        'overlong', 'uax14', 'width',
+    )
+
+    def __init__(self, text: str, interval: int = INTERVAL, **options: Any):
+        self.text = text or ''
+        self.options = options
+        self.interval = max(interval, 1)
+        self.checkpoints = []
+        self.lines = 0
+        self.complete = False
+
+    def __repr__(self):
+        return '{}(lines={}{}, checkpoints={}, interval={})'.format(
+            type(self).__name__,
+            self.lines,
+            '' if self.complete else '+',
+            len(self.checkpoints),
+            self.interval,
+        )
+
+    def build(self, count: Optional[int] = None) -> int:
+        """ Index up to `count` more lines, or all of them when `count` is
+            None. The index can be built a piece at a time.
+            Returns the number of lines indexed so far.
+        """
+        if self.complete or ((count is not None) and (count < 1)):
+            return self.lines
+        checkpoint = max(len(self.checkpoints) - 1, 0)
+        # Lines already indexed after the checkpoint are skipped.
+        skip = self.lines - (checkpoint * self.interval)
+        lineno = checkpoint * self.interval
+        records = self.iter_checkpoint_records(
+            checkpoint,
+            count=None if count is None else skip + count + 1,
+        )
+        # Where formatting can resume for the current line.
+        resume = None
+        for record in records:
+            if resume is None:
+                resume = (
+                    self.checkpoints[checkpoint] if self.checkpoints
+                    else (record.start, record.end, 0)
+                )
+            elif self.is_resumable(record):
+                resume = (record.start, record.end, 0)
+            else:
+                resume = (resume[0], resume[1], resume[2] + 1)
+            if lineno < self.lines:
+                lineno += 1
+                continue
+            if (count is not None) and (lineno == self.lines + count):
+                # There are more lines.
+                self.lines = lineno
+                return self.lines
+            if not (lineno % self.interval):
+                self.checkpoints.append(resume)
+            lineno += 1
+        self.lines = lineno
+        self.complete = True
+        return self.lines
+
+    def find_prefix_end(self, start: int, size: int) -> Optional[int]:
+        """ Return where a prefix of the text from `start` can end, between
+            `size` and `size * 2` characters in, so its lines are wrapped
+            like the whole text's, except for the last one.
+            Returns None if there is no such place.
+        """
+        text = self.text
+        if not self.is_uax14():
+            match = _wordendpat.search(text, start + size, start + size * 2)
+            return None if match is None else match.end()
+        # Whitespace isn't always a break opportunity with `uax14`. Breaks
+        # only depend on the text before them, like the lines do.
+        window = text[start:start + size * 2]
+        for offset in core.iter_uax14_breaks(window):
+            if offset < size:
+                continue
+            # Without the whitespace, the last line is never blank.
+            stop = len(window[:offset].rstrip())
+            if stop:
+                return start + stop
+        return None
+
+    def format_window(self, start_line: int, count: int) -> List[str]:
+        """ Format `count` lines starting with line number `start_line`
+            (0-based), resuming from the nearest checkpoint.
+            The index is built as far as needed first.
+            Returns a list of formatted lines, which is shorter than
+            `count` at the end of the text.
+        """
+        if (start_line < 0) or (count < 1):
+            return []
+        if self.lines <= start_line:
+            self.build(count=start_line + 1 - self.lines)
+            if self.lines <= start_line:
+                return []
+        checkpoint = start_line // self.interval
+        skip = start_line - (checkpoint * self.interval)
+        records = list(islice(
+            self.iter_checkpoint_records(checkpoint, skip + count + 1),
+            skip,
+            None,
+        ))
+        # Whether the window includes the last line.
+        islast = len(records) <= count
+        records = records[:count]
+        prepend = self.options.get('prepend', None)
+        append = self.options.get('append', None)
+        strip_first = self.options.get('strip_first', False)
+        strip_last = self.options.get('strip_last', False)
+        lines = []
+        for lineno, record in enumerate(records, start_line):
+            if prepend and not (strip_first and (lineno == 0)):
+                record.prepend = prepend
+            if append and not (
+                    strip_last and islast and (record is records[-1])):
+                record.append = append
+            lines.append(record.render())
+        return lines
+
+    def is_resumable(self, record: LineRecord) -> bool:
+        """ Returns True if formatting can resume at the line for `record`.
+            It can't when the line is the rest of a word that was split
+            (overlong='split'), because it would be wrapped as a new word.
+            With `uax14`, it can't when the line starts with escape codes
+            that aren't followed by a character.
+        """
+        options = self.options
+        start = record.start
+        if self.is_uax14() and self.text.startswith('\x1b', start):
+            # A break after escape codes and whitespace that start a line
+            # depends on the text before the line.
+            plain = strip_codes(self.text[start:record.end])
+            if (not plain) or plain[0].isspace():
+                return False
+        if (options.get('overlong', None) != 'split') or (
+                options.get('chars', False) and not options.get('fill')):
+            # Characters are wrapped the same from any line (`fill` turns
+            # `chars` off).
+            return True
+        return (
+            (start == record.end) or
+            (start == 0) or
+            self.text[start - 1].isspace()
+        )
+
+    def is_uax14(self) -> bool:
+        """ Returns True if lines are wrapped at Unicode line break
+            opportunities (`chars` and `shrink` wrap differently).
+        """
+        options = self.options
+        chars = options.get('chars', False) and not options.get('fill')
+        return options.get('uax14', False) and not (
+            chars or options.get('shrink', False)
+        )
+
+    def iter_checkpoint_records(
+            self, checkpoint: int,
+            count: Optional[int] = None) -> Iterator[LineRecord]:
+        """ Yield up to `count` undecorated LineRecords, starting with the
+            line at `checkpoint` (an index into `checkpoints`), with source
+            offsets into `text`.
+            Only as much text as needed for `count` lines is formatted.
+        """
+        if not self.checkpoints:
+            start = 0
+            span = None
+            back = 0
+        else:
+            start, end, back = self.checkpoints[checkpoint]
+            span = (start, end)
+            if not checkpoint:
+                # The first line can always be resumed at, from the start
+                # of the text.
+                start = 0
+        records = self.iter_resumed_records(
+            start,
+            span=span,
+            count=None if count is None else count + back,
+        )
+        yield from islice(records, back, None)
+
+    def iter_resumed_records(
+            self, start: int, span: Optional[tuple] = None,
+            count: Optional[int] = None) -> Iterator[LineRecord]:
+        """ Yield up to `count` undecorated LineRecords, starting with the
+            line with the source `span`, at `start`.
+            Only as much text as needed for `count` lines is formatted.
+        """
+        text = self.text
+        if count is None:
+            yield from self.iter_span_records(start, len(text), span)
+            return None
+        width = max(self.options.get('width', 60), 1)
+        size = (count + 1) * (width + 1) * 2
+        # A line is only final once the next line has started, so the
+        # prefix is doubled until it holds `count + 1` lines.
+        while start + size < len(text):
+            stop = self.find_prefix_end(start, size)
+            if stop is None:
+                size *= 2
+                continue
+            try:
+                records = list(islice(
+                    self.iter_span_records(start, stop, span),
+                    count + 1,
+                ))
+            except ValueError:
+                # The checkpoint's line doesn't end in the prefix.
+                records = []
+            if len(records) > count:
+                yield from records[:count]
+                return None
+            size *= 2
+        yield from islice(
+            self.iter_span_records(start, len(text), span),
+            count,
+        )
+
+    def iter_span_records(
+            self, start: int, stop: int,
+            span: Optional[tuple] = None) -> Iterator[LineRecord]:
+        """ Format `text[start:stop]`, yielding undecorated LineRecords
+            with offsets into `text`.
+            When a checkpoint `span` is given, records before the one with
+            that span are skipped. Resuming on an overlong word adds an
+            empty line before it, that wasn't there originally.
+            Raises ValueError if there is no line with that span.
+        """
+        options = {
+            k: v
+            for k, v in self.options.items()
+            if k in self.line_options
+        }
+        # break_lines() moves a line's start past the whitespace it strips,
+        # and wrapping characters can't resume there, so those lines are
+        # stripped here (`fill` turns `chars` off).
+        lstrip = options.get('chars', False) and not options.get('fill')
+        if lstrip:
+            lstrip = options.pop('lstrip', False)
+        pipeline = Pipeline.preset_format_block(records=True, **options)
+        if start and (span is not None) and (span[0] != span[1]):
+            # Resuming inside a paragraph (only blank lines are empty).
+            pipeline.stages[0] = tokenize(
+                chars=options.get('chars', False),
+                newlines=options.get('newlines', False),
+                paragraphs=options.get('paragraphs', False),
+                continued=True,
+            )
+        records = pipeline.iter_lines(self.text[start:stop])
+        if lstrip:
+            records = (lstrip_record(record) for record in records)
+        for record in records:
+            record.start += start
+            record.end += start
+            if (span is None) or ((record.start, record.end) == span):
+                yield record
+                break
+        else:
+            if span is not None:
+                raise ValueError(
+                    'No line matches the checkpoint at: {}'.format(span)
+                )
+        for record in records:
+            record.start += start
+            record.end += start
+            yield record
+
+    @classmethod
+    def load(cls, filename: str, text: str) -> 'LineIndex':
+        """ Load an index saved with `save()`, for `text`.
+            Raises ValueError if the index was saved for different text,
+            or by a different FormatBlock version.
+        """
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if data.get('version', None) != __version__:
+            raise ValueError(
+                'Index was saved by FormatBlock v. {}: {}'.format(
+                    data.get('version', None),
+                    filename,
+                )
+            )
+        if data.get('fingerprint', None) != get_fingerprint(text):
+            raise ValueError('Index was saved for different text: {}'.format(
+                filename,
+            ))
+        index = cls(text, interval=data['interval'], **data['options'])
+        index.checkpoints = [
+            tuple(checkpoint) for checkpoint in data['checkpoints']
+        ]
+        index.lines = data['lines']
+        index.complete = data['complete']
+        return index
+
+    def save(self, filename: str) -> None:
+        """ Save the index to a JSON file, atomically. """
+        data = {
+            'version': __version__,
+            'fingerprint': get_fingerprint(self.text),
+            'options': self.options,
+            'interval': self.interval,
+            'checkpoints': self.checkpoints,
+            'lines': self.lines,
+            'complete': self.complete,
+        }
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.fmtblock-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmpname, filename)
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmpname)
+            raise
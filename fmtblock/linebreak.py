@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+""" FormatBlock - Line Break
+    Line break opportunities from the Unicode line breaking algorithm
+    (UAX #14), so text can wrap after hyphens and slashes, inside of long
+    URLs and paths, and between CJK characters, instead of only at
+    whitespace. See core.iter_uax14_spans() for the wrapping engine.
+
+    Each character's line breaking class comes from a compact table of
+    code point ranges (RANGES), generated from the Unicode Character
+    Database's LineBreak.txt by build_ranges() (format_ranges() returns
+    the source for a new table). Letters (AL, the default) and Hangul
+    syllables (H2 and H3, which alternate) aren't in the table. The
+    classes that UAX #14 leaves to the implementation are resolved like
+    its rule LB1 suggests.
+    Which pairs of classes can break is a pair table (PAIRS), from rules
+    LB7 through LB30b. iter_breaks() finds the breaks in one pass, using
+    a few flags for the rules that look further back than one character.
+
+    Mandatory breaks (newlines) are treated like spaces, because newlines
+    are handled before wrapping (see pipeline.tokenize()), and the
+    exception for East Asian parentheses in rule LB30 isn't made.
+
+    Example:
+        text = 'see https://example.com/a/long/path'
+        print([text[:i] for i in iter_breaks(text)])
+"""
+
+import re
+from array import array
+from bisect import bisect_right
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+)
+
+# Unicode version the table was generated from.
+UNICODE_VERSION = '14.0.0'
+
+# Line breaking classes in the pair table, in order.
+PAIR_CLASSES = (
+    'OP', 'CL', 'CP', 'QU', 'GL', 'NS', 'EX', 'SY', 'IS', 'PR', 'PO', 'NU',
+    'AL', 'HL', 'ID', 'IN', 'HY', 'BA', 'BB', 'B2', 'ZW', 'WJ', 'H2', 'H3',
+    'JL', 'JV', 'JT', 'RI', 'EB', 'EM', 'CB',
+)
+# Every class, by id. The ones after the pair table's are handled by
+# iter_breaks() itself.
+CLASSES = PAIR_CLASSES + ('CM', 'ZWJ', 'SP')
+
+# Classes that LineBreak.txt uses, but are resolved to other classes
+# (rule LB1). SA (South East Asian) is CM for marks, and AL otherwise.
+# Mandatory breaks are spaces here.
+RESOLVED = {
+    'AI': 'AL', 'SG': 'AL', 'XX': 'AL', 'CJ': 'NS',
+    'BK': 'SP', 'CR': 'SP', 'LF': 'SP', 'NL': 'SP',
+}
+
+# Break actions for each pair of classes, with any spaces between them.
+# Each row is the class before, and the columns are the class after, in
+# PAIR_CLASSES order:
+#     _ : Break.
+#     % : Only break if there are spaces between them.
+#     ^ : Never break, even with spaces between them.
+PAIRS = """
+OP  ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^ ^
+CL  _ ^ ^ % % ^ ^ ^ ^ % % _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+CP  _ ^ ^ % % ^ ^ ^ ^ % % % % % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+QU  ^ ^ ^ % % % ^ ^ ^ % % % % % % % % % % % ^ ^ % % % % % % % % %
+GL  % ^ ^ % % % ^ ^ ^ % % % % % % % % % % % ^ ^ % % % % % % % % %
+NS  _ ^ ^ % % % ^ ^ ^ _ _ _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+EX  _ ^ ^ % % % ^ ^ ^ _ _ _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+SY  _ ^ ^ % % % ^ ^ ^ _ _ % _ % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+IS  _ ^ ^ % % % ^ ^ ^ _ _ % % % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+PR  % ^ ^ % % % ^ ^ ^ _ _ % % % % % % % _ _ ^ ^ % % % % % _ % % _
+PO  % ^ ^ % % % ^ ^ ^ _ _ % % % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+NU  % ^ ^ % % % ^ ^ ^ % % % % % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+AL  % ^ ^ % % % ^ ^ ^ % % % % % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+HL  % ^ ^ % % % ^ ^ ^ % % % % % _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+ID  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+IN  _ ^ ^ % % % ^ ^ ^ _ _ _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+HY  _ ^ ^ % _ % ^ ^ ^ _ _ % _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+BA  _ ^ ^ % _ % ^ ^ ^ _ _ _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+BB  % ^ ^ % % % ^ ^ ^ % % % % % % % % % % % ^ ^ % % % % % % % % _
+B2  _ ^ ^ % % % ^ ^ ^ _ _ _ _ _ _ % % % _ ^ ^ ^ _ _ _ _ _ _ _ _ _
+ZW  _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ ^ _ _ _ _ _ _ _ _ _ _
+WJ  % ^ ^ % % % ^ ^ ^ % % % % % % % % % % % ^ ^ % % % % % % % % %
+H2  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ % % _ _ _ _
+H3  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ _ % _ _ _ _
+JL  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ % % % % _ _ _ _ _
+JV  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ % % _ _ _ _
+JT  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ _ % _ _ _ _
+RI  _ ^ ^ % % % ^ ^ ^ _ _ _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ % _ _ _
+EB  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ % _
+EM  _ ^ ^ % % % ^ ^ ^ _ % _ _ _ _ % % % _ _ ^ ^ _ _ _ _ _ _ _ _ _
+CB  _ ^ ^ % % _ ^ ^ ^ _ _ _ _ _ _ _ _ _ _ _ ^ ^ _ _ _ _ _ _ _ _ _
+"""
+
+# Code point ranges for every class but AL, H2, and H3, as
+# `first[-last]:class` in hex.
+RANGES = """
+0-8:CM 9:BA a-d:SP e-1f:CM 20:SP 21:EX 22:QU 24:PR 25:PO 27:QU 28:OP 29:CP
+2b:PR 2c:IS 2d:HY 2e:IS 2f:SY 30-39:NU 3a-3b:IS 3f:EX 5b:OP 5c:PR 5d:CP
+7b:OP 7c:BA 7d:CL 7f-84:CM 85:SP 86-9f:CM a0:GL a1:OP a2:PO a3-a5:PR ab:QU
+ad:BA b0:PO b1:PR b4:BB bb:QU bf:OP 2c8:BB 2cc:BB 2df:BB 300-34e:CM 34f:GL
+350-35b:CM 35c-362:GL 363-36f:CM 37e:IS 483-489:CM 589:IS 58a:BA 58f:PR
+591-5bd:CM 5be:BA 5bf:CM 5c1-5c2:CM 5c4-5c5:CM 5c6:EX 5c7:CM 5d0-5ea:HL
+5ef-5f2:HL 609-60b:PO 60c-60d:IS 610-61a:CM 61b:EX 61c:CM 61d-61f:EX
+64b-65f:CM 660-669:NU 66a:PO 66b-66c:NU 670:CM 6d4:EX 6d6-6dc:CM 6df-6e4:CM
+6e7-6e8:CM 6ea-6ed:CM 6f0-6f9:NU 711:CM 730-74a:CM 7a6-7b0:CM 7c0-7c9:NU
+7eb-7f3:CM 7f8:IS 7f9:EX 7fd:CM 7fe-7ff:PR 816-819:CM 81b-823:CM 825-827:CM
+829-82d:CM 859-85b:CM 898-89f:CM 8ca-8e1:CM 8e3-903:CM 93a-93c:CM 93e-94f:CM
+951-957:CM 962-963:CM 964-965:BA 966-96f:NU 981-983:CM 9bc:CM 9be-9c4:CM
+9c7-9c8:CM 9cb-9cd:CM 9d7:CM 9e2-9e3:CM 9e6-9ef:NU 9f2-9f3:PO 9f9:PO 9fb:PR
+9fe:CM a01-a03:CM a3c:CM a3e-a42:CM a47-a48:CM a4b-a4d:CM a51:CM a66-a6f:NU
+a70-a71:CM a75:CM a81-a83:CM abc:CM abe-ac5:CM ac7-ac9:CM acb-acd:CM
+ae2-ae3:CM ae6-aef:NU af1:PR afa-aff:CM b01-b03:CM b3c:CM b3e-b44:CM
+b47-b48:CM b4b-b4d:CM b55-b57:CM b62-b63:CM b66-b6f:NU b82:CM bbe-bc2:CM
+bc6-bc8:CM bca-bcd:CM bd7:CM be6-bef:NU bf9:PR c00-c04:CM c3c:CM c3e-c44:CM
+c46-c48:CM c4a-c4d:CM c55-c56:CM c62-c63:CM c66-c6f:NU c77:BB c81-c83:CM
+c84:BB cbc:CM cbe-cc4:CM cc6-cc8:CM cca-ccd:CM cd5-cd6:CM ce2-ce3:CM
+ce6-cef:NU d00-d03:CM d3b-d3c:CM d3e-d44:CM d46-d48:CM d4a-d4d:CM d57:CM
+d62-d63:CM d66-d6f:NU d79:PO d81-d83:CM dca:CM dcf-dd4:CM dd6:CM dd8-ddf:CM
+de6-def:NU df2-df3:CM e31:CM e34-e3a:CM e3f:PR e47-e4e:CM e50-e59:NU
+e5a-e5b:BA eb1:CM eb4-ebc:CM ec8-ecd:CM ed0-ed9:NU f01-f04:BB f06-f07:BB
+f08:GL f09-f0a:BB f0b:BA f0c:GL f0d-f11:EX f12:GL f14:EX f18-f19:CM
+f20-f29:NU f34:BA f35:CM f37:CM f39:CM f3a:OP f3b:CL f3c:OP f3d:CL
+f3e-f3f:CM f71-f7e:CM f7f:BA f80-f84:CM f85:BA f86-f87:CM f8d-f97:CM
+f99-fbc:CM fbe-fbf:BA fc6:CM fd0-fd1:BB fd2:BA fd3:BB fd9-fda:GL
+102b-103e:CM 1040-1049:NU 104a-104b:BA 1056-1059:CM 105e-1060:CM
+1062-1064:CM 1067-106d:CM 1071-1074:CM 1082-108d:CM 108f:CM 1090-1099:NU
+109a-109d:CM 1100-115f:JL 1160-11a7:JV 11a8-11ff:JT 135d-135f:CM 1361:BA
+1400:BA 1680:BA 169b:OP 169c:CL 16eb-16ed:BA 1712-1715:CM 1732-1734:CM
+1735-1736:BA 1752-1753:CM 1772-1773:CM 17b4-17d3:CM 17d4-17d5:BA 17d6:NS
+17d8:BA 17da:BA 17db:PR 17dd:CM 17e0-17e9:NU 1802-1803:EX 1804-1805:BA
+1806:BB 1808-1809:EX 180b-180d:CM 180e:GL 180f:CM 1810-1819:NU 1885-1886:CM
+18a9:CM 1920-192b:CM 1930-193b:CM 1944-1945:EX 1946-194f:NU 19d0-19d9:NU
+1a17-1a1b:CM 1a55-1a5e:CM 1a60-1a7c:CM 1a7f:CM 1a80-1a89:NU 1a90-1a99:NU
+1ab0-1ace:CM 1b00-1b04:CM 1b34-1b44:CM 1b50-1b59:NU 1b5a-1b5b:BA
+1b5d-1b60:BA 1b6b-1b73:CM 1b7d-1b7e:BA 1b80-1b82:CM 1ba1-1bad:CM
+1bb0-1bb9:NU 1be6-1bf3:CM 1c24-1c37:CM 1c3b-1c3f:BA 1c40-1c49:NU
+1c50-1c59:NU 1c7e-1c7f:BA 1cd0-1cd2:CM 1cd4-1ce8:CM 1ced:CM 1cf4:CM
+1cf7-1cf9:CM 1dc0-1dff:CM 1ffd:BB 2000-2006:BA 2007:GL 2008-200a:BA 200b:ZW
+200c:CM 200d:ZWJ 200e-200f:CM 2010:BA 2011:GL 2012-2013:BA 2014:B2
+2018-2019:QU 201a:OP 201b-201d:QU 201e:OP 201f:QU 2024-2026:IN 2027:BA
+2028-2029:SP 202a-202e:CM 202f:GL 2030-2037:PO 2039-203a:QU 203c-203d:NS
+2044:IS 2045:OP 2046:CL 2047-2049:NS 2056:BA 2058-205b:BA 205d-205f:BA
+2060:WJ 2066-206f:CM 207d:OP 207e:CL 208d:OP 208e:CL 20a0-20a6:PR 20a7:PO
+20a8-20b5:PR 20b6:PO 20b7-20ba:PR 20bb:PO 20bc-20bd:PR 20be:PO 20bf:PR
+20c0:PO 20c1-20cf:PR 20d0-20f0:CM 2103:PO 2109:PO 2116:PR 2212-2213:PR
+22ef:IN 2308:OP 2309:CL 230a:OP 230b:CL 231a-231b:ID 2329:OP 232a:CL
+23f0-23f3:ID 2600-2603:ID 2614-2615:ID 2618:ID 261a-261c:ID 261d:EB
+261e-261f:ID 2639-263b:ID 2668:ID 267f:ID 26bd-26c8:ID 26cd:ID 26cf-26d1:ID
+26d3-26d4:ID 26d8-26d9:ID 26dc:ID 26df-26e1:ID 26ea:ID 26f1-26f5:ID
+26f7-26f8:ID 26f9:EB 26fa:ID 26fd-2704:ID 2708-2709:ID 270a-270d:EB
+275b-2760:QU 2762-2763:EX 2764:ID 2768:OP 2769:CL 276a:OP 276b:CL 276c:OP
+276d:CL 276e:OP 276f:CL 2770:OP 2771:CL 2772:OP 2773:CL 2774:OP 2775:CL
+27c5:OP 27c6:CL 27e6:OP 27e7:CL 27e8:OP 27e9:CL 27ea:OP 27eb:CL 27ec:OP
+27ed:CL 27ee:OP 27ef:CL 2983:OP 2984:CL 2985:OP 2986:CL 2987:OP 2988:CL
+2989:OP 298a:CL 298b:OP 298c:CL 298d:OP 298e:CL 298f:OP 2990:CL 2991:OP
+2992:CL 2993:OP 2994:CL 2995:OP 2996:CL 2997:OP 2998:CL 29d8:OP 29d9:CL
+29da:OP 29db:CL 29fc:OP 29fd:CL 2cef-2cf1:CM 2cf9:EX 2cfa-2cfc:BA 2cfe:EX
+2cff:BA 2d70:BA 2d7f:CM 2de0-2dff:CM 2e00-2e0d:QU 2e0e-2e15:BA 2e17:BA
+2e18:OP 2e19:BA 2e1c-2e1d:QU 2e20-2e21:QU 2e22:OP 2e23:CL 2e24:OP 2e25:CL
+2e26:OP 2e27:CL 2e28:OP 2e29:CL 2e2a-2e2d:BA 2e2e:EX 2e30-2e31:BA
+2e33-2e34:BA 2e3a-2e3b:B2 2e3c-2e3e:BA 2e40-2e41:BA 2e42:OP 2e43-2e4a:BA
+2e4c:BA 2e4e-2e4f:BA 2e53-2e54:EX 2e55:OP 2e56:CL 2e57:OP 2e58:CL 2e59:OP
+2e5a:CL 2e5b:OP 2e5c:CL 2e5d:BA 2e80-2e99:ID 2e9b-2ef3:ID 2f00-2fd5:ID
+2ff0-2ffb:ID 3000:BA 3001-3002:CL 3003-3004:ID 3005:NS 3006-3007:ID 3008:OP
+3009:CL 300a:OP 300b:CL 300c:OP 300d:CL 300e:OP 300f:CL 3010:OP 3011:CL
+3012-3013:ID 3014:OP 3015:CL 3016:OP 3017:CL 3018:OP 3019:CL 301a:OP 301b:CL
+301c:NS 301d:OP 301e-301f:CL 3020-3029:ID 302a-302f:CM 3030-3034:ID 3035:CM
+3036-303a:ID 303b-303c:NS 303d-303f:ID 3041:NS 3042:ID 3043:NS 3044:ID
+3045:NS 3046:ID 3047:NS 3048:ID 3049:NS 304a-3062:ID 3063:NS 3064-3082:ID
+3083:NS 3084:ID 3085:NS 3086:ID 3087:NS 3088-308d:ID 308e:NS 308f-3094:ID
+3095-3096:NS 3099-309a:CM 309b-309e:NS 309f:ID 30a0-30a1:NS 30a2:ID 30a3:NS
+30a4:ID 30a5:NS 30a6:ID 30a7:NS 30a8:ID 30a9:NS 30aa-30c2:ID 30c3:NS
+30c4-30e2:ID 30e3:NS 30e4:ID 30e5:NS 30e6:ID 30e7:NS 30e8-30ed:ID 30ee:NS
+30ef-30f4:ID 30f5-30f6:NS 30f7-30fa:ID 30fb-30fe:NS 30ff:ID 3105-312f:ID
+3131-318e:ID 3190-31e3:ID 31f0-31ff:NS 3200-321e:ID 3220-3247:ID
+3250-4dbf:ID 4e00-a014:ID a015:NS a016-a48c:ID a490-a4c6:ID a4fe-a4ff:BA
+a60d:BA a60e:EX a60f:BA a620-a629:NU a66f-a672:CM a674-a67d:CM a69e-a69f:CM
+a6f0-a6f1:CM a6f3-a6f7:BA a802:CM a806:CM a80b:CM a823-a827:CM a82c:CM
+a838:PO a874-a875:BB a876-a877:EX a880-a881:CM a8b4-a8c5:CM a8ce-a8cf:BA
+a8d0-a8d9:NU a8e0-a8f1:CM a8fc:BB a8ff:CM a900-a909:NU a926-a92d:CM
+a92e-a92f:BA a947-a953:CM a960-a97c:JL a980-a983:CM a9b3-a9c0:CM
+a9c7-a9c9:BA a9d0-a9d9:NU a9e5:CM a9f0-a9f9:NU aa29-aa36:CM aa43:CM
+aa4c-aa4d:CM aa50-aa59:NU aa5d-aa5f:BA aa7b-aa7d:CM aab0:CM aab2-aab4:CM
+aab7-aab8:CM aabe-aabf:CM aac1:CM aaeb-aaef:CM aaf0-aaf1:BA aaf5-aaf6:CM
+abe3-abea:CM abeb:BA abec-abed:CM abf0-abf9:NU d7b0-d7c6:JV d7cb-d7fb:JT
+f900-faff:ID fb1d:HL fb1e:CM fb1f-fb28:HL fb2a-fb36:HL fb38-fb3c:HL fb3e:HL
+fb40-fb41:HL fb43-fb44:HL fb46-fb4f:HL fd3e:CL fd3f:OP fdfc:PO fe00-fe0f:CM
+fe10:IS fe11-fe12:CL fe13-fe14:IS fe15-fe16:EX fe17:OP fe18:CL fe19:IN
+fe20-fe2f:CM fe30-fe34:ID fe35:OP fe36:CL fe37:OP fe38:CL fe39:OP fe3a:CL
+fe3b:OP fe3c:CL fe3d:OP fe3e:CL fe3f:OP fe40:CL fe41:OP fe42:CL fe43:OP
+fe44:CL fe45-fe46:ID fe47:OP fe48:CL fe49-fe4f:ID fe50:CL fe51:ID fe52:CL
+fe54-fe55:NS fe56-fe57:EX fe58:ID fe59:OP fe5a:CL fe5b:OP fe5c:CL fe5d:OP
+fe5e:CL fe5f-fe66:ID fe68:ID fe69:PR fe6a:PO fe6b:ID feff:WJ ff01:EX
+ff02-ff03:ID ff04:PR ff05:PO ff06-ff07:ID ff08:OP ff09:CL ff0a-ff0b:ID
+ff0c:CL ff0d:ID ff0e:CL ff0f-ff19:ID ff1a-ff1b:NS ff1c-ff1e:ID ff1f:EX
+ff20-ff3a:ID ff3b:OP ff3c:ID ff3d:CL ff3e-ff5a:ID ff5b:OP ff5c:ID ff5d:CL
+ff5e:ID ff5f:OP ff60-ff61:CL ff62:OP ff63-ff64:CL ff65:NS ff66:ID
+ff67-ff70:NS ff71-ff9d:ID ff9e-ff9f:NS ffa0-ffbe:ID ffc2-ffc7:ID
+ffca-ffcf:ID ffd2-ffd7:ID ffda-ffdc:ID ffe0:PO ffe1:PR ffe2-ffe4:ID
+ffe5-ffe6:PR fff9-fffb:CM fffc:CB 10100-10102:BA 101fd:CM 102e0:CM
+10376-1037a:CM 1039f:BA 103d0:BA 104a0-104a9:NU 10857:BA 1091f:BA
+10a01-10a03:CM 10a05-10a06:CM 10a0c-10a0f:CM 10a38-10a3a:CM 10a3f:CM
+10a50-10a57:BA 10ae5-10ae6:CM 10af0-10af5:BA 10af6:IN 10b39-10b3f:BA
+10d24-10d27:CM 10d30-10d39:NU 10eab-10eac:CM 10ead:BA 10f46-10f50:CM
+10f82-10f85:CM 11000-11002:CM 11038-11046:CM 11047-11048:BA 11066-1106f:NU
+11070:CM 11073-11074:CM 1107f-11082:CM 110b0-110ba:CM 110be-110c1:BA
+110c2:CM 110f0-110f9:NU 11100-11102:CM 11127-11134:CM 11136-1113f:NU
+11140-11143:BA 11145-11146:CM 11173:CM 11175:BB 11180-11182:CM
+111b3-111c0:CM 111c5-111c6:BA 111c8:BA 111c9-111cc:CM 111ce-111cf:CM
+111d0-111d9:NU 111db:BB 111dd-111df:BA 1122c-11237:CM 11238-11239:BA
+1123b-1123c:BA 1123e:CM 112a9:BA 112df-112ea:CM 112f0-112f9:NU
+11300-11303:CM 1133b-1133c:CM 1133e-11344:CM 11347-11348:CM 1134b-1134d:CM
+11357:CM 11362-11363:CM 11366-1136c:CM 11370-11374:CM 11435-11446:CM
+1144b-1144e:BA 11450-11459:NU 1145a-1145b:BA 1145e:CM 114b0-114c3:CM
+114d0-114d9:NU 115af-115b5:CM 115b8-115c0:CM 115c1:BB 115c2-115c3:BA
+115c4-115c5:EX 115c9-115d7:BA 115dc-115dd:CM 11630-11640:CM 11641-11642:BA
+11650-11659:NU 11660-1166c:BB 116ab-116b7:CM 116c0-116c9:NU 1171d-1172b:CM
+11730-11739:NU 1173c-1173e:BA 1182c-1183a:CM 118e0-118e9:NU 11930-11935:CM
+11937-11938:CM 1193b-1193e:CM 11940:CM 11942-11943:CM 11944-11946:BA
+11950-11959:NU 119d1-119d7:CM 119da-119e0:CM 119e2:BB 119e4:CM
+11a01-11a0a:CM 11a33-11a39:CM 11a3b-11a3e:CM 11a3f:BB 11a41-11a44:BA
+11a45:BB 11a47:CM 11a51-11a5b:CM 11a8a-11a99:CM 11a9a-11a9c:BA
+11a9e-11aa0:BB 11aa1-11aa2:BA 11c2f-11c36:CM 11c38-11c3f:CM 11c41-11c45:BA
+11c50-11c59:NU 11c70:BB 11c71:EX 11c92-11ca7:CM 11ca9-11cb6:CM
+11d31-11d36:CM 11d3a:CM 11d3c-11d3d:CM 11d3f-11d45:CM 11d47:CM
+11d50-11d59:NU 11d8a-11d8e:CM 11d90-11d91:CM 11d93-11d97:CM 11da0-11da9:NU
+11ef3-11ef6:CM 11fdd-11fe0:PO 11fff:BA 12470-12474:BA 13258-1325a:OP
+1325b-1325d:CL 13282:CL 13286:OP 13287:CL 13288:OP 13289:CL 13379:OP
+1337a-1337b:CL 13430-13436:GL 13437:OP 13438:CL 145ce:OP 145cf:CL
+16a60-16a69:NU 16a6e-16a6f:BA 16ac0-16ac9:NU 16af0-16af4:CM 16af5:BA
+16b30-16b36:CM 16b37-16b39:BA 16b44:BA 16b50-16b59:NU 16e97-16e98:BA
+16f4f:CM 16f51-16f87:CM 16f8f-16f92:CM 16fe0-16fe3:NS 16fe4:GL
+16ff0-16ff1:CM 17000-187f7:ID 18800-18aff:ID 18d00-18d08:ID 1b000-1b122:ID
+1b150-1b152:NS 1b164-1b167:NS 1b170-1b2fb:ID 1bc9d-1bc9e:CM 1bc9f:BA
+1bca0-1bca3:CM 1cf00-1cf2d:CM 1cf30-1cf46:CM 1d165-1d169:CM 1d16d-1d182:CM
+1d185-1d18b:CM 1d1aa-1d1ad:CM 1d242-1d244:CM 1d7ce-1d7ff:NU 1da00-1da36:CM
+1da3b-1da6c:CM 1da75:CM 1da84:CM 1da87-1da8a:BA 1da9b-1da9f:CM
+1daa1-1daaf:CM 1e000-1e006:CM 1e008-1e018:CM 1e01b-1e021:CM 1e023-1e024:CM
+1e026-1e02a:CM 1e130-1e136:CM 1e140-1e149:NU 1e2ae:CM 1e2ec-1e2ef:CM
+1e2f0-1e2f9:NU 1e2ff:PR 1e8d0-1e8d6:CM 1e944-1e94a:CM 1e950-1e959:NU
+1e95e-1e95f:OP 1ecac:PO 1ecb0:PO 1f000-1f0ff:ID 1f10d-1f10f:ID
+1f16d-1f16f:ID 1f1ad-1f1e5:ID 1f1e6-1f1ff:RI 1f200-1f384:ID 1f385:EB
+1f386-1f39b:ID 1f39e-1f3b4:ID 1f3b7-1f3bb:ID 1f3bd-1f3c1:ID 1f3c2-1f3c4:EB
+1f3c5-1f3c6:ID 1f3c7:EB 1f3c8-1f3c9:ID 1f3ca-1f3cc:EB 1f3cd-1f3fa:ID
+1f3fb-1f3ff:EM 1f400-1f441:ID 1f442-1f443:EB 1f444-1f445:ID 1f446-1f450:EB
+1f451-1f465:ID 1f466-1f478:EB 1f479-1f47b:ID 1f47c:EB 1f47d-1f480:ID
+1f481-1f483:EB 1f484:ID 1f485-1f487:EB 1f488-1f48e:ID 1f48f:EB 1f490:ID
+1f491:EB 1f492-1f49f:ID 1f4a1:ID 1f4a3:ID 1f4a5-1f4a9:ID 1f4aa:EB
+1f4ab-1f4ae:ID 1f4b0:ID 1f4b3-1f4ff:ID 1f507-1f516:ID 1f525-1f531:ID
+1f54a-1f573:ID 1f574-1f575:EB 1f576-1f579:ID 1f57a:EB 1f57b-1f58f:ID
+1f590:EB 1f591-1f594:ID 1f595-1f596:EB 1f597-1f5d3:ID 1f5dc-1f5f3:ID
+1f5fa-1f644:ID 1f645-1f647:EB 1f648-1f64a:ID 1f64b-1f64f:EB 1f676-1f678:QU
+1f679-1f67b:NS 1f680-1f6a2:ID 1f6a3:EB 1f6a4-1f6b3:ID 1f6b4-1f6b6:EB
+1f6b7-1f6bf:ID 1f6c0:EB 1f6c1-1f6cb:ID 1f6cc:EB 1f6cd-1f6ff:ID
+1f774-1f77f:ID 1f7d5-1f7ff:ID 1f80c-1f80f:ID 1f848-1f84f:ID 1f85a-1f85f:ID
+1f888-1f88f:ID 1f8ae-1f8ff:ID 1f90c:EB 1f90d-1f90e:ID 1f90f:EB
+1f910-1f917:ID 1f918-1f91f:EB 1f920-1f925:ID 1f926:EB 1f927-1f92f:ID
+1f930-1f939:EB 1f93a-1f93b:ID 1f93c-1f93e:EB 1f93f-1f976:ID 1f977:EB
+1f978-1f9b4:ID 1f9b5-1f9b6:EB 1f9b7:ID 1f9b8-1f9b9:EB 1f9ba:ID 1f9bb:EB
+1f9bc-1f9cc:ID 1f9cd-1f9cf:EB 1f9d0:ID 1f9d1-1f9dd:EB 1f9de-1f9ff:ID
+1fa54-1fac2:ID 1fac3-1fac5:EB 1fac6-1faef:ID 1faf0-1faf6:EB 1faf7-1faff:ID
+1fbf0-1fbf9:NU 1fc00-1fffd:ID 20000-2fffd:ID 30000-3fffd:ID e0001:CM
+e0020-e007f:CM e0100-e01ef:CM
+"""
+
+# Class ids used by iter_breaks().
+(
+    _OP, _CL, _CP, _QU, _GL, _NS, _EX, _SY, _IS, _PR, _PO, _NU, _AL, _HL,
+    _ID, _IN, _HY, _BA, _BB, _B2, _ZW, _WJ, _H2, _H3, _JL, _JV, _JT, _RI,
+    _EB, _EM, _CB, _CM, _ZWJ, _SP,
+) = range(len(CLASSES))
+
+# Used to find runs that can't have breaks in them (ASCII letters,
+# digits, or spaces), or single characters.
+_runpat = re.compile(
+    r'([A-Za-z]+)|([0-9]+)|([ \n\r\x0b\x0c\x85\u2028\u2029]+)|.',
+    re.DOTALL,
+)
+
+
+def _is_hangul(codepoint: int) -> bool:
+    """ Returns True for Hangul syllables, which are H2 or H3. """
+    return 0xac00 <= codepoint <= 0xd7a3
+
+
+def _parse_pairs(data: str) -> Tuple[bytes, ...]:
+    """ Parse PAIRS into a tuple of rows (bytes), indexed by class id. """
+    rows = {}
+    for line in data.strip('\n').splitlines():
+        name, *actions = line.split()
+        if len(actions) != len(PAIR_CLASSES):
+            raise ValueError('Wrong number of PAIRS columns: {}'.format(
+                name,
+            ))
+        rows[name] = ''.join(actions).encode('ascii')
+    return tuple(rows[name] for name in PAIR_CLASSES)
+
+
+def _parse_ranges(data: str) -> Tuple[array, array, array]:
+    """ Parse RANGES into arrays for bisect: first and last code points of
+        each range, and the class id of its characters.
+    """
+    firsts = array('L')
+    lasts = array('L')
+    classes = array('B')
+    for token in data.split():
+        span, _, name = token.partition(':')
+        first, _, last = span.partition('-')
+        firsts.append(int(first, 16))
+        lasts.append(int(last or first, 16))
+        classes.append(CLASSES.index(name))
+    return firsts, lasts, classes
+
+
+_pairs = _parse_pairs(PAIRS)
+_firsts, _lasts, _classes = _parse_ranges(RANGES)
+# Actions, as bytes.
+_BREAK = ord('_')
+_INDIRECT = ord('%')
+
+
+def build_ranges(lines: Iterable[str]) -> List[Tuple[int, int, str]]:
+    """ Build the (first, last, class) ranges for RANGES from the lines of
+        LineBreak.txt (in the Unicode Character Database).
+        Classes are resolved (see RESOLVED), and code points missing from
+        the file are AL.
+    """
+    import unicodedata
+    ranges = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        span, name = (s.strip() for s in line.split(';'))
+        first, _, last = span.partition('..')
+        first = int(first, 16)
+        last = int(last, 16) if last else first
+        for codepoint in range(first, last + 1):
+            if name == 'SA':
+                category = unicodedata.category(chr(codepoint))
+                resolved = 'CM' if category in ('Mn', 'Mc') else 'AL'
+            else:
+                resolved = RESOLVED.get(name, name)
+            if (resolved == 'AL') or _is_hangul(codepoint):
+                # The defaults, and H2/H3, aren't in the table.
+                continue
+            if ranges and (ranges[-1][1] == codepoint - 1) and (
+                    ranges[-1][2] == resolved):
+                ranges[-1] = (ranges[-1][0], codepoint, resolved)
+            else:
+                ranges.append((codepoint, codepoint, resolved))
+    ranges.sort()
+    return ranges
+
+
+def format_ranges(ranges: Iterable[Tuple[int, int, str]]) -> str:
+    """ Return the source for a new RANGES string, from build_ranges(). """
+    lines = ['RANGES = """']
+    line = ''
+    for first, last, name in ranges:
+        if first == last:
+            token = '{:x}:{}'.format(first, name)
+        else:
+            token = '{:x}-{:x}:{}'.format(first, last, name)
+        if len(line) + len(token) + 1 > 76:
+            lines.append(line)
+            line = ''
+        line = '{} {}'.format(line, token) if line else token
+    if line:
+        lines.append(line)
+    lines.append('"""')
+    return '\n'.join(lines)
+
+
+def get_class(char: str) -> str:
+    """ Return the (resolved) line breaking class of a character. """
+    return CLASSES[get_class_id(char)]
+
+
+def get_class_id(char: str) -> int:
+    """ Return the line breaking class of a character, as an index into
+        CLASSES.
+    """
+    codepoint = ord(char)
+    if 0xac00 <= codepoint <= 0xd7a3:
+        # Hangul syllables, LV (H2) starts every run of 28.
+        return _H3 if (codepoint - 0xac00) % 28 else _H2
+    i = bisect_right(_firsts, codepoint) - 1
+    if (i >= 0) and (codepoint <= _lasts[i]):
+        return _classes[i]
+    return _AL
+
+
+def iter_breaks(text: str) -> Iterator[int]:
+    """ Yield each offset in `text` where a line can start (a break
+        before the character at that offset), in order. Spaces before a
+        break stay on the line before it. The start and end of `text` are
+        never yielded.
+    """
+    pairs = _pairs
+    getid = get_class_id
+    # Class of the last character that wasn't a space.
+    before = None
+    # Whether there were spaces after `before`.
+    spaces = False
+    # Whether `before` was a ZWJ (rule LB8a), or HY/BA after HL (LB21a).
+    glued = False
+    # Regional indicators in a row (LB30a).
+    flags = 0
+    for match in _runpat.finditer(text):
+        kind = match.lastindex
+        if kind == 3:
+            spaces = before is not None
+            continue
+        if kind == 1:
+            cur = _AL
+        elif kind == 2:
+            cur = _NU
+        else:
+            cur = getid(match.group())
+            if cur == _SP:
+                # Other spaces, and mandatory breaks.
+                spaces = before is not None
+                continue
+        joiner = cur == _ZWJ
+        if (cur == _CM) or joiner:
+            if (before is not None) and not (spaces or before == _ZW):
+                # Part of the character before it (LB9).
+                glued = glued or joiner
+                continue
+            # Marks without a character are letters (LB10).
+            cur = _AL
+        if before is None:
+            before = cur
+            glued = joiner
+            flags = int(cur == _RI)
+            continue
+        if glued and not spaces:
+            pass
+        elif (cur == _RI) and (before == _RI) and not spaces:
+            # Flags are pairs of regional indicators.
+            if not flags % 2:
+                yield match.start()
+        else:
+            action = pairs[before][cur]
+            if (action == _BREAK) or (spaces and action == _INDIRECT):
+                yield match.start()
+        glued = joiner or (
+            (cur in (_HY, _BA)) and (before == _HL) and not spaces
+        )
+        if cur == _RI:
+            flags = flags + 1 if (before == _RI) and not spaces else 1
+        before = cur
+        spaces = False
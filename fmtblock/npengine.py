@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+""" FormatBlock - NumPy Engine
+    Vectorized greedy line breaking for large, plain ASCII text.
+    This engine is only used when NumPy is installed, and only for text
+    that has no escape codes and no non-ASCII characters.
+    Its output is identical to FormatBlock.iter_space_block().
+    Text is wrapped a chunk at a time, so memory use doesn't grow with the
+    size of the text.
+"""
+
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    Tuple,
+)
+
+from importlib.util import find_spec
+
+# NumPy is imported the first time this engine is used, so it doesn't slow
+# down startup for everything else.
+numpy = None
+HAS_NUMPY = find_spec('numpy') is not None
+
+# Texts shorter than this are faster in the pure-python loop, because of
+# the overhead of building the arrays.
+MIN_LENGTH = 65536
+# Number of characters wrapped at a time, so the arrays (and the Python
+# values built from them) stay small, no matter how large the text is.
+CHUNK_SIZE = 1024 * 1024
+
+# Characters that str.split() treats as whitespace, for ASCII text.
+WHITESPACE = b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f '
+
+# Lookup table of whitespace bytes, built when NumPy is loaded.
+_spacetable = None
+
+
+def accepts(text: str) -> bool:
+    """ Returns True if `text` can (and should) be handled by this engine.
+        Text with escape codes or non-ASCII characters is never accepted.
+    """
+    return (
+        HAS_NUMPY and
+        (len(text) >= MIN_LENGTH) and
+        ('\x1b' not in text) and
+        text.isascii()
+    )
+
+
+def load_numpy():
+    """ Import NumPy and build the lookup tables, if not done already.
+        Returns the numpy module, or None if it is not installed.
+    """
+    global numpy, _spacetable
+    if (numpy is None) and HAS_NUMPY:
+        import numpy as np
+        spacetable = np.zeros(256, dtype=np.bool_)
+        spacetable[list(WHITESPACE)] = True
+        _spacetable = spacetable
+        numpy = np
+    return numpy
+
+
+def iter_space_block(
+        text: str,
+        width: int = 60,
+        fmtfunc: Callable[[str], Any] = str) -> Iterator[Any]:
+    """ Format block by wrapping on spaces, like
+        FormatBlock.iter_space_block(), using NumPy arrays for the word
+        lengths and line offsets.
+        `text` must be ASCII without escape codes (see `accepts()`).
+    """
+    for info in iter_space_lines(text, width=width):
+        yield fmtfunc(info[0])
+
+
+def iter_space_lines(
+        text: str,
+        width: int = 60) -> Iterator[Tuple[str, int, int, int, int]]:
+    """ Like core.iter_space_lines(), yielding a tuple of
+        (line, start, end, words, linewidth) for each line.
+        `text` must be ASCII without escape codes (see `accepts()`).
+    """
+    for start, end, words, linewidth, clean in iter_space_spans(
+            text, width=width):
+        line = text[start:end]
+        yield (
+            line if clean else ' '.join(line.split()),
+            start,
+            end,
+            words,
+            linewidth,
+        )
+
+
+def iter_space_spans(
+        text: str,
+        width: int = 60) -> Iterator[Tuple[int, int, int, int, bool]]:
+    """ Like core.iter_space_spans(), yielding a tuple of
+        (start, end, words, linewidth, clean) for each line, without
+        creating any line strings.
+        `text` must be ASCII without escape codes (see `accepts()`).
+    """
+    if load_numpy() is None:
+        raise RuntimeError('NumPy is not installed.')
+    if width < 1:
+        width = 1
+    length = len(text)
+    # Start of the next line, always at a word (or the start of the text).
+    pos = 0
+    size = CHUNK_SIZE
+    first = True
+    while pos < length:
+        stop = min(pos + size, length)
+        final = stop >= length
+        data = numpy.frombuffer(
+            text[pos:stop].encode('ascii'),
+            dtype=numpy.uint8,
+        )
+        # Pad with whitespace so every word has a start and an end edge.
+        inword = numpy.zeros(len(data) + 2, dtype=numpy.int8)
+        inword[1:-1] = ~_spacetable[data]
+        edges = numpy.diff(inword)
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
+        wordcount = len(starts)
+        if not wordcount:
+            pos = stop
+            continue
+        lengths = ends - starts
+        # offsets[j] - offsets[i] - 1 is the width of words i..j-1 joined by
+        # single spaces.
+        offsets = numpy.zeros(wordcount + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths + 1, out=offsets[1:])
+        # The end (exclusive) of the line that starts with each word.
+        # A line always holds at least one word, even when it is too long.
+        lineends = numpy.searchsorted(
+            offsets,
+            offsets[:-1] + (width + 1),
+            side='right',
+        ) - 1
+        numpy.maximum(
+            lineends,
+            numpy.arange(1, wordcount + 1),
+            out=lineends,
+        )
+        # Walk the greedy chain of line starts. The last word of a chunk
+        # might be cut off, so a line is only final when it ends before it.
+        # The rest is wrapped with the next chunk.
+        chain = []
+        nextends = lineends.tolist()
+        i = 0
+        while i < wordcount:
+            j = nextends[i]
+            if (j >= wordcount) and not final:
+                break
+            chain.append(i)
+            i = j
+        del nextends
+        if not chain:
+            # Not even one line fits in the chunk.
+            size *= 2
+            continue
+        if first:
+            first = False
+            if lengths[0] > width:
+                # The pure-python version yields an empty line before an
+                # overlong first word.
+                yield pos + int(starts[0]), pos + int(starts[0]), 0, 0, True
+        # Lines can be sliced straight out of `text` when every gap between
+        # their words is a single space. Count the gaps that are not.
+        gaps = starts[1:] - ends[:-1]
+        dirty = (gaps != 1) | (data[ends[:-1]] != 32)
+        dirtycounts = numpy.zeros(wordcount, dtype=numpy.int64)
+        numpy.cumsum(dirty, out=dirtycounts[1:])
+        # Python values are only built for each line.
+        linestarts = numpy.array(chain, dtype=numpy.int64)
+        lineends = lineends[linestarts]
+        yield from zip(
+            (starts[linestarts] + pos).tolist(),
+            (ends[lineends - 1] + pos).tolist(),
+            (lineends - linestarts).tolist(),
+            (offsets[lineends] - offsets[linestarts] - 1).tolist(),
+            (dirtycounts[lineends - 1] == dirtycounts[linestarts]).tolist(),
+        )
+        if i >= wordcount:
+            return None
+        pos += int(starts[i])
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+""" FormatBlock - Parallel Engine
+    Speculative parallel greedy line breaking, for one huge paragraph.
+
+    Greedy wrapping is sequential, because each line starts where the last
+    one ended. But it has no other memory: once two wrappings start a line
+    at the same word, every line after that is the same.
+    So the text is split into shards at word boundaries, and each shard is
+    wrapped in a process pool as if it started a fresh line. Then the shard
+    boundaries are fixed up, in order: the real wrapping is continued from
+    the last line of the previous shard, until it starts a line where the
+    shard's speculative wrapping did (usually within a line or two), and
+    the rest of the shard's lines are used as they are.
+    Its output is identical to FormatBlock.iter_space_block().
+
+    The workers only return line offsets, but the shards still have to be
+    sent to them, so this is only worth it for large text, with more than
+    one CPU.
+
+    Example:
+        with ProcessPoolExecutor() as executor:
+            for line in iter_space_block(text, width=80, executor=executor):
+                print(line)
+"""
+
+import os
+import re
+from array import array
+from bisect import bisect_left
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from . import core
+
+# Texts shorter than this are faster in one process, because of the
+# overhead of sending the shards to the workers.
+MIN_LENGTH = 4 * 1024 * 1024
+
+# Used to find the start of the next word, after a whitespace character.
+_nextwordpat = re.compile(r'\s(?=\S)')
+# Used to find the start of the first word.
+_wordpat = re.compile(r'\S')
+
+
+def accepts(text: str, jobs: Optional[int] = None) -> bool:
+    """ Returns True if `text` should be wrapped by this engine, with `jobs`
+        worker processes (or one per CPU).
+    """
+    return (len(text) >= MIN_LENGTH) and ((jobs or os.cpu_count() or 1) > 1)
+
+
+def get_shards(text: str, count: int) -> List[int]:
+    """ Return the start offset of each shard, when splitting `text` into
+        about `count` shards of the same size. Every shard but the first
+        starts at a word, after whitespace. The first shard always has the
+        first word.
+    """
+    starts = [0]
+    match = _wordpat.search(text)
+    if match is None:
+        return starts
+    first = match.start()
+    for i in range(1, max(count, 1)):
+        match = _nextwordpat.search(
+            text,
+            max(len(text) * i // count - 1, first),
+        )
+        if match is None:
+            break
+        start = match.end()
+        if start > starts[-1]:
+            starts.append(start)
+    return starts
+
+
+def iter_fixed_spans(
+        text: str,
+        starts: List[int],
+        results: Iterator[array],
+        width: int = 60) -> Iterator[Tuple[int, int, int, int, bool]]:
+    """ Yield the real spans for `text`, from the speculative spans of each
+        shard (from wrap_shard(), in order), fixing up the lines at each
+        shard boundary.
+    """
+    # Start of the next line that isn't final yet.
+    resume = None
+    for shardstart, spans in zip(starts, results):
+        count = len(spans) // 5
+        if not count:
+            continue
+        spanstarts = spans[::5]
+        first = 0
+        if resume is not None:
+            # Continue the real wrapping until it starts a line where the
+            # shard did.
+            first = None
+            for span in iter_rewrap_spans(text, resume, width=width):
+                index = bisect_left(spanstarts, span[0] - shardstart)
+                if index >= count:
+                    # Past the shard, the next one might match.
+                    resume = span[0]
+                    break
+                if spanstarts[index] + shardstart == span[0]:
+                    first = index
+                    break
+                yield span
+            else:
+                # Wrapped to the end of the text.
+                return None
+            if first is None:
+                continue
+        # The last line might have more words from the next shard.
+        for i in range(first * 5, (count - 1) * 5, 5):
+            yield (
+                shardstart + spans[i],
+                shardstart + spans[i + 1],
+                spans[i + 2],
+                spans[i + 3],
+                bool(spans[i + 4]),
+            )
+        resume = shardstart + spanstarts[-1]
+    if resume is not None:
+        yield from iter_rewrap_spans(text, resume, width=width)
+
+
+def iter_rewrap_spans(
+        text: str,
+        start: int,
+        width: int = 60) -> Iterator[Tuple[int, int, int, int, bool]]:
+    """ Yield the real spans (see core.iter_space_spans()) from `start`, a
+        line start after the beginning of `text`, to the end of `text`.
+        Windows of `text` are wrapped at a time. Every line but the last
+        one in a window is final, because it ended before a word that was
+        complete.
+    """
+    size = max(width * 64, 4096)
+    length = len(text)
+    while start < length:
+        stop = start + size
+        spans = [
+            span for span in core.iter_space_spans(
+                text[start:stop],
+                width=width,
+            )
+            if span[2]
+        ]
+        if stop >= length:
+            last = len(spans)
+        elif len(spans) < 2:
+            # One line (or less) doesn't say where the next one starts.
+            size *= 2
+            continue
+        else:
+            last = len(spans) - 1
+        for spanstart, spanend, words, linewidth, clean in spans[:last]:
+            yield (
+                start + spanstart,
+                start + spanend,
+                words,
+                linewidth,
+                clean,
+            )
+        if last == len(spans):
+            return None
+        start += spans[last][0]
+
+
+def iter_space_block(
+        text: str,
+        width: int = 60,
+        fmtfunc: Callable[[str], Any] = str,
+        jobs: Optional[int] = None,
+        executor: Optional[Executor] = None) -> Iterator[Any]:
+    """ Format block by wrapping on spaces, like
+        FormatBlock.iter_space_block(), wrapping shards of `text` in
+        worker processes.
+        Arguments:
+            See iter_space_spans().
+    """
+    for info in iter_space_lines(
+            text, width=width, jobs=jobs, executor=executor):
+        yield fmtfunc(info[0])
+
+
+def iter_space_lines(
+        text: str,
+        width: int = 60,
+        jobs: Optional[int] = None,
+        executor: Optional[Executor] = None) -> Iterator[
+            Tuple[str, int, int, int, int]]:
+    """ Like core.iter_space_lines(), yielding a tuple of
+        (line, start, end, words, linewidth) for each line.
+        Arguments:
+            See iter_space_spans().
+    """
+    text = text or ''
+    return core.iter_space_lines(
+        text,
+        width=width,
+        spans=iter_space_spans(
+            text,
+            width=width,
+            jobs=jobs,
+            executor=executor,
+        ),
+    )
+
+
+def iter_space_spans(
+        text: str,
+        width: int = 60,
+        jobs: Optional[int] = None,
+        executor: Optional[Executor] = None) -> Iterator[
+            Tuple[int, int, int, int, bool]]:
+    """ Like core.iter_space_spans(), yielding a tuple of
+        (start, end, words, linewidth, clean) for each line, without
+        creating any line strings.
+        Arguments:
+            text      : Text to wrap.
+            width     : Maximum width for each line.
+            jobs      : Number of shards (and worker processes, when a new
+                        pool is started). Default: os.cpu_count()
+            executor  : A concurrent.futures Executor to wrap the shards
+                        in. A ProcessPoolExecutor is started (and shut
+                        down) for each call when not given.
+    """
+    text = text or ''
+    if width < 1:
+        width = 1
+    jobs = jobs or os.cpu_count() or 1
+    starts = get_shards(text, jobs)
+    if len(starts) < 2:
+        yield from core.iter_space_spans(text, width=width)
+        return None
+    stops = starts[1:] + [len(text)]
+    args = (
+        (text[start:stop] for start, stop in zip(starts, stops)),
+        [width] * len(starts),
+        [True] + [False] * (len(starts) - 1),
+    )
+    if executor is not None:
+        yield from iter_fixed_spans(
+            text,
+            starts,
+            executor.map(wrap_shard, *args),
+            width=width,
+        )
+        return None
+    with ProcessPoolExecutor(max_workers=len(starts)) as executor:
+        yield from iter_fixed_spans(
+            text,
+            starts,
+            executor.map(wrap_shard, *args),
+            width=width,
+        )
+
+
+def wrap_shard(text: str, width: int = 60, first: bool = False) -> array:
+    """ Wrap a shard of text, as if it started a fresh line, in a worker
+        process. Returns the spans (see core.iter_space_spans()) as one
+        flat array of (start, end, words, linewidth, clean) values.
+        The empty line before an overlong first word is only kept for the
+        `first` shard.
+    """
+    spans = array('q')
+    for span in core.iter_space_spans(text, width=width):
+        if span[2] or first:
+            spans.extend(span)
+    return spans
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+""" FormatBlock - Pipeline
+    Composable formatting stages.
+    Each stage is a callable that takes an iterable and returns an iterator.
+    The first stage receives the text, the `break_lines()` stage turns text
+    into LineRecords, and the `output()` stage turns records into strings.
+    Stages in between pass the same LineRecords along, updating them.
+
+    Example:
+        pipeline = Pipeline(
+            tokenize(),
+            break_lines(width=20),
+            justify(width=20),
+            decorate(prepend='> '),
+            output(),
+        )
+        for line in pipeline.iter_lines(text):
+            print(line)
+"""
+
+import re
+from contextvars import ContextVar
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+)
+
+from . import core
+from .escapecodes import strip_codes
+from .tokens import Tokens
+from .widths import get_width as get_display_width
+
+Stage = Callable[[Iterable[Any]], Iterator[Any]]
+
+# The stage wrapper for pipelines without their own, in the current thread
+# (or context), while it's set (see fmtblock.profiler).
+current_stage_wrapper = ContextVar('current_stage_wrapper', default=None)
+
+# Used to end a text prefix on whitespace, without cutting a word.
+_spacepat = re.compile(r'\s')
+
+# Default format for line numbers, used by the output() stage.
+NUMBER_FORMAT = '{: >3}: '
+
+
+class LineRecord(object):
+    """ A single line passed between pipeline stages.
+        Attributes:
+            text    : The line's content, without decoration.
+            width   : Visible width of `text` (escape codes not counted).
+            start   : Offset of the line's first character in the source
+                      text, or None if unknown.
+            end     : Offset just past the line's last character in the
+                      source text, or None if unknown.
+            words   : Number of words in the line, or None if unknown.
+            prepend : Text to prepend when rendering, or None.
+            append  : Text to append when rendering, or None.
+            number  : Line number, or None when not numbering.
+    """
+    __slots__ = (
+        'text', 'width', 'start', 'end', 'words',
+        'prepend', 'append', 'number',
+    )
+
+    def __init__(
+            self, text, width=None, start=None, end=None, words=None,
+            prepend=None, append=None):
+        self.text = text
+        if width is None:
+            width = get_width(text)
+        self.width = width
+        self.start = start
+        self.end = end
+        self.words = words
+        self.prepend = prepend
+        self.append = append
+        self.number = None
+
+    def __repr__(self):
+        return '{}({!r}, width={}, start={}, end={}, words={})'.format(
+            type(self).__name__,
+            self.text,
+            self.width,
+            self.start,
+            self.end,
+            self.words,
+        )
+
+    def render(self, numfmt=NUMBER_FORMAT):
+        """ Return the decorated line, as a string. """
+        text = self.text
+        if self.prepend:
+            text = self.prepend + text
+        if self.append:
+            text = text + self.append
+        if self.number is not None:
+            text = numfmt.format(self.number) + text
+        return text
+
+
+class Pipeline(object):
+    """ A chain of formatting stages. See the module docs. """
+    __slots__ = ('stages', 'stage_wrapper')
+
+    def __init__(
+            self, *stages: Stage,
+            stage_wrapper: Optional[Callable[[Stage], Stage]] = None):
+        self.stages = list(stages)
+        # When set, every stage is passed through this before it runs, and
+        # the stage it returns is used instead (see fmtblock.profiler).
+        # Otherwise, `current_stage_wrapper` is used.
+        self.stage_wrapper = stage_wrapper
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join(
+                getattr(stage, '__qualname__', repr(stage)).split('.')[0]
+                for stage in self.stages
+            ),
+        )
+
+    @classmethod
+    def preset_block(
+            cls, width=60, chars=False, newlines=False, lstrip=False,
+            shrink=False, paragraphs=False, max_lines=None, marker=None,
+            tokens=None, uax14=False, overlong=None):
+        """ Pipeline for FormatBlock.iter_block().
+            `tokens` must be a Tokens for the text it runs on, if given.
+        """
+        stages = [
+            tokenize(chars=chars, newlines=newlines, paragraphs=paragraphs),
+            break_lines(
+                width=width,
+                chars=chars,
+                lstrip=lstrip,
+                shrink=shrink,
+                uax14=uax14,
+                overlong=overlong,
+                max_lines=None if max_lines is None else max_lines + 1,
+                tokens=tokens,
+            ),
+        ]
+        if max_lines is not None:
+            stages.append(limit(max_lines, marker=marker))
+        stages.append(output())
+        return cls(*stages)
+
+    @classmethod
+    def preset_format_block(
+            cls, width=60, chars=False, fill=False, newlines=False,
+            append=None, prepend=None, strip_first=False, strip_last=False,
+            lstrip=False, shrink=False, paragraphs=False, max_lines=None,
+            marker=None, continuation=None, enumerate_lines=False,
+            records=False, tokens=None, uax14=False, overlong=None):
+        """ Pipeline for FormatBlock.iter_format_block().
+            If `continuation` is set, it is prepended to every line after
+            the first, instead of `prepend`.
+            If `enumerate_lines` is truthy, line numbers are added like the
+            command-line --enumerate option.
+            If `records` is truthy, the pipeline yields LineRecords instead
+            of strings (see FormatBlock.iter_records()).
+            `tokens` must be a Tokens for the text it runs on, if given.
+        """
+        if fill:
+            chars = False
+        stages = [
+            tokenize(chars=chars, newlines=newlines, paragraphs=paragraphs),
+            break_lines(
+                width=width,
+                chars=chars,
+                lstrip=lstrip,
+                shrink=shrink,
+                uax14=uax14,
+                overlong=overlong,
+                # One extra line, to know whether there are more.
+                max_lines=None if max_lines is None else max_lines + 1,
+                tokens=tokens,
+            ),
+        ]
+        if fill:
+            stages.append(justify(width=width))
+        if max_lines is not None:
+            stages.append(limit(max_lines, marker=marker))
+        if prepend or append or continuation:
+            stages.append(decorate(
+                prepend=prepend,
+                append=append,
+                strip_first=strip_first,
+                strip_last=strip_last,
+                continuation=continuation,
+            ))
+        if enumerate_lines:
+            stages.append(number())
+        if not records:
+            stages.append(output())
+        return cls(*stages)
+
+    def iter_lines(self, text: str) -> Iterator[Any]:
+        """ Run `text` through all stages, returning an iterator of the
+            final output. The stages are lazy, so no work is done until
+            it is used.
+        """
+        wrapper = self.stage_wrapper
+        if wrapper is None:
+            wrapper = current_stage_wrapper.get()
+        items = text
+        for stage in self.stages:
+            if wrapper is not None:
+                stage = wrapper(stage)
+            items = stage(items)
+        return iter(items)
+
+    def run(self, text: str) -> str:
+        """ Run `text` through all stages, and join the output lines. """
+        return '\n'.join(self.iter_lines(text))
+
+
+def break_lines(
+        width: int = 60, chars: bool = False, lstrip: bool = False,
+        shrink: bool = False, max_lines: Optional[int] = None,
+        tokens: Optional[Tokens] = None, uax14: bool = False,
+        overlong: Optional[str] = None) -> Stage:
+    """ Stage that wraps (offset, segment) tuples from tokenize() into
+        LineRecords, on spaces or characters (or, with `uax14`, at Unicode
+        line break opportunities, see core.iter_uax14_spans()).
+        The records' source offsets, word counts and widths all come from
+        the wrapping engine.
+        A None segment (a blank line from `paragraphs` mode) becomes an
+        empty LineRecord.
+        With `max_lines`, no more than that many records are made, and
+        only as much of each segment is wrapped as needed for them (see
+        iter_first_lines()).
+        With `tokens` (a Tokens for the text), segments are wrapped with
+        the words and escape codes found before, when that helps.
+        With an `overlong` policy (see core.OVERLONG_POLICIES), words that
+        are wider than `width` are split or truncated, without slicing
+        them from the text (see core.iter_overlong_spans()). Wrapping on
+        characters doesn't need it.
+    """
+    if (overlong is not None) and (overlong not in core.OVERLONG_POLICIES):
+        raise ValueError('Unknown overlong policy: {!r}'.format(overlong))
+    # Where iter_first_lines() can end a prefix of a segment.
+    breaksengine = None
+    if chars:
+        engine = core.iter_char_lines
+    elif shrink:
+        engine = core.iter_shrink_lines
+        spansengine = core.iter_shrink_spans
+    elif uax14:
+        engine = core.iter_uax14_lines
+        spansengine = core.iter_uax14_spans
+        breaksengine = core.iter_uax14_breaks
+        # Tokens only have spans for the other engines.
+        tokens = None
+    else:
+        engine = core.iter_space_lines
+        spansengine = core.iter_space_spans
+    if overlong and not chars:
+        linesengine = engine
+        truncate = overlong == core.OVERLONG_TRUNCATE
+
+        def engine(text, width=60, spans=None):
+            if spans is None:
+                spans = spansengine(text, width=width)
+            return core.iter_overlong_lines(
+                text,
+                spans,
+                width=width,
+                engine=linesengine,
+                truncate=truncate,
+            )
+    # Short plain segments can only make one line, and don't need the
+    # engines. This saves a lot for text with many short lines.
+    shortcut = not shrink
+    width = max(width, 1)
+
+    def break_lines_stage(segments):
+        count = 0
+        for offset, segment in segments:
+            if (max_lines is not None) and (count >= max_lines):
+                return None
+            if segment is None:
+                count += 1
+                yield LineRecord(
+                    '',
+                    width=0,
+                    start=offset,
+                    end=offset,
+                    words=0,
+                )
+                continue
+            if shortcut and (len(segment) <= width) and (
+                    '\x1b' not in segment) and (
+                    segment.isascii() or not core.has_wide(segment)):
+                words = segment.split()
+                if not (segment if chars else words):
+                    continue
+                if chars:
+                    line = segment.replace('\n', ' ')
+                    start = offset
+                    end = offset + len(segment)
+                else:
+                    line = ' '.join(words)
+                    start = offset + len(segment) - len(segment.lstrip())
+                    end = start + len(segment.strip())
+                if lstrip:
+                    stripped = line.lstrip()
+                    start += len(line) - len(stripped)
+                    line = stripped
+                count += 1
+                yield LineRecord(
+                    line,
+                    width=len(line),
+                    start=start,
+                    end=end,
+                    words=len(words),
+                )
+                continue
+            spans = None
+            if tokens is not None:
+                spans = tokens.iter_spans(
+                    offset,
+                    offset + len(segment),
+                    width=width,
+                    chars=chars,
+                    shrink=shrink,
+                )
+            if spans is not None:
+                lines = engine(segment, width=width, spans=spans)
+                if max_lines is not None:
+                    # Tokens are wrapped lazily.
+                    lines = islice(lines, max_lines - count)
+            elif max_lines is None:
+                lines = engine(segment, width=width)
+            else:
+                lines = iter_first_lines(
+                    engine,
+                    segment,
+                    max_lines - count,
+                    width=width,
+                    breaks=(
+                        None if breaksengine is None
+                        else breaksengine(segment)
+                    ),
+                )
+            for line, start, end, words, linewidth in lines:
+                if lstrip:
+                    stripped = line.lstrip()
+                    skipped = len(line) - len(stripped)
+                    linewidth -= get_display_width(line[:skipped])
+                    line = stripped
+                    # Like get_breaks(), the line starts after the
+                    # whitespace.
+                    start += skipped
+                count += 1
+                # Positional arguments, this is the hot path.
+                yield LineRecord(
+                    line, linewidth, offset + start, offset + end, words,
+                )
+    return break_lines_stage
+
+
+def decorate(
+        prepend: Optional[str] = None, append: Optional[str] = None,
+        strip_first: bool = False, strip_last: bool = False,
+        continuation: Optional[str] = None) -> Stage:
+    """ Stage that sets the prepend/append text for each LineRecord,
+        optionally skipping the first prepend or last append.
+        When `continuation` is set, it is prepended to every line after
+        the first one, instead of `prepend`.
+    """
+    if continuation is None:
+        continuation = prepend
+
+    def decorate_stage(records):
+        records = iter(records)
+        try:
+            record = next(records)
+        except StopIteration:
+            return None
+        first = True
+        for nextrecord in records:
+            if first:
+                if prepend and not strip_first:
+                    record.prepend = prepend
+            elif continuation:
+                record.prepend = continuation
+            if append:
+                record.append = append
+            yield record
+            record = nextrecord
+            first = False
+        # Last record.
+        if first:
+            if prepend and not strip_first:
+                record.prepend = prepend
+        elif continuation:
+            record.prepend = continuation
+        if append and not strip_last:
+            record.append = append
+        yield record
+    return decorate_stage
+
+
+def get_width(text: str) -> int:
+    """ Return the visible width of `text`, without escape codes, counting
+        wide characters as two columns (see fmtblock.widths).
+    """
+    if '\x1b' in text:
+        text = strip_codes(text)
+    return get_display_width(text)
+
+
+def iter_first_lines(
+        engine: Callable[..., Iterator[Any]], text: str, count: int,
+        width: int = 60,
+        breaks: Optional[Iterator[int]] = None) -> Iterator[Any]:
+    """ Yield the first `count` line info tuples from a core engine (like
+        core.iter_space_lines()), without wrapping all of `text`.
+        The engine runs on a prefix of `text` that ends on whitespace, so
+        no word is cut. A line is only final once the next line has
+        started, so the prefix is doubled until it holds `count + 1`
+        lines, or all of `text`. The work done depends on `count`, not
+        on the length of `text`.
+        With `breaks` (the offsets where a line can start in `text`, in
+        order, like core.iter_uax14_breaks() yields), the prefix ends at
+        one of them instead. Whitespace isn't always a break opportunity
+        for those engines.
+    """
+    size = (count + 1) * (width + 1) * 2
+    while size < len(text):
+        if breaks is None:
+            match = _spacepat.search(text, size)
+            stop = None if match is None else match.start()
+        else:
+            stop = next((pos for pos in breaks if pos >= size), None)
+        if stop is None:
+            break
+        lines = list(islice(
+            engine(text[:stop], width=width),
+            count + 1,
+        ))
+        if len(lines) > count:
+            yield from lines[:count]
+            return None
+        size *= 2
+    yield from islice(engine(text, width=width), count)
+
+
+def justify(width: int = 60) -> Stage:
+    """ Stage that inserts spaces between words, so each LineRecord is
+        `width` wide (see core.expand_words()).
+    """
+    def justify_stage(records):
+        for record in records:
+            if record.width < width:
+                text = core.expand_words(
+                    record.text,
+                    width=width,
+                    linewidth=record.width,
+                )
+                if text != record.text:
+                    record.width = width if ' ' in text else get_width(text)
+                    record.text = text
+            yield record
+    return justify_stage
+
+
+def limit(max_lines: int, marker: Optional[str] = None) -> Stage:
+    """ Stage that stops after `max_lines` LineRecords. When there were
+        more, and `marker` is set, a LineRecord for the marker (like '...')
+        is added after the last one.
+    """
+    def limit_stage(records):
+        records = iter(records)
+        yield from islice(records, max_lines)
+        record = next(records, None)
+        if (record is not None) and marker:
+            yield LineRecord(
+                marker,
+                start=record.start,
+                end=record.start,
+                words=len(marker.split()),
+            )
+    return limit_stage
+
+
+def number(start: int = 1) -> Stage:
+    """ Stage that numbers each LineRecord, starting with `start`. """
+    def number_stage(records):
+        for i, record in enumerate(records, start):
+            record.number = i
+            yield record
+    return number_stage
+
+
+def output(numfmt: str = NUMBER_FORMAT) -> Stage:
+    """ Stage that renders LineRecords as strings.
+        `numfmt` is used to format line numbers, when they are set.
+    """
+    def output_stage(records):
+        for record in records:
+            if record.prepend or record.append or (record.number is not None):
+                yield record.render(numfmt=numfmt)
+            else:
+                yield record.text
+    return output_stage
+
+
+def tokenize(
+        chars: bool = False, newlines: bool = False,
+        paragraphs: bool = False, continued: bool = False) -> Stage:
+    """ Stage that splits text into segments that are wrapped separately,
+        yielding (offset, segment) tuples, where `offset` is the segment's
+        offset in the text.
+        With `paragraphs`, each paragraph is a segment, and each blank line
+        is a None segment. With `newlines`, each line is a segment.
+        Otherwise the whole text is one segment.
+        Lines and paragraphs are found lazily.
+        With `continued`, the text starts in the middle of a paragraph (see
+        core.iter_paragraphs()).
+    """
+    def iter_line_segments(text):
+        offset = 0
+        for line in core.iter_lines(text):
+            yield offset, line
+            offset += len(line) + 1
+
+    def tokenize_stage(text):
+        if paragraphs:
+            return core.iter_paragraphs(text, continued=continued)
+        if newlines:
+            return iter_line_segments(text)
+        return iter(((0, text),))
+    return tokenize_stage
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+""" FormatBlock - Profiler
+    Profiles a formatting job, for the `fmtblock --profile` option.
+
+    While a Profiler is running:
+        * cProfile records the time spent in each function.
+        * tracemalloc records memory use.
+        * Call stacks are sampled with a CPU timer (SIGPROF, on Unix, from
+          the main thread), for flame graphs. The stacks are written in
+          the "collapsed" format (`frame;frame;frame count`), that
+          flamegraph.pl, speedscope, and other tools read.
+        * Every Pipeline stage that runs in the profiler's thread is
+          wrapped, to record the time and memory spent producing its
+          items.
+
+    Stage times don't include the stages a stage reads from, and neither
+    does retained memory (what is still allocated afterwards). Peak memory
+    is the highest traced memory above the level at the start of each
+    step, including the stages it reads from.
+    tracemalloc slows allocations down, so all times are higher than they
+    would be without profiling, but they can still be compared.
+
+    Example:
+        with Profiler() as profiler:
+            output = core.format_block(text, width=80)
+        print(profiler.format_report(), file=sys.stderr)
+        profiler.write_stacks('fmtblock.stacks')
+"""
+
+import cProfile
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import (
+    Iterator,
+    List,
+)
+
+from .pipeline import Stage, current_stage_wrapper
+
+# Seconds of CPU time between call stack samples.
+SAMPLE_INTERVAL = 0.001
+# Number of functions in the report.
+REPORT_LIMIT = 15
+
+
+class StageStats(object):
+    """ Time and memory used by one pipeline stage (for every pipeline it
+        ran in).
+        Attributes:
+            name     : The stage name, like Pipeline's repr() shows.
+            calls    : Number of items the stage produced.
+            time     : Seconds spent in the stage.
+            peak     : Highest memory above the start of a step, in bytes.
+            retained : Memory still allocated by the stage, in bytes.
+    """
+    __slots__ = ('name', 'calls', 'time', 'peak', 'retained')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+        self.peak = 0
+        self.retained = 0
+
+    def __repr__(self):
+        return '{}({!r}, calls={}, time={:.6f}, peak={}, retained={})'.format(
+            type(self).__name__,
+            self.name,
+            self.calls,
+            self.time,
+            self.peak,
+            self.retained,
+        )
+
+
+class Profiler(object):
+    """ Profiles the code that runs while it is started, see the module
+        docs. Use it as a context manager to start and stop it.
+        Only one Profiler can run at a time.
+    """
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        # Counts for each sampled call stack (a tuple of code objects,
+        # innermost first).
+        self.samples = {}
+        self.stages = OrderedDict()
+        self.elapsed = 0.0
+        self.peak = 0
+        self.retained = 0
+        # Stage steps that are running, innermost last. Each one is a list
+        # of [stats, start time, start memory, highest memory,
+        # time in inner stages, memory retained by inner stages].
+        self._steps = []
+        self._started = None
+        self._sampling = False
+        self._oldhandler = None
+        # Token to restore the stage wrapper with, while running.
+        self._wrapping = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __repr__(self):
+        return '{}(elapsed={:.6f}, samples={}, stages={})'.format(
+            type(self).__name__,
+            self.elapsed,
+            sum(self.samples.values()),
+            len(self.stages),
+        )
+
+    def _begin_step(self, stats: StageStats) -> None:
+        """ Start timing a step of a pipeline stage. """
+        current, peak = tracemalloc.get_traced_memory()
+        if self._steps:
+            # The peak is reset for this step, keep the outer one's.
+            outer = self._steps[-1]
+            outer[3] = max(outer[3], peak)
+        tracemalloc.reset_peak()
+        self._steps.append(
+            [stats, time.perf_counter(), current, current, 0.0, 0]
+        )
+
+    def _end_step(self) -> None:
+        """ Stop timing the innermost step, and add it to its stage. """
+        now = time.perf_counter()
+        current, peak = tracemalloc.get_traced_memory()
+        stats, start, base, high, innertime, innermem = self._steps.pop()
+        high = max(high, peak)
+        elapsed = now - start
+        retained = current - base
+        stats.time += elapsed - innertime
+        stats.retained += retained - innermem
+        stats.peak = max(stats.peak, high - base)
+        if self._steps:
+            outer = self._steps[-1]
+            outer[3] = max(outer[3], high)
+            outer[4] += elapsed
+            outer[5] += retained
+
+    def _sample(self, signum, frame) -> None:
+        """ Signal handler that counts the current call stack. Only code
+            objects are kept here, to keep the handler cheap.
+        """
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(codes)
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def format_report(self, limit: int = REPORT_LIMIT) -> str:
+        """ Return a report of the hottest functions, and the time and
+            memory of each pipeline stage.
+        """
+        lines = [
+            'Profile: {:.3f}s, peak memory: {} KB, retained: {} KB'.format(
+                self.elapsed,
+                self.peak // 1024,
+                self.retained // 1024,
+            ),
+            '',
+            'Hot functions (by own time):',
+            '{:>10} {:>10} {:>10}  {}'.format(
+                'calls', 'own s', 'total s', 'function',
+            ),
+        ]
+        for name, calls, owntime, totaltime in self.get_functions()[:limit]:
+            lines.append('{:>10} {:>10.4f} {:>10.4f}  {}'.format(
+                calls,
+                owntime,
+                totaltime,
+                name,
+            ))
+        if self.stages:
+            lines.extend((
+                '',
+                'Pipeline stages:',
+                '{:<20} {:>10} {:>10} {:>10} {:>12}'.format(
+                    'stage', 'items', 'own s', 'peak KB', 'retained KB',
+                ),
+            ))
+            for stats in self.stages.values():
+                lines.append('{:<20} {:>10} {:>10.4f} {:>10} {:>12}'.format(
+                    stats.name,
+                    stats.calls,
+                    stats.time,
+                    stats.peak // 1024,
+                    stats.retained // 1024,
+                ))
+        if not self.samples:
+            lines.extend(('', 'No call stacks were sampled.'))
+        return '\n'.join(lines)
+
+    def get_functions(self) -> List[tuple]:
+        """ Return a list of (name, calls, own time, total time) for each
+            profiled function, hottest first. The profiler's own functions
+            (and built-in functions only it calls) are left out.
+        """
+        functions = []
+        stats = pstats.Stats(self.profile).stats
+        for (filename, lineno, funcname), info in stats.items():
+            _, calls, owntime, totaltime, callers = info
+            if (filename == __file__) or (callers and all(
+                    caller[0] == __file__ for caller in callers)):
+                continue
+            if filename == '~':
+                # Built-in function.
+                name = funcname
+            else:
+                name = '{}:{}({})'.format(
+                    os.path.basename(filename),
+                    lineno,
+                    funcname,
+                )
+            functions.append((name, calls, owntime, totaltime))
+        functions.sort(key=lambda info: info[2], reverse=True)
+        return functions
+
+    def iter_stacks(self) -> Iterator[str]:
+        """ Yield a line for each sampled call stack, in the collapsed
+            format (`frame;frame;frame count`), leaving out the profiler's
+            own frames.
+        """
+        stacks = Counter()
+        for codes, count in self.samples.items():
+            stacks[';'.join(
+                '{}:{}'.format(
+                    os.path.basename(code.co_filename),
+                    getattr(code, 'co_qualname', code.co_name),
+                )
+                for code in reversed(codes)
+                if code.co_filename != __file__
+            )] += count
+        for stack, count in sorted(stacks.items()):
+            yield '{} {}'.format(stack, count)
+
+    def start(self) -> None:
+        """ Start profiling. """
+        self.samples.clear()
+        self.stages.clear()
+        self._steps = []
+        tracemalloc.start()
+        self._wrapping = current_stage_wrapper.set(self.wrap_stage)
+        self._sampling = hasattr(signal, 'setitimer') and (
+            threading.current_thread() is threading.main_thread()
+        )
+        if self._sampling:
+            self._oldhandler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._started = time.perf_counter()
+        self.profile.enable()
+
+    def stop(self) -> None:
+        """ Stop profiling, and record the memory use. """
+        self.profile.disable()
+        self.elapsed = time.perf_counter() - self._started
+        if self._sampling:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._oldhandler or signal.SIG_DFL)
+            self._sampling = False
+        current_stage_wrapper.reset(self._wrapping)
+        self._wrapping = None
+        self.retained, self.peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    def wrap_stage(self, stage: Stage) -> Stage:
+        """ Wrap a pipeline stage, to record the time and memory spent
+            producing each item.
+        """
+        name = getattr(stage, '__qualname__', repr(stage)).split('.')[0]
+        stats = self.stages.get(name, None)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+
+        def profiled_stage(items):
+            self._begin_step(stats)
+            try:
+                iterator = iter(stage(items))
+            finally:
+                self._end_step()
+            while True:
+                self._begin_step(stats)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return None
+                finally:
+                    self._end_step()
+                stats.calls += 1
+                yield item
+
+        return profiled_stage
+
+    def write_stacks(self, filename: str) -> None:
+        """ Write the sampled call stacks to a file, in the collapsed
+            format.
+        """
+        with open(filename, 'w') as f:
+            for line in self.iter_stacks():
+                f.write(line)
+                f.write('\n')
+
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+""" FormatBlock - Server
+    A formatting server that listens on a Unix domain socket, so that
+    frequent callers don't pay for interpreter startup and imports on every
+    call.
+
+    Messages in both directions are a 4-byte big-endian length, followed by
+    that many bytes of UTF-8 encoded JSON.
+
+    Requests:
+        {'text': str, 'options': {iter_format_block() keyword args}}
+            Format `text`, and respond with {'output': str}.
+        {'argv': [str, ...], 'cwd': str}
+            Run `fmtblock` command-line arguments, and respond with
+            {'output': str, 'errors': [str, ...]}. There is no 'output'
+            when there are no output lines.
+            If the arguments need stdin, the server responds with
+            {'stdin': True} first, and the client must send {'stdin': str}.
+            If the arguments can't be handled by the server (--help, -m,
+            invalid arguments, etc.), it responds with {'fallback': True}.
+    Any failure is reported with {'error': str}.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
+
+# Unix domain sockets (and user ids) are not available on Windows.
+HAS_UNIX_SOCKETS = hasattr(socket, 'AF_UNIX') and hasattr(os, 'getuid')
+# The server's base class only exists with Unix sockets. FormatServer raises
+# OSError when it's created without them.
+_UnixStreamServer = getattr(
+    socketserver,
+    'UnixStreamServer',
+    socketserver.TCPServer,
+)
+
+# Message length header.
+_header = struct.Struct('>I')
+# Maximum message size that will be accepted (in bytes).
+MAX_MESSAGE = 256 * 1024 * 1024
+
+# Default number of results to keep in the server's cache.
+CACHE_SIZE = 1024
+# Texts longer than this are never cached.
+CACHE_MAX_TEXT = 65536
+
+
+def get_socket_path() -> Optional[str]:
+    """ Return the default socket path for this user, or None if Unix
+        sockets are not supported.
+        Without $XDG_RUNTIME_DIR, the socket goes in a directory of its own
+        in the temp directory, that only this user can write to.
+    """
+    if not HAS_UNIX_SOCKETS:
+        return None
+    envpath = os.environ.get('FMTBLOCK_SOCKET', None)
+    if envpath:
+        return envpath
+    rundir = os.environ.get('XDG_RUNTIME_DIR', None)
+    if rundir:
+        return os.path.join(rundir, 'fmtblock-{}.sock'.format(os.getuid()))
+    return os.path.join(
+        tempfile.gettempdir(),
+        'fmtblock-{}'.format(os.getuid()),
+        'fmtblock.sock',
+    )
+
+
+def is_private(socketpath: str) -> bool:
+    """ Returns True if `socketpath` is a socket owned by this user, in a
+        directory that no other user can write to, so another user's
+        server can't be listening on it.
+    """
+    if not HAS_UNIX_SOCKETS:
+        return False
+    try:
+        sockstat = os.stat(socketpath)
+        dirstat = os.stat(os.path.dirname(os.path.abspath(socketpath)))
+    except OSError:
+        return False
+    uid = os.getuid()
+    return (
+        stat.S_ISSOCK(sockstat.st_mode) and
+        (sockstat.st_uid == uid) and
+        (dirstat.st_uid in (uid, 0)) and
+        not (dirstat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+    )
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """ Receive exactly `size` bytes from a socket.
+        Raises EOFError if the connection is closed first.
+    """
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(min(size - len(buf), 1048576))
+        if not chunk:
+            raise EOFError('Connection closed.')
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def recv_message(sock: socket.socket) -> Any:
+    """ Receive one length-prefixed JSON message from a socket. """
+    size, = _header.unpack(recv_exact(sock, _header.size))
+    if size > MAX_MESSAGE:
+        raise ValueError('Message is too large: {}'.format(size))
+    return json.loads(recv_exact(sock, size).decode('utf-8'))
+
+
+def send_message(sock: socket.socket, msg: Any) -> None:
+    """ Send one length-prefixed JSON message over a socket. """
+    data = json.dumps(msg).encode('utf-8')
+    sock.sendall(b''.join((_header.pack(len(data)), data)))
+
+
+class ResultCache(object):
+    """ A thread-safe LRU cache of formatted results, shared by all of the
+        server's connections.
+    """
+    __slots__ = ('lock', 'maxsize', 'results', 'hits', 'misses')
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Get a cached result, or None if it's not cached. """
+        with self.lock:
+            result = self.results.get(key, None)
+            if result is None:
+                self.misses += 1
+            else:
+                self.results.move_to_end(key)
+                self.hits += 1
+            return result
+
+    def set(self, key, result):
+        """ Cache a result, removing the least recently used one if full. """
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+
+class FormatHandler(socketserver.BaseRequestHandler):
+    """ Handles a single client connection for FormatServer. """
+
+    def handle(self):
+        try:
+            request = recv_message(self.request)
+            if 'argv' in request:
+                response = self.handle_argv(request)
+            else:
+                response = {
+                    'output': self.server.format_text(
+                        request.get('text', None) or '',
+                        request.get('options', None) or {},
+                    ),
+                }
+        except EOFError:
+            return None
+        except Exception as ex:
+            response = {'error': '{}: {}'.format(type(ex).__name__, ex)}
+        try:
+            send_message(self.request, response)
+        except OSError:
+            # Client went away.
+            pass
+
+    def handle_argv(self, request):
+        """ Handle command-line arguments from the `fmtblock` client. """
+        cli = self.server.cli
+        try:
+            argd = cli.docopt(
+                cli.USAGESTR,
+                argv=request['argv'],
+                help=False,
+                script=cli.SCRIPT,
+            )
+            if any(argd[s] for s in self.server.fallback_args):
+                return {'fallback': True}
+            fmtargs = cli.get_fmtargs(argd)
+        except SystemExit:
+            # Invalid arguments, let the client report them.
+            return {'fallback': True}
+        errors = []
+        if argd['WORDS']:
+            text = cli.join_words(
+                argd['WORDS'],
+                cwd=request.get('cwd', None),
+                errors=errors,
+            )
+        else:
+            send_message(self.request, {'stdin': True})
+            text = recv_message(self.request).get('stdin', None) or ''
+        if argd['--enumerate']:
+            output = '\n'.join(
+                cli.iter_output_lines(text, fmtargs, enumerate_lines=True)
+            )
+        else:
+            output = self.server.format_text(text, fmtargs)
+        if not output:
+            # No lines at all is not the same as one empty line.
+            lines = iter(cli.iter_output_lines(text, fmtargs))
+            if next(lines, None) is None:
+                return {'errors': errors}
+        return {'output': output, 'errors': errors}
+
+
+class FormatServer(socketserver.ThreadingMixIn, _UnixStreamServer):
+    """ A threaded formatting server, listening on a Unix domain socket.
+        Use it as a context manager to remove the socket file when done.
+    """
+    daemon_threads = True
+    # Command-line options that only the normal CLI can handle.
+    fallback_args = (
+        '--debug', '--follow', '--help', '--multi', '--profile', '--records',
+        '--serve', '--tail', '--version',
+    )
+
+    def __init__(self, socketpath=None, cachesize=CACHE_SIZE):
+        if not HAS_UNIX_SOCKETS:
+            raise OSError('Unix sockets are not supported.')
+        # Import everything up front, so the first requests are fast too.
+        from . import __main__ as cli
+        from . import core
+        self.cli = cli
+        self.core = core
+        self.socketpath = socketpath or get_socket_path()
+        self.cache = ResultCache(maxsize=cachesize)
+        if os.path.exists(self.socketpath):
+            # Remove a stale socket file, but not a live server's socket.
+            if is_serving(self.socketpath):
+                raise OSError(
+                    'Server is already running: {}'.format(self.socketpath)
+                )
+            os.remove(self.socketpath)
+        rundir = os.path.dirname(os.path.abspath(self.socketpath))
+        if not os.path.exists(rundir):
+            os.makedirs(rundir, mode=0o700)
+        # Only this user should be able to connect.
+        oldmask = os.umask(0o177)
+        try:
+            super().__init__(self.socketpath, FormatHandler)
+        finally:
+            os.umask(oldmask)
+
+    def format_text(self, text: str, options: Dict[str, Any]) -> str:
+        """ Format `text` with iter_format_block() options, using the cache.
+            Formatting is stateless (see core.py), so connections can
+            format at the same time.
+        """
+        if len(text) > CACHE_MAX_TEXT:
+            return self.core.format_block(text, **options)
+        key = (text, json.dumps(options, sort_keys=True))
+        result = self.cache.get(key)
+        if result is None:
+            result = self.core.format_block(text, **options)
+            self.cache.set(key, result)
+        return result
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.socketpath)
+        except FileNotFoundError:
+            pass
+
+
+def is_serving(socketpath: Optional[str] = None) -> bool:
+    """ Returns True if a server is accepting connections at `socketpath`.
+    """
+    if not HAS_UNIX_SOCKETS:
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketpath or get_socket_path())
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
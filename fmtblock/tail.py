@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+""" FormatBlock - Tail
+    Formats only the end of large text, in `newlines` mode, for showing the
+    last lines of a log.
+
+    In `newlines` mode, each source line is formatted on its own, so the
+    last N output lines only depend on the last few source lines. They are
+    found by reading blocks backwards from the end of a seekable file (or
+    an mmap, or bytes), and only those lines are formatted. Blank source
+    lines don't make any output lines, so they are skipped (and more lines
+    are found as needed), but no byte is formatted twice. The cost is
+    O(output + blank lines), no matter how large the file is.
+
+    A very long last source line still has to be formatted from its start
+    (where its line breaks start), but it's fed to an IncrementalFormatter a
+    block at a time, and only the last N lines are kept, so memory use
+    stays bounded. Streams that can't seek (pipes, compressed files) are
+    formatted the same way, from the start.
+
+    Escape codes never contain newlines, and whole source lines are
+    formatted, so they are handled just like FormatBlock.format() does.
+    The encoding must be ASCII-compatible (like UTF-8), so that newline
+    bytes can be found without decoding.
+
+    Example:
+        with open('app.log', 'rb') as f:
+            for line in tail_lines(f, 20, width=80, prepend='> '):
+                print(line)
+"""
+
+import mmap
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+)
+
+from .incremental import IncrementalFormatter
+
+# Number of bytes to read at a time.
+BLOCK_SIZE = 65536
+
+
+def find_lines_start(
+        read: Callable[[int, int], bytes], stop: int, lines: int,
+        blocksize: int = BLOCK_SIZE) -> int:
+    """ Return the offset where the last `lines` source lines before `stop`
+        start, reading blocks backwards with `read(start, stop)`.
+        `stop` is the end of the data, or the start of a line. Lines that
+        are only ASCII whitespace aren't counted, because they never make
+        output lines. Returns 0 if there aren't that many lines.
+    """
+    found = 0
+    pos = stop
+    # End of the current line (after its newline).
+    lineend = stop
+    # Whether the part of the current line in later blocks is blank.
+    blank = True
+    while pos > 0:
+        blockstart = max(pos - blocksize, 0)
+        block = read(blockstart, pos)
+        # The newline at the end of the current line is part of it.
+        end = min(len(block), lineend - 1 - blockstart)
+        while True:
+            end = block.rfind(b'\n', 0, end)
+            if end < 0:
+                break
+            line = block[end + 1:lineend - blockstart]
+            if line.strip() or not blank:
+                found += 1
+                if found >= lines:
+                    return blockstart + end + 1
+            lineend = blockstart + end + 1
+            blank = True
+        blank = blank and not block[:lineend - blockstart].strip()
+        pos = blockstart
+    return 0
+
+
+def get_reader(source: Any) -> Tuple[Callable[[int, int], bytes], int]:
+    """ Return a tuple of (read, size) for a seekable binary file, or a
+        bytes-like object (like an mmap), where `read(start, stop)` returns
+        the bytes from `start` to `stop`.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return (lambda start, stop: bytes(source[start:stop])), len(source)
+    size = source.seek(0, 2)
+
+    def read(start: int, stop: int) -> bytes:
+        source.seek(start)
+        return source.read(stop - start)
+
+    return read, size
+
+
+def has_lines(
+        read: Callable[[int, int], bytes], stop: int, **kwargs) -> bool:
+    """ Return True if the text before `stop` makes any output lines, with
+        IncrementalFormatter arguments. Source lines are read backwards,
+        and only until the first output line. Each block is read once, so
+        a long run of blank lines costs O(length).
+    """
+    # End of the current line (after its newline).
+    lineend = stop
+    pos = stop
+    while pos > 0:
+        blockstart = max(pos - BLOCK_SIZE, 0)
+        block = read(blockstart, pos)
+        while True:
+            # The newline at the end of the current line is part of it.
+            i = block.rfind(
+                b'\n',
+                0,
+                min(len(block), lineend - 1 - blockstart),
+            )
+            if i < 0:
+                break
+            linestart = blockstart + i + 1
+            if lineend > pos:
+                chunks = iter_blocks(read, linestart, lineend)
+                if makes_lines(chunks, **kwargs):
+                    return True
+            else:
+                # The whole line is in this block. Lines that are only
+                # ASCII whitespace never make output lines.
+                line = block[i + 1:lineend - blockstart]
+                if line.strip() and makes_lines((line,), **kwargs):
+                    return True
+            lineend = linestart
+        pos = blockstart
+    return makes_lines(iter_blocks(read, 0, lineend), **kwargs)
+
+
+def iter_blocks(
+        read: Callable[[int, int], bytes], start: int,
+        stop: int) -> Iterator[bytes]:
+    """ Yield the bytes from `start` to `stop`, a block at a time. """
+    for pos in range(start, stop, BLOCK_SIZE):
+        yield read(pos, min(pos + BLOCK_SIZE, stop))
+
+
+def makes_lines(chunks: Iterable[bytes], **kwargs) -> bool:
+    """ Return True if the text in `chunks` makes any output lines, with
+        IncrementalFormatter arguments.
+    """
+    formatter = IncrementalFormatter(**kwargs)
+    for chunk in chunks:
+        if formatter.feed(chunk):
+            return True
+    return bool(formatter.flush())
+
+
+def tail_lines(
+        source: Any, count: int, width: int = 60, chars: bool = False,
+        fill: bool = False, prepend: str = None, append: str = None,
+        strip_first: bool = False, strip_last: bool = False,
+        lstrip: bool = False, shrink: bool = False, uax14: bool = False,
+        overlong: str = None, encoding: str = 'utf-8',
+        errors: str = 'strict') -> List[str]:
+    """ Return the last `count` lines that FormatBlock.format() would make
+        in `newlines` mode, formatting only the end of `source`.
+        `source` is a binary file, or a bytes-like object (like an mmap),
+        in `encoding`. Files that can't seek are formatted from the start,
+        keeping only the last `count` lines.
+        Arguments:
+            See FormatBlock.format().
+    """
+    if count <= 0:
+        return []
+    fmtargs = {
+        'width': width,
+        'chars': chars,
+        'fill': fill,
+        'newlines': True,
+        'prepend': prepend,
+        'append': append,
+        'lstrip': lstrip,
+        'shrink': shrink,
+        'uax14': uax14,
+        'overlong': overlong,
+        'encoding': encoding,
+        'errors': errors,
+    }
+    if not (isinstance(source, (bytes, bytearray, memoryview, mmap.mmap))
+            or source.seekable()):
+        formatter = IncrementalFormatter(
+            strip_first=strip_first,
+            strip_last=strip_last,
+            **fmtargs
+        )
+        lines = deque(maxlen=count)
+        for chunk in iter(lambda: source.read(BLOCK_SIZE), b''):
+            lines.extend(formatter.feed(chunk))
+        lines.extend(formatter.flush())
+        return list(lines)
+
+    read, size = get_reader(source)
+    lines = []
+    stop = size
+    while (stop > 0) and (len(lines) < count):
+        # Each source line makes at least one output line, unless it's
+        # blank. Then more lines are found in the next pass.
+        start = find_lines_start(read, stop, count - len(lines))
+        formatter = IncrementalFormatter(
+            # The first line might come after blank lines.
+            strip_first=strip_first and not (
+                start and has_lines(read, start, **fmtargs)
+            ),
+            strip_last=strip_last and not lines,
+            **fmtargs
+        )
+        partlines = deque(maxlen=count - len(lines))
+        for chunk in iter_blocks(read, start, stop):
+            partlines.extend(formatter.feed(chunk))
+        partlines.extend(formatter.flush())
+        lines[:0] = partlines
+        stop = start
+    return lines
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+""" FormatBlock - Tokens
+    The tokenized form of a text: word offsets, visible word widths, and
+    escape code offsets. Once a text is tokenized, it can be wrapped again
+    (at another width, or in another mode) without splitting it into words
+    or looking for escape codes again.
+
+    FormatBlock keeps one for its `text`, built the first time it's needed
+    and dropped when `text` is reassigned, and every method that formats
+    `text` uses it.
+
+    Plain text (see core.is_plain()) is wrapped without looking at each
+    word, and large ASCII text uses the NumPy engine (see npengine), so
+    words are only tokenized for the other tiers (see core.get_tier()).
+
+    Example:
+        tokens = Tokens(text)
+        for width in (40, 60, 80):
+            lines = list(core.iter_block(text, width=width, tokens=tokens))
+"""
+
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import (
+    Iterator,
+    Optional,
+    Tuple,
+)
+
+from . import core, npengine
+from .escapecodes import get_codes, strip_codes
+from .widths import get_width
+
+# Used to find words, like core.py does.
+_wordpat = re.compile(r'\S+')
+
+
+def get_bounds(offsets: array, start: int, stop: int) -> Tuple[int, int]:
+    """ Return the (lo, hi) indexes of the [start, end] pairs in a flat
+        array of offsets that are between `start` and `stop`.
+    """
+    lo = bisect_left(offsets, start)
+    hi = bisect_left(offsets, stop)
+    # An odd index is an end, for a pair that starts before the offset.
+    return lo + (lo & 1), hi + (hi & 1)
+
+
+class Tokens(object):
+    """ Tokenized `text`. Everything is found lazily, the first time it is
+        needed, and never changes afterwards, so the same Tokens can be
+        used from many threads (two threads may tokenize the same thing at
+        once, and one result is kept).
+        Attributes:
+            text   : The tokenized text.
+            tier   : The tier of `text` (see core.get_tier()), or None
+                     if not profiled yet.
+            codes  : Escape code offsets, from core.get_code_spans(),
+                     or None if not found yet.
+            words  : Word offsets, as an array('Q') of
+                     [start0, end0, start1, end1, ...], or None if not
+                     found yet.
+            widths : Visible (display) width of each word for space
+                     wrapping, or None when `text` has no escape codes or
+                     wide characters.
+            shrinkwidths : Visible width of each word for shrink mode,
+                           which also ignores escape codes other than
+                           colors. This is `widths` when they are the
+                           same.
+    """
+    __slots__ = (
+        'text', 'tier', 'hascodes', 'codes', 'words', 'widths',
+        'shrinkwidths',
+    )
+
+    def __init__(self, text: str):
+        self.text = text or ''
+        self.tier = None
+        self.hascodes = '\x1b' in self.text
+        self.codes = None
+        self.words = None
+        self.widths = None
+        self.shrinkwidths = None
+
+    def __repr__(self):
+        return '{}(length={}, words={}, size={})'.format(
+            type(self).__name__,
+            len(self.text),
+            '?' if self.words is None else len(self.words) // 2,
+            self.get_size(),
+        )
+
+    def get_codes(self) -> array:
+        """ Return the escape code offsets, finding them if needed. """
+        codes = self.codes
+        if codes is None:
+            if self.hascodes:
+                codes = core.get_code_spans(self.text)
+            else:
+                codes = array('Q')
+            self.codes = codes
+        return codes
+
+    def get_size(self) -> int:
+        """ Return the memory used by the tokens (in bytes), not counting
+            `text` itself.
+        """
+        size = sys.getsizeof(self)
+        for tokens in (self.codes, self.words, self.widths):
+            if tokens is not None:
+                size += sys.getsizeof(tokens)
+        if self.shrinkwidths is not self.widths:
+            size += sys.getsizeof(self.shrinkwidths)
+        return size
+
+    def get_words(self) -> array:
+        """ Return the word offsets, finding them (and the word widths) if
+            needed.
+        """
+        words = self.words
+        if words is not None:
+            return words
+        text = self.text
+        words = array(
+            'Q',
+            chain.from_iterable(m.span() for m in _wordpat.finditer(text)),
+        )
+        if self.hascodes:
+            wide = (not text.isascii()) and core.has_wide(text)
+        else:
+            wide = self.get_tier() == core.TIER_WIDE
+        if self.hascodes or wide:
+            widths = array('Q')
+            shrinkwidths = array('Q')
+            for start, end in zip(words[::2], words[1::2]):
+                word = text[start:end]
+                wordwidth = end - start
+                if wide and not word.isascii():
+                    # Escape codes are ASCII, and one column per character.
+                    wordwidth = get_width(word)
+                if '\x1b' not in word:
+                    widths.append(wordwidth)
+                    shrinkwidths.append(wordwidth)
+                    continue
+                widths.append(
+                    wordwidth - sum(len(s) for s in get_codes(word))
+                )
+                shrinkwidths.append(get_width(strip_codes(word)))
+            if shrinkwidths == widths:
+                shrinkwidths = widths
+            self.widths = widths
+            self.shrinkwidths = shrinkwidths
+        self.words = words
+        return words
+
+    def get_tier(self) -> str:
+        """ Return the tier of `text`, profiling it if needed. """
+        tier = self.tier
+        if tier is None:
+            tier = self.tier = core.get_tier(self.text)
+        return tier
+
+    def iter_char_spans(
+            self, start: int, stop: int,
+            width: int = 60) -> Iterator[Tuple[int, int, int]]:
+        """ Like core.iter_char_spans() for `text[start:stop]`, using the
+            escape code offsets found before.
+        """
+        codes = self.get_codes()
+        lo, hi = get_bounds(codes, start, stop)
+        codes = array('Q', (offset - start for offset in codes[lo:hi]))
+        text = self.text
+        if (start, stop) != (0, len(text)):
+            text = text[start:stop]
+        return core.iter_char_spans(text, width=width, codes=codes)
+
+    def iter_shrink_spans(
+            self, start: int, stop: int,
+            width: int = 60) -> Iterator[Tuple[int, int, int, int, bool]]:
+        """ Like core.iter_shrink_spans() for `text[start:stop]`, using the
+            words found before.
+        """
+        if width < 1:
+            width = 1
+        text = self.text
+        offsets = self.get_words()
+        lo, hi = get_bounds(offsets, start, stop)
+        starts = offsets[lo:hi:2]
+        ends = offsets[lo + 1:hi:2]
+        if self.shrinkwidths is None:
+            widths = map(int.__sub__, ends, starts)
+        else:
+            widths = self.shrinkwidths[lo // 2:hi // 2]
+        count = text.count
+        words = 0
+        linestart = lineend = 0
+        # Width of the line with single spaces between words.
+        curwidth = 0
+        # Width of the line with the original spacing.
+        rawwidth = 0
+        clean = True
+        for wordstart, wordend, wordwidth in zip(starts, ends, widths):
+            if words and (curwidth + 1 + wordwidth <= width):
+                gapwidth = wordstart - lineend
+                # Only runs of plain spaces are kept.
+                if gapwidth == 1:
+                    if clean and (text[lineend] != ' '):
+                        clean = False
+                    rawwidth += 1 + wordwidth
+                elif count(' ', lineend, wordstart) == gapwidth:
+                    rawwidth += gapwidth + wordwidth
+                else:
+                    clean = False
+                    rawwidth += 1 + wordwidth
+                words += 1
+                curwidth += 1 + wordwidth
+                lineend = wordend
+                continue
+            if words:
+                yield (
+                    linestart - start,
+                    lineend - start,
+                    words,
+                    min(rawwidth, max(width, curwidth)),
+                    clean,
+                )
+            words = 1
+            linestart, lineend = wordstart, wordend
+            curwidth = rawwidth = wordwidth
+            clean = True
+        if words:
+            yield (
+                linestart - start,
+                lineend - start,
+                words,
+                min(rawwidth, max(width, curwidth)),
+                clean,
+            )
+
+    def iter_space_spans(
+            self, start: int, stop: int,
+            width: int = 60) -> Iterator[Tuple[int, int, int, int, bool]]:
+        """ Like core.iter_word_spans() for `text[start:stop]`, using the
+            words found before.
+        """
+        if width < 1:
+            width = 1
+        text = self.text
+        offsets = self.get_words()
+        lo, hi = get_bounds(offsets, start, stop)
+        starts = offsets[lo:hi:2]
+        ends = offsets[lo + 1:hi:2]
+        if self.widths is None:
+            widths = map(int.__sub__, ends, starts)
+        else:
+            widths = self.widths[lo // 2:hi // 2]
+        words = 0
+        linestart = lineend = 0
+        linewidth = 0
+        # Whether all gaps in the line are single spaces.
+        clean = True
+        for wordstart, wordend, wordwidth in zip(starts, ends, widths):
+            if words and (linewidth + 1 + wordwidth <= width):
+                if clean and (
+                        (wordstart - lineend != 1) or (text[lineend] != ' ')):
+                    clean = False
+                lineend = wordend
+                words += 1
+                linewidth += 1 + wordwidth
+                continue
+            if words:
+                yield (
+                    linestart - start,
+                    lineend - start,
+                    words,
+                    linewidth,
+                    clean,
+                )
+            elif wordwidth > width:
+                # The first word is too long, this has always started with
+                # an empty line.
+                yield wordstart - start, wordstart - start, 0, 0, True
+            linestart, lineend = wordstart, wordend
+            words = 1
+            linewidth = wordwidth
+            clean = True
+        if words:
+            yield linestart - start, lineend - start, words, linewidth, clean
+
+    def iter_spans(
+            self, start: int = 0, stop: Optional[int] = None,
+            width: int = 60, chars: bool = False,
+            shrink: bool = False) -> Optional[Iterator[tuple]]:
+        """ Return an iterator of line spans for `text[start:stop]`, like
+            core.iter_char_spans(), core.iter_shrink_spans(), or
+            core.iter_space_spans(), with offsets into `text[start:stop]`.
+            `start` and `stop` must not be inside of a word.
+            Returns None when the tokens wouldn't help (text without escape
+            codes when wrapping on characters, or text for the NumPy
+            engine), so the usual engines should be used.
+            The engines are picked for the tier of the whole text.
+        """
+        text = self.text
+        if stop is None:
+            stop = len(text)
+        if chars:
+            if not self.get_codes():
+                return None
+            return self.iter_char_spans(start, stop, width=width)
+        tier = self.get_tier()
+        if tier == core.TIER_PLAIN:
+            # Plain text doesn't need the words.
+            if (start, stop) != (0, len(text)):
+                text = text[start:stop]
+            if shrink:
+                return core.iter_shrink_space_spans(
+                    text,
+                    width=width,
+                    tier=tier,
+                )
+            return core.iter_plain_spans(text, width=width)
+        if (
+                (tier == core.TIER_ASCII) and
+                npengine.HAS_NUMPY and
+                (stop - start >= npengine.MIN_LENGTH)):
+            # Same as npengine.accepts(), without slicing the text.
+            return None
+        if shrink:
+            return self.iter_shrink_spans(start, stop, width=width)
+        return self.iter_space_spans(start, stop, width=width)
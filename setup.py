@@ -76,7 +76,7 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'fmtblock = fmtblock.__main__:main',
+            'fmtblock = fmtblock.client:main',
         ]
     }
 )
@@ -7,10 +7,38 @@
     -Christopher Welborn 12-09-2016
 """
 
+import os
+import io
+import random
+import socket
 import sys
+import tempfile
+import threading
+import time
+import unicodedata
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
 
 from fmtblock import FormatBlock
+from fmtblock import (
+    cache,
+    client,
+    compressed,
+    core,
+    follow,
+    linebreak,
+    npengine,
+    parallel,
+    pipeline,
+    tail,
+    widths,
+)
+from fmtblock.escapecodes import strip_codes
+from fmtblock.incremental import IncrementalFormatter
+from fmtblock.index import LineIndex
+from fmtblock.profiler import Profiler
+from fmtblock.server import FormatServer
 
 
 class FmtBlockTests(unittest.TestCase):
@@ -275,6 +303,58 @@ like this test.
             msg='Failed to preserve newlines when splitting!'
         )
 
+    def test_format_max_lines(self):
+        """ format() should stop at max_lines, adding a marker. """
+        s = 'A AA AAA B BB BBB C CC CCC ' * 1000
+        for kwargs in ({}, {'chars': True}, {'fill': True}, {'shrink': True}):
+            expected = FormatBlock(s).format(width=4, **kwargs).split('\n')
+            for maxlines in (0, 1, 5):
+                self.assertEqual(
+                    list(FormatBlock(s).iter_format_block(
+                        width=4,
+                        max_lines=maxlines,
+                        marker='...',
+                        **kwargs
+                    )),
+                    expected[:maxlines] + ['...'],
+                    msg='Failed to stop at {} lines: {!r}'.format(
+                        maxlines,
+                        kwargs,
+                    ),
+                )
+        self.assertEqual(
+            FormatBlock('A AA AAA').format(width=4, max_lines=5, marker='x'),
+            'A AA\nAAA',
+            msg='Marker should only be added when lines are cut off.',
+        )
+
+    def test_format_paragraphs(self):
+        """ format() should reflow paragraphs, keeping blank lines. """
+        s = '\n'.join((
+            'This is',
+            'a test with',
+            '',
+            'some paragraphs',
+            '  ',
+            '',
+            'in it.',
+        ))
+        expected = '\n'.join((
+            'This is a',
+            'test with',
+            '',
+            'some',
+            'paragraphs',
+            '',
+            '',
+            'in it.',
+        ))
+        self.assertEqual(
+            FormatBlock(s).format(width=10, paragraphs=True),
+            expected,
+            msg='Failed to reflow paragraphs!'
+        )
+
     def test_format_prepend(self):
         """ format() should prepend text after wrapping. """
         s = 'A AA AAA B BB BBB C CC CCC'
@@ -325,6 +405,1574 @@ like this test.
             msg='Failed to wrap on spaces!'
         )
 
+    def test_iter_records(self):
+        """ iter_records() should yield widths, offsets, and word counts.
+        """
+        s = 'A AA  AAA\n\x1b[31mB\x1b[0m BB BBB'
+        records = list(FormatBlock(s).iter_records(width=6))
+        self.assertListEqual(
+            [(r.text, r.width, r.start, r.end, r.words) for r in records],
+            [
+                ('A AA', 4, 0, 4, 2),
+                ('AAA \x1b[31mB\x1b[0m', 5, 6, 20, 2),
+                ('BB BBB', 6, 21, 27, 2),
+            ],
+            msg='Line records have the wrong info.'
+        )
+        self.assertListEqual(
+            [
+                r.render()
+                for r in FormatBlock(s).iter_records(width=6, prepend='> ')
+            ],
+            list(FormatBlock(s).iter_format_block(width=6, prepend='> ')),
+            msg='Rendered records do not match iter_format_block().'
+        )
+
+    def test_tokens(self):
+        """ FormatBlock should reuse its tokens, and drop them when `text`
+            is reassigned.
+        """
+        s = 'A  AA\tAAA \x1b[31mB\x1b[0m\nBB BBB\n\nC CC CCC'
+        fmtblock = FormatBlock(s)
+        self.assertEqual(
+            fmtblock.get_tokens_size(),
+            0,
+            msg='Tokens were built before they were needed.',
+        )
+        for _ in range(2):
+            for kwargs in (
+                    {}, {'shrink': True}, {'chars': True},
+                    {'newlines': True}, {'paragraphs': True, 'shrink': True},
+                    {'fill': True}):
+                for width in (3, 7):
+                    self.assertEqual(
+                        fmtblock.format(width=width, **kwargs),
+                        core.format_block(s, width=width, **kwargs),
+                        msg='Tokens changed the output for {}.'.format(
+                            kwargs,
+                        ),
+                    )
+        self.assertGreater(
+            fmtblock.get_tokens_size(),
+            0,
+            msg='Tokens were not kept.',
+        )
+        self.assertEqual(
+            fmtblock.tokens.words[:4].tolist(),
+            [0, 1, 3, 5],
+            msg='Tokens have the wrong word offsets.',
+        )
+        fmtblock.text = 'D DD DDD'
+        self.assertEqual(
+            fmtblock.get_tokens_size(),
+            0,
+            msg='Tokens were not dropped when text was reassigned.',
+        )
+        for _ in range(2):
+            self.assertEqual(
+                fmtblock.format(width=4, shrink=True),
+                'D DD\nDDD',
+                msg='Old tokens were used for new text.',
+            )
+
+    def test_format_shrink(self):
+        """ format() should keep runs of spaces, squeezing them to fit. """
+        s = '\n'.join((
+            'Name      Value     Notes',
+            'alpha     1         first   one',
+            'beta      22        second',
+        ))
+        expected = '\n'.join((
+            'Name      Value  Notes',
+            'alpha     1  first one',
+            'beta      22    second',
+        ))
+        self.assertEqual(
+            FormatBlock(s).format(width=22, newlines=True, shrink=True),
+            expected,
+            msg='Failed to shrink pre-aligned text!'
+        )
+        self.assertEqual(
+            FormatBlock(s).format(width=40, newlines=True, shrink=True),
+            s,
+            msg='Shrink changed text that already fits!'
+        )
+        # Lines are broken at the same places as without shrink.
+        s = 'A  AA   AAA B    BB BBB C CC    CCC'
+        self.assertListEqual(
+            [
+                l.split()
+                for l in FormatBlock(s).iter_format_block(width=7, shrink=True)
+            ],
+            [l.split() for l in FormatBlock(s).iter_format_block(width=7)],
+            msg='Shrink changed where lines are broken.'
+        )
+
+    def test_squeeze_words(self):
+        """ squeeze_words() should remove spaces from the last runs first.
+        """
+        s = 'a    b   c  d'
+        self.assertEqual(
+            FormatBlock.squeeze_words(s, width=10),
+            'a    b c d',
+            msg='Failed to squeeze words.'
+        )
+        self.assertEqual(
+            FormatBlock.squeeze_words(s, width=1),
+            'a b c d',
+            msg='Should leave one space between words.'
+        )
+
+    def test_squeeze_words_colr(self):
+        """ squeeze_words() should ignore escape codes. """
+        s = '\x1b[31ma\x1b[0m    \x1b[34mb\x1b[0m'
+        self.assertEqual(
+            FormatBlock.squeeze_words(s, width=4),
+            '\x1b[31ma\x1b[0m  \x1b[34mb\x1b[0m',
+            msg='Failed to squeeze words with escape codes.'
+        )
+
+    def test_format_fill_prepend(self):
+        """ format() should fill lines without counting prepend/append. """
+        s = 'This is a convoluted test to see if fmtblock fills.'
+        result = FormatBlock(s).format(
+            width=20,
+            fill=True,
+            prepend='> ',
+            append=' <',
+        )
+        self.assertTrue(
+            all((len(line) == 24) for line in result.split('\n')),
+            msg='Failed to fill text to width with prepend/append.'
+        )
+
+    def test_format_strip_first_last(self):
+        """ format() should strip prepend and append for a single line. """
+        self.assertEqual(
+            FormatBlock('A AA').format(
+                width=4,
+                prepend='> ',
+                append=' <',
+                strip_first=True,
+                strip_last=True,
+            ),
+            'A AA',
+            msg='Failed to strip prepend/append for a single line.'
+        )
+
+
+@unittest.skipIf(not npengine.HAS_NUMPY, 'NumPy is not installed.')
+class NumPyEngineTests(unittest.TestCase):
+
+    def test_accepts(self):
+        """ npengine.accepts() should reject escape codes and non-ASCII. """
+        s = 'test ' * npengine.MIN_LENGTH
+        self.assertTrue(npengine.accepts(s), msg='Plain text was rejected.')
+        self.assertFalse(
+            npengine.accepts('\x1b[31m{}\x1b[0m'.format(s)),
+            msg='Text with escape codes was accepted.',
+        )
+        self.assertFalse(
+            npengine.accepts('{}\u2022'.format(s)),
+            msg='Non-ASCII text was accepted.',
+        )
+        self.assertFalse(
+            npengine.accepts('test this'),
+            msg='Small text was accepted.',
+        )
+
+    def test_iter_space_block(self):
+        """ npengine.iter_space_block() should match the python version. """
+        rand = random.Random(26)
+        seps = (' ', ' ', ' ', '  ', '\n', '\t', ' \n ', '\x1f')
+        for _ in range(50):
+            s = ''.join(
+                ''.join((
+                    'x' * rand.randint(1, 12),
+                    rand.choice(seps),
+                ))
+                for _ in range(rand.randint(0, 200))
+            )
+            if rand.random() < 0.5:
+                s = ''.join((rand.choice(seps), s))
+            for width in (1, 5, 10, 13, 40):
+                for fmtfunc in (str, str.lstrip):
+                    self.assertListEqual(
+                        list(npengine.iter_space_block(
+                            s,
+                            width=width,
+                            fmtfunc=fmtfunc,
+                        )),
+                        list(FormatBlock(s).iter_space_block(
+                            width=width,
+                            fmtfunc=fmtfunc,
+                        )),
+                        msg='Output differs for width {}: {!r}'.format(
+                            width,
+                            s,
+                        ),
+                    )
+
+    def test_iter_space_spans_chunks(self):
+        """ npengine.iter_space_spans() should wrap across chunks. """
+        rand = random.Random(26)
+        seps = (' ', ' ', '  ', '\n', '\t ')
+        chunksize = npengine.CHUNK_SIZE
+        try:
+            for _ in range(200):
+                npengine.CHUNK_SIZE = rand.choice((1, 2, 3, 8, 32))
+                s = ''.join(
+                    ''.join(('x' * rand.randint(1, 15), rand.choice(seps)))
+                    for _ in range(rand.randint(0, 40))
+                )
+                if rand.random() < 0.5:
+                    s = ''.join((rand.choice(seps), s))
+                width = rand.randint(1, 12)
+                self.assertListEqual(
+                    list(npengine.iter_space_spans(s, width=width)),
+                    list(core.iter_space_spans(s, width=width)),
+                    msg='Spans differ for chunk {}, width {}: {!r}'.format(
+                        npengine.CHUNK_SIZE,
+                        width,
+                        s,
+                    ),
+                )
+        finally:
+            npengine.CHUNK_SIZE = chunksize
+
+
+class CoreTests(unittest.TestCase):
+
+    def test_format_block(self):
+        """ core.format_block() should match FormatBlock.format(). """
+        s = 'A AA AAA B BB BBB C CC CCC'
+        self.assertEqual(
+            core.format_block(s, width=4, fill=True, prepend='> '),
+            FormatBlock(s).format(width=4, fill=True, prepend='> '),
+            msg='core.format_block() does not match FormatBlock.format().'
+        )
+
+    def test_get_breaks(self):
+        """ core.get_breaks() should hold the offsets of the wrapped lines.
+        """
+        s = 'A  AA\tAAA B \x1b[31mBB\x1b[0m BBB C CC CCC'
+        for kwargs in ({}, {'shrink': True}, {'chars': True}):
+            breaks = core.get_breaks(s, width=7, **kwargs)
+            lines = list(core.iter_block(s, width=7, **kwargs))
+            self.assertEqual(
+                len(breaks),
+                len(lines) * 2,
+                msg='Wrong number of breaks for {}.'.format(kwargs),
+            )
+            for i, line in enumerate(lines):
+                start, end = breaks[i * 2], breaks[i * 2 + 1]
+                self.assertEqual(
+                    strip_codes(' '.join(s[start:end].split())),
+                    strip_codes(' '.join(line.split())),
+                    msg='Break {} does not match the line for {}.'.format(
+                        i,
+                        kwargs,
+                    ),
+                )
+        breaks = core.get_breaks('AAA BBB', width=4, chars=True, lstrip=True)
+        self.assertListEqual(
+            list(breaks),
+            [0, 4, 4, 7],
+            msg='Leading whitespace was not skipped.',
+        )
+        # Line records start in the same place.
+        for s in ('AAA BBB', 'AAA BBB  CCCCC \u00e9\u00e9 D'):
+            breaks = core.get_breaks(s, width=4, chars=True, lstrip=True)
+            records = pipeline.Pipeline.preset_format_block(
+                records=True,
+                width=4,
+                chars=True,
+                lstrip=True,
+            ).iter_lines(s)
+            self.assertListEqual(
+                [pos for record in records for pos in (
+                    record.start, record.end)],
+                list(breaks),
+                msg='Records and breaks differ for: {!r}'.format(s),
+            )
+
+    def test_get_tier(self):
+        """ core.get_tier() should profile text, and every tier should wrap
+            like the generic engines.
+        """
+        tiers = (
+            ('A AA AAA B BB', core.TIER_PLAIN),
+            ('A  AA\tAAA\nB BB', core.TIER_ASCII),
+            ('\xc0 \xc0\xc0  \xc0\xc0\xc0 B BB', core.TIER_TEXT),
+            ('\xc0 \xc0\xc0 \u6f22\u5b57 B BB', core.TIER_WIDE),
+            ('A \x1b[31mAA\x1b[0m AAA B BB', core.TIER_CODES),
+        )
+        for s, tier in tiers:
+            self.assertEqual(
+                core.get_tier(s),
+                tier,
+                msg='Wrong tier for: {!r}'.format(s),
+            )
+            for width in (1, 4, 7):
+                for func in (core.iter_space_spans, core.iter_shrink_spans):
+                    self.assertListEqual(
+                        list(func(s, width=width)),
+                        list(func(s, width=width, tier=core.TIER_CODES)),
+                        msg='{}() differs for the {} tier.'.format(
+                            func.__name__,
+                            tier,
+                        ),
+                    )
+
+    def test_measure(self):
+        """ core.measure() should match the widths of the formatted lines.
+        """
+        s = '\n'.join((
+            'A  AA\tAAA B \x1b[31mBB\x1b[0m BBB C CC CCC',
+            '',
+            ' '.join(['word'] * 20),
+            '  leading and trailing  ',
+        ))
+        for kwargs in (
+                {},
+                {'chars': True, 'lstrip': True},
+                {'fill': True},
+                {'shrink': True, 'paragraphs': True},
+                {'newlines': True, 'prepend': '> ', 'strip_first': True},
+                {'append': ' |', 'max_lines': 3, 'marker': '...'}):
+            widths = [
+                len(strip_codes(line))
+                for line in core.iter_format_block(s, width=9, **kwargs)
+            ]
+            for fmtblock in (FormatBlock(s), None):
+                if fmtblock is None:
+                    lines, maxwidth, measured = core.measure(
+                        s,
+                        width=9,
+                        **kwargs
+                    )
+                else:
+                    # The second call uses the tokens.
+                    fmtblock.measure(width=9, **kwargs)
+                    lines, maxwidth, measured = fmtblock.measure(
+                        width=9,
+                        **kwargs
+                    )
+                self.assertEqual(
+                    (lines, maxwidth, list(measured)),
+                    (len(widths), max(widths), widths),
+                    msg='Wrong measurements for {}.'.format(kwargs),
+                )
+        self.assertEqual(
+            core.measure('')[:2],
+            (0, 0),
+            msg='Empty text should have no lines.',
+        )
+
+    def test_iter_format_stream(self):
+        """ core.iter_format_stream() should format each record separately.
+        """
+        for delimiter in ('\n', '\0'):
+            stream = io.StringIO(delimiter.join((
+                'A AA AAA B BB',
+                '',
+                'C CC CCC',
+                '',
+            )))
+            self.assertListEqual(
+                list(core.iter_format_stream(
+                    stream,
+                    delimiter=delimiter,
+                    continuation='  ',
+                    width=6,
+                    prepend='* ',
+                )),
+                ['* A AA\n  AAA B\n  BB', '', '* C CC\n  CCC'],
+                msg='Records were not formatted separately: {!r}'.format(
+                    delimiter,
+                ),
+            )
+
+    def test_threads(self):
+        """ core functions should give the same output from many threads.
+        """
+        rand = random.Random(31)
+        texts = [
+            ' '.join(
+                '\x1b[31m{}\x1b[0m'.format('x' * rand.randint(1, 8))
+                if rand.random() < 0.2 else 'y' * rand.randint(1, 8)
+                for _ in range(200)
+            )
+            for _ in range(16)
+        ]
+        kwargs = {'width': 30, 'fill': True, 'append': ' |'}
+        expected = [core.format_block(s, **kwargs) for s in texts]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda s: core.format_block(s, **kwargs),
+                texts * 4,
+            ))
+        self.assertListEqual(
+            results,
+            expected * 4,
+            msg='Output differs when formatting from threads.'
+        )
+
+
+class PipelineTests(unittest.TestCase):
+
+    def test_custom_stage(self):
+        """ Pipelines should accept custom stages. """
+        def upper(records):
+            for record in records:
+                record.text = record.text.upper()
+                yield record
+
+        p = pipeline.Pipeline(
+            pipeline.tokenize(),
+            pipeline.break_lines(width=4),
+            upper,
+            pipeline.decorate(prepend='> '),
+            pipeline.number(),
+            pipeline.output(numfmt='{}. '),
+        )
+        self.assertEqual(
+            p.run('a aa aaa'),
+            '1. > A AA\n2. > AAA',
+            msg='Custom stage was not used.'
+        )
+
+    def test_line_records(self):
+        """ Pipeline stages should pass along LineRecords with widths. """
+        s = '\x1b[31mA\x1b[0m AA AAA B BB BBB'
+        p = pipeline.Pipeline(
+            pipeline.tokenize(),
+            pipeline.break_lines(width=6),
+        )
+        records = list(p.iter_lines(s))
+        self.assertTrue(
+            all(isinstance(r, pipeline.LineRecord) for r in records),
+            msg='Stages did not produce LineRecords.'
+        )
+        self.assertListEqual(
+            [r.width for r in records],
+            [4, 5, 6],
+            msg='LineRecord widths are wrong.'
+        )
+        p.stages.append(pipeline.justify(width=6))
+        self.assertListEqual(
+            [r.width for r in p.iter_lines(s)],
+            [6, 6, 6],
+            msg='LineRecord widths are wrong after justify().'
+        )
+
+    def test_preset_format_block(self):
+        """ Preset pipelines should match FormatBlock methods. """
+        s = 'A AA AAA B BB BBB C CC CCC'
+        self.assertEqual(
+            pipeline.Pipeline.preset_format_block(
+                width=4,
+                prepend='> ',
+                strip_first=True,
+            ).run(s),
+            FormatBlock(s).format(width=4, prepend='> ', strip_first=True),
+            msg='Preset pipeline does not match format().'
+        )
+
+    def test_stage_wrapper(self):
+        """ Pipelines should pass their stages through their wrapper. """
+        names = []
+
+        def wrapper(stage):
+            names.append(stage.__qualname__.split('.')[0])
+            return stage
+
+        p = pipeline.Pipeline(
+            pipeline.tokenize(),
+            pipeline.break_lines(width=4),
+            pipeline.output(),
+            stage_wrapper=wrapper,
+        )
+        self.assertEqual(p.run('a aa aaa'), 'a aa\naaa')
+        self.assertListEqual(
+            names,
+            ['tokenize', 'break_lines', 'output'],
+            msg='Stages were not wrapped.',
+        )
+        token = pipeline.current_stage_wrapper.set(wrapper)
+        try:
+            pipeline.Pipeline.preset_format_block(width=4).run('a aa aaa')
+        finally:
+            pipeline.current_stage_wrapper.reset(token)
+        self.assertListEqual(
+            names[3:],
+            ['tokenize', 'break_lines', 'output'],
+            msg='The current stage wrapper was not used.',
+        )
+
+
+class IncrementalTests(unittest.TestCase):
+
+    def feed_all(self, data, chunksize, **kwargs):
+        """ Feed `data` to an IncrementalFormatter in chunks, returning all
+            of the output lines.
+        """
+        formatter = IncrementalFormatter(**kwargs)
+        lines = []
+        for i in range(0, len(data), chunksize):
+            lines.extend(formatter.feed(data[i:i + chunksize]))
+            self.assertLess(
+                formatter.get_buffered(),
+                100,
+                msg='Only the current line should be buffered.',
+            )
+        lines.extend(formatter.flush())
+        return lines
+
+    def test_feed(self):
+        """ IncrementalFormatter should match FormatBlock.format(). """
+        s = '\n'.join((
+            'A  AA\tAAA B \x1b[31mBB\x1b[0m BBB C CC CCC \u00e9\u20ac',
+            '',
+            ' '.join(['word'] * 20),
+            '  ',
+            'overlongword and \x1b[1mmore\x1b[0m text',
+        ))
+        data = s.encode('utf-8')
+        for kwargs in (
+                {},
+                {'chars': True, 'lstrip': True},
+                {'fill': True},
+                {'shrink': True, 'paragraphs': True},
+                {'newlines': True, 'prepend': '> ', 'strip_first': True},
+                {'append': ' |', 'strip_last': True},
+                {'max_lines': 3, 'marker': '...'}):
+            expected = FormatBlock(s).format(width=9, **kwargs).split('\n')
+            # Chunks of 1 and 3 bytes split escape codes, words, and
+            # multi-byte characters.
+            for chunks in (data, s):
+                for chunksize in (1, 3, 4096):
+                    self.assertListEqual(
+                        self.feed_all(chunks, chunksize, width=9, **kwargs),
+                        expected,
+                        msg='Wrong lines for {}, {}-{} chunks.'.format(
+                            kwargs,
+                            chunksize,
+                            type(chunks).__name__,
+                        ),
+                    )
+        formatter = IncrementalFormatter(width=9)
+        self.assertListEqual(
+            formatter.feed('one two three fo'),
+            ['one two'],
+            msg='Only final lines should be returned.',
+        )
+        self.assertListEqual(
+            formatter.flush(),
+            ['three fo'],
+            msg='The last line was not flushed.',
+        )
+
+    def test_feed_uax14_codes(self):
+        """ Words that are only escape codes should break like they do in
+            FormatBlock.format(), with `uax14`.
+        """
+        for s in (
+                'bbx \u00e9 bb \x1b[0m\t',
+                'a-b \x1b[0m\t',
+                'a-b \x1b[31m \x1b[0m\t\x1b[1m\nx'):
+            for width in (3, 8):
+                expected = FormatBlock(s).format(
+                    width=width,
+                    uax14=True,
+                ).split('\n')
+                for chunksize in (1, 3, 4096):
+                    self.assertListEqual(
+                        self.feed_all(s, chunksize, width=width, uax14=True),
+                        expected,
+                        msg='Wrong lines for width {}, {} chunks: {!r}'.format(
+                            width,
+                            chunksize,
+                            s,
+                        ),
+                    )
+        paragraphs = {'width': 4, 'newlines': True, 'paragraphs': True}
+        for s, kwargs in (
+                ('fgcf\n\t\x1b[2m \nfdbh', paragraphs),
+                (
+                    'jibhdaieafgcf\n\t\x1b[1;32m \nighecfdecaafdbh',
+                    dict(paragraphs, overlong='truncate'),
+                ),
+                ('\t\x1b[2m b', {'width': 1, 'newlines': True}),
+                ('a-bbbx \x1b[31m\tbb\tx', {'width': 3, 'overlong': 'split'})):
+            expected = FormatBlock(s).format(uax14=True, **kwargs).split('\n')
+            for chunksize in (1, 3, 4096):
+                self.assertListEqual(
+                    self.feed_all(s, chunksize, uax14=True, **kwargs),
+                    expected,
+                    msg='Wrong lines for {!r}, {} chunks: {!r}'.format(
+                        kwargs,
+                        chunksize,
+                        s,
+                    ),
+                )
+
+
+class LineIndexTests(unittest.TestCase):
+
+    def test_format_window(self):
+        """ LineIndex.format_window() should match formatting everything.
+        """
+        s = '\n'.join((
+            'A AA AAA B BB BBB C CC CCC',
+            '  ',
+            'D DDDDDDDDDD E   EE EEE',
+            '',
+            'F FF FFF G GG GGG',
+        )) * 20
+        for kwargs in (
+                {'prepend': '> ', 'strip_first': True},
+                {'fill': True, 'append': ' <', 'strip_last': True},
+                {'chars': True, 'paragraphs': True},
+                {'chars': True, 'lstrip': True},
+                {'newlines': True, 'shrink': True}):
+            expected = FormatBlock(s).format(width=5, **kwargs).split('\n')
+            index = LineIndex(s, interval=7, width=5, **kwargs)
+            for start, count in ((0, 3), (30, 10), (len(expected) - 2, 5)):
+                self.assertEqual(
+                    index.format_window(start, count),
+                    expected[start:start + count],
+                    msg='Window {}+{} does not match: {!r}'.format(
+                        start,
+                        count,
+                        kwargs,
+                    ),
+                )
+            self.assertEqual(
+                index.build(),
+                len(expected),
+                msg='Wrong line count for index.',
+            )
+        # Lines are justified after `lstrip`.
+        s = ')\x1b[2mc'
+        self.assertEqual(
+            LineIndex(
+                s,
+                interval=1,
+                width=5,
+                fill=True,
+                lstrip=True,
+            ).format_window(0, 1),
+            [FormatBlock(s).format(width=5, fill=True, lstrip=True)],
+            msg='Window does not match with `fill` and `lstrip`.',
+        )
+
+    def test_format_window_split(self):
+        """ LineIndex.format_window() should resume before split words. """
+        self.assertListEqual(
+            LineIndex(
+                'xxxx a',
+                interval=1,
+                width=3,
+                overlong='split',
+            ).format_window(1, 3),
+            ['x', 'a'],
+        )
+        s = ' '.join(['A AAAAAAAAAA BB'] * 30)
+        for kwargs in ({}, {'fill': True}, {'newlines': True}):
+            expected = FormatBlock(s).format(
+                width=4,
+                overlong='split',
+                **kwargs
+            ).split('\n')
+            index = LineIndex(
+                s,
+                interval=3,
+                width=4,
+                overlong='split',
+                **kwargs
+            )
+            for start in range(0, len(expected), 5):
+                self.assertEqual(
+                    index.format_window(start, 4),
+                    expected[start:start + 4],
+                    msg='Window {}+4 does not match: {!r}'.format(
+                        start,
+                        kwargs,
+                    ),
+                )
+        index = LineIndex(s, interval=3, width=4)
+        index.build()
+        index.checkpoints[1] = (1, 2, 0)
+        with self.assertRaises(ValueError):
+            index.format_window(3, 2)
+
+    def test_format_window_uax14(self):
+        """ LineIndex.format_window() should resume at UAX #14 breaks. """
+        self.assertListEqual(
+            LineIndex(
+                'bgbibecigcgdi\n/',
+                interval=1,
+                width=1,
+                uax14=True,
+            ).format_window(0, 1),
+            ['bgbibecigcgdi /'],
+        )
+        s = ' '.join((
+            'See https://example.com/some/long/path?query=value',
+            '\t\x1b[2m hgfgh/bf-db- (g/g)\n\x1b[1m\t\ncegigef-\tec)g/',
+        )) * 20
+        for kwargs in (
+                {},
+                {'fill': True},
+                {'newlines': True, 'overlong': 'split'},
+                {'paragraphs': True, 'overlong': 'truncate'}):
+            expected = FormatBlock(s).format(
+                width=6,
+                uax14=True,
+                **kwargs
+            ).split('\n')
+            index = LineIndex(s, interval=3, width=6, uax14=True, **kwargs)
+            for start in range(0, len(expected), 4):
+                self.assertEqual(
+                    index.format_window(start, 3),
+                    expected[start:start + 3],
+                    msg='Window {}+3 does not match: {!r}'.format(
+                        start,
+                        kwargs,
+                    ),
+                )
+
+    def test_save_load(self):
+        """ LineIndex.save() and load() should keep the checkpoints. """
+        s = 'A AA AAA B BB BBB C CC CCC ' * 100
+        index = LineIndex(s, interval=10, width=4, prepend='> ')
+        index.build(count=50)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'test.idx')
+            index.save(filename)
+            loaded = LineIndex.load(filename, s)
+            with self.assertRaises(ValueError):
+                LineIndex.load(filename, s + 'changed')
+        self.assertEqual(
+            (loaded.checkpoints, loaded.lines, loaded.complete),
+            (index.checkpoints, 50, False),
+            msg='Loaded index does not match the saved one.',
+        )
+        self.assertEqual(
+            loaded.format_window(95, 5),
+            index.format_window(95, 5),
+            msg='Loaded index formats a different window.',
+        )
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'No Unix sockets.')
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socketpath = os.path.join(self.tmpdir.name, 'fmtblock.sock')
+        self.server = FormatServer(self.socketpath)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            daemon=True,
+        )
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmpdir.cleanup()
+
+    def test_format_text(self):
+        """ client.format_text() should match FormatBlock.format(). """
+        s = 'A AA AAA B BB BBB C CC CCC'
+        for _ in range(2):
+            self.assertEqual(
+                client.format_text(
+                    s,
+                    socketpath=self.socketpath,
+                    width=4,
+                    prepend='> ',
+                ),
+                FormatBlock(s).format(width=4, prepend='> '),
+                msg='Server output does not match FormatBlock.format().',
+            )
+        self.assertEqual(
+            self.server.cache.hits,
+            1,
+            msg='Second request should have been cached.',
+        )
+        with self.assertRaises(client.ServerError):
+            client.format_text(s, socketpath=self.socketpath, badarg=True)
+
+    def test_run_argv(self):
+        """ client.run_argv() should print what a local run prints. """
+        from fmtblock import __main__ as cli
+        for argv in (['-w', '4', 'A AA AAA'], ['-r', ' '], [' ']):
+            expected = io.StringIO()
+            with redirect_stdout(expected):
+                cli.main(argv=argv)
+            output = io.StringIO()
+            with redirect_stdout(output):
+                status = client.run_argv(argv, socketpath=self.socketpath)
+            self.assertEqual(status, 0)
+            self.assertEqual(
+                output.getvalue(),
+                expected.getvalue(),
+                msg='Server output differs for: {!r}'.format(argv),
+            )
+
+    def test_is_private(self):
+        """ The client should only use sockets that no one else can replace.
+        """
+        from fmtblock.server import is_private
+        self.assertTrue(is_private(self.socketpath))
+        shareddir = os.path.join(self.tmpdir.name, 'shared')
+        os.mkdir(shareddir)
+        os.chmod(shareddir, 0o777)
+        socketpath = os.path.join(shareddir, 'fmtblock.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(socketpath)
+            sock.listen(1)
+            self.assertFalse(
+                is_private(socketpath),
+                msg='Socket in a world-writable directory is private.',
+            )
+            self.assertIsNone(
+                client.run_argv(['test'], socketpath=socketpath),
+                msg='Client used a socket that is not private.',
+            )
+            with self.assertRaises(OSError):
+                client.format_text('test', socketpath=socketpath)
+
+
+class CacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cachedir = os.path.join(self.tmpdir.name, 'cache')
+        self.calls = 0
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_cached(self, argv):
+        """ Run cache.run_argv() with a fake command, returning the output.
+        """
+        def runfunc(argv):
+            self.calls += 1
+            print(FormatBlock(' '.join(argv[-1:])).format(width=4))
+            return 0
+
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            status = cache.run_argv(argv, runfunc)
+        self.assertEqual(status, 0, msg='Cached command failed.')
+        return buf.getvalue()
+
+    def test_run_argv(self):
+        """ cache.run_argv() should only run the command on a miss. """
+        argv = ['--cache', self.cachedir, '-w', '4', 'A AA AAA']
+        expected = self.run_cached(argv)
+        for _ in range(2):
+            self.assertEqual(
+                self.run_cached(argv),
+                expected,
+                msg='Cached output does not match.',
+            )
+        self.assertEqual(self.calls, 1, msg='Command should be cached.')
+        self.run_cached(['--cache', self.cachedir, '-w', '5', 'A AA AAA'])
+        self.assertEqual(self.calls, 2, msg='Options should change the key.')
+        self.assertIsNone(
+            cache.run_argv(['--cache', self.cachedir, '-m', 'x'], print),
+            msg='Uncacheable arguments should not be run.',
+        )
+        # Only the most recently used entry fits.
+        cache.prune(self.cachedir, maxsize=len(expected))
+        self.run_cached(argv)
+        self.assertEqual(self.calls, 3, msg='Entry should have been pruned.')
+
+    def test_run_argv_exit(self):
+        """ cache.run_argv() should print errors when the command exits. """
+        from fmtblock import __main__ as cli
+        argv = ['--cache', self.cachedir, '-w', 'abc', 'hello']
+        errbuf = io.StringIO()
+        with redirect_stderr(errbuf), self.assertRaises(SystemExit):
+            cache.run_argv(argv, lambda argv: cli.main(argv=argv))
+        self.assertIn('Invalid integer: abc', errbuf.getvalue())
+
+    def test_split_argv(self):
+        """ cache.split_argv() should know every option that takes a value.
+        """
+        from fmtblock import __main__ as cli
+        for line in cli.USAGESTR.splitlines():
+            line = line.strip()
+            if not line.startswith('-'):
+                continue
+            for opt in line.partition(' : ')[0].split(','):
+                name, _, val = opt.strip().partition(' ')
+                if name.startswith('--'):
+                    opts = cache.LONG_OPTS
+                else:
+                    opts = cache.SHORT_OPTS
+                    name = name[1:]
+                if name in opts:
+                    self.assertEqual(
+                        opts[name],
+                        bool(val),
+                        msg='Wrong value flag for: {}'.format(name),
+                    )
+        self.assertEqual(
+            cache.split_argv(['-fw40', 'a', '--cache=x', '-p', '> ', 'b']),
+            (['-f', '-w', '40', '-p', '> '], ['a', 'b'], 'x'),
+            msg='Arguments were not split correctly.',
+        )
+        for argv in (['-h'], ['-fm', 'a'], ['--wid', '40'], ['-w']):
+            self.assertIsNone(
+                cache.split_argv(argv),
+                msg='Arguments should not be cacheable: {!r}'.format(argv),
+            )
+
+
+class CompressedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.text = '\n'.join(
+            'Record {} has a few words in it.'.format(i) for i in range(500)
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_files(self):
+        """ Write `text` to a plain file and a compressed file for each
+            format, returning a dict of {format: filename}.
+        """
+        import bz2
+        import gzip
+        import lzma
+        data = self.text.encode('utf-8')
+        filenames = {}
+        for fmt, func in (
+                (None, bytes),
+                ('gzip', gzip.compress),
+                ('bzip2', bz2.compress),
+                ('xz', lzma.compress)):
+            filename = os.path.join(self.tmpdir.name, str(fmt))
+            with open(filename, 'wb') as f:
+                f.write(func(data))
+            filenames[fmt] = filename
+        return filenames
+
+    def test_open_file(self):
+        """ compressed.open_file() should decompress by magic bytes. """
+        for fmt, filename in self.write_files().items():
+            with open(filename, 'rb') as f:
+                self.assertEqual(
+                    compressed.get_format(f.read(compressed.MAGIC_SIZE)),
+                    fmt,
+                    msg='Wrong format for: {}'.format(fmt),
+                )
+            with compressed.open_file(filename, encoding='utf-8') as f:
+                self.assertEqual(
+                    f.read(),
+                    self.text,
+                    msg='Wrong text for: {}'.format(fmt),
+                )
+        # Pipes can't be rewound, so they are peeked at.
+        readfd, writefd = os.pipe()
+        with open(self.write_files()['gzip'], 'rb') as f:
+            os.write(writefd, f.read())
+        os.close(writefd)
+        with open(readfd, 'rb') as f:
+            self.assertEqual(
+                compressed.open_binary(f).read().decode('utf-8'),
+                self.text,
+                msg='Compressed pipe was not decompressed.',
+            )
+        # Truncated input is a read error, like any other.
+        filename = self.write_files()['xz']
+        with open(filename, 'rb') as f:
+            data = f.read()
+        with open(filename, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with self.assertRaises(compressed.DecompressError):
+            with compressed.open_file(filename) as f:
+                f.read()
+
+    def test_records(self):
+        """ --records should format compressed files like plain ones. """
+        from fmtblock import __main__ as cli
+        filenames = self.write_files()
+        outputs = []
+        for fmt in (None, 'gzip', 'xz'):
+            buf = io.StringIO()
+            with redirect_stdout(buf):
+                status = cli.main(
+                    ['--records', '-w', '12', filenames[fmt]]
+                )
+            self.assertEqual(status, 0, msg='Failed for: {}'.format(fmt))
+            outputs.append(buf.getvalue())
+        self.assertTrue(outputs[0], msg='No output for plain text.')
+        self.assertEqual(
+            outputs[1:],
+            outputs[:1] * 2,
+            msg='Compressed records do not match the plain records.',
+        )
+
+
+class WidthsTests(unittest.TestCase):
+
+    def test_get_width(self):
+        """ widths.get_width() should count display columns. """
+        for text, expected in (
+                ('', 0),
+                ('test', 4),
+                ('caf\xe9', 4),
+                # Wide (CJK) characters.
+                ('\u6f22\u5b57', 4),
+                # Combining acute accent.
+                ('cafe\u0301', 4),
+                # Emoji, with a skin tone modifier.
+                ('\U0001f44d\U0001f3fd', 2),
+                # A family emoji, joined with zero width joiners.
+                ('\U0001f468\u200d\U0001f469\u200d\U0001f467', 2)):
+            self.assertEqual(
+                widths.get_width(text),
+                expected,
+                msg='Wrong width for: {!r}'.format(text),
+            )
+        self.assertEqual(
+            pipeline.get_width('\x1b[31m\u6f22\x1b[0m'),
+            2,
+            msg='Escape codes were counted.',
+        )
+        self.assertEqual(
+            widths.char_width('\u6f22'),
+            2,
+            msg='Wrong char_width() for a wide character.',
+        )
+        if widths.UNICODE_VERSION == unicodedata.unidata_version:
+            self.assertEqual(
+                widths.build_ranges(),
+                (list(widths.ZERO_RANGES), list(widths.WIDE_RANGES)),
+                msg='The width table does not match unicodedata.',
+            )
+
+    def test_wrap(self):
+        """ Wrapping should use display widths, for every engine. """
+        cjk = ' '.join(['\u6f22\u5b57', '\u304b\u306a'] * 6)
+        accented = ' '.join(['cafe\u0301'] * 12)
+        for text in (cjk, accented, '\x1b[31m{}\x1b[0m'.format(cjk)):
+            for kwargs in (
+                    {}, {'shrink': True}, {'chars': True}, {'fill': True}):
+                lines = FormatBlock(text).iter_format_block(
+                    width=9,
+                    **kwargs
+                )
+                linewidths = [
+                    widths.get_width(strip_codes(line)) for line in lines
+                ]
+                self.assertLessEqual(
+                    max(linewidths),
+                    9,
+                    msg='Too wide for {}: {!r}'.format(kwargs, text),
+                )
+                if kwargs.get('fill'):
+                    self.assertEqual(
+                        set(linewidths[:-1]),
+                        {9},
+                        msg='Not filled: {!r}'.format(text),
+                    )
+        self.assertEqual(
+            core.format_block(cjk, width=9).split('\n')[0],
+            '\u6f22\u5b57 \u304b\u306a',
+            msg='Wide characters were counted as one column.',
+        )
+        self.assertEqual(
+            core.format_block('\u6f22' * 5, width=3, chars=True),
+            '\n'.join(['\u6f22'] * 5),
+            msg='A wide character was split.',
+        )
+        self.assertEqual(
+            core.format_block(accented, width=9, chars=True).split('\n')[0],
+            'cafe\u0301 cafe\u0301',
+            msg='Combining marks were counted, or split from their letter.',
+        )
+        self.assertEqual(
+            core.measure(cjk, width=9)[:2],
+            (len(core.format_block(cjk, width=9).split('\n')), 9),
+            msg='measure() does not use display widths.',
+        )
+
+
+class LineBreakTests(unittest.TestCase):
+
+    def test_iter_breaks(self):
+        """ linebreak.iter_breaks() should find UAX #14 opportunities. """
+        for text, expected in (
+                ('', []),
+                ('a test', ['a ', 'test']),
+                ('well-known', ['well-', 'known']),
+                ('http://a.com/b?c=d', ['http://', 'a.com/', 'b?', 'c=d']),
+                # Numbers, prefixes, and postfixes are kept together.
+                ('$12.50 (100%)', ['$12.50 ', '(100%)']),
+                # CJK, keeping closing punctuation and small kana.
+                ('\u65e5\u672c\u3002\u300c\u304d\u3083\u300d', [
+                    '\u65e5', '\u672c\u3002',
+                    '\u300c\u304d\u3083\u300d',
+                ]),
+                # Flags are pairs of regional indicators.
+                ('\U0001f1ef\U0001f1f5\U0001f1fa\U0001f1f8', [
+                    '\U0001f1ef\U0001f1f5', '\U0001f1fa\U0001f1f8',
+                ]),
+                # Combining marks stay with their letter.
+                ('\u6f22\u0301\u5b57', ['\u6f22\u0301', '\u5b57'])):
+            offsets = [0] + list(linebreak.iter_breaks(text)) + [len(text)]
+            pieces = [
+                text[start:end] for start, end in zip(offsets, offsets[1:])
+            ]
+            self.assertEqual(
+                [piece for piece in pieces if piece],
+                expected,
+                msg='Wrong breaks for: {!r}'.format(text),
+            )
+        self.assertEqual(
+            linebreak.get_class('\u3002'),
+            'CL',
+            msg='Wrong class from the range table.',
+        )
+
+    def test_wrap(self):
+        """ Wrapping with `uax14` should break inside of words. """
+        url = 'See https://example.com/some/long/path?query=value'
+        self.assertEqual(
+            core.format_block(url, width=20, uax14=True).split('\n'),
+            ['See https://', 'example.com/some/', 'long/path?', 'query=value'],
+            msg='Long words were not broken.',
+        )
+        cjk = '\u6f22\u5b57\u304b\u306a\u3002' * 4
+        codes = '\x1b[1m\u6f22\u5b57\x1b[0m' * 6
+        for text in (url, cjk, codes, '\x1b[31m{}\x1b[0m'.format(url)):
+            for kwargs in ({}, {'fill': True}, {'lstrip': True}):
+                fmt = FormatBlock(text)
+                lines = list(fmt.iter_format_block(
+                    width=9,
+                    uax14=True,
+                    **kwargs
+                ))
+                linewidths = [
+                    widths.get_width(strip_codes(line)) for line in lines
+                ]
+                self.assertLessEqual(
+                    max(linewidths),
+                    max(9, len('example.com/')),
+                    msg='Too wide for {}: {!r}'.format(kwargs, text),
+                )
+                self.assertFalse(
+                    any('\x1b' in strip_codes(line) for line in lines),
+                    msg='An escape code was broken: {!r}'.format(lines),
+                )
+                self.assertEqual(
+                    fmt.measure(width=9, uax14=True, **kwargs)[0],
+                    len(lines),
+                    msg='measure() does not match for: {!r}'.format(text),
+                )
+        self.assertEqual(
+            core.format_block(codes[:20], width=4, uax14=True).split('\n'),
+            ['\x1b[1m\u6f22\u5b57', '\x1b[0m\x1b[1m\u6f22\u5b57\x1b[0m'],
+            msg='Escape codes were broken, or changed the breaks.',
+        )
+        self.assertEqual(
+            core.format_block(url, width=20, uax14=True, chars=True),
+            core.format_block(url, width=20, chars=True),
+            msg='`uax14` was not ignored with `chars`.',
+        )
+        self.assertEqual(
+            core.format_block('a test', width=20, uax14=True),
+            'a test',
+            msg='Short text was changed.',
+        )
+
+    def test_wrap_max_lines(self):
+        """ `max_lines` should stop wrapping at UAX #14 breaks, and not
+            on any whitespace.
+        """
+        for text in ('a' * 25 + ' /c', ('aaaaaaaaa /c ' * 20).strip()):
+            for kwargs in ({}, {'overlong': 'split'}):
+                fmt = FormatBlock(text)
+                lines = fmt.format(
+                    width=3,
+                    uax14=True,
+                    newlines=True,
+                    **kwargs
+                ).split('\n')
+                for maxlines in (1, 2, 5):
+                    self.assertEqual(
+                        fmt.format(
+                            width=3,
+                            uax14=True,
+                            newlines=True,
+                            max_lines=maxlines,
+                            **kwargs
+                        ).split('\n'),
+                        lines[:maxlines],
+                        msg='Failed to stop at {} lines: {!r}'.format(
+                            maxlines,
+                            kwargs,
+                        ),
+                    )
+
+
+class OverlongTests(unittest.TestCase):
+
+    def test_split(self):
+        """ overlong='split' should split long words into lines. """
+        text = 'aa {} bb cc dd'.format('x' * 25)
+        expected = ['aa', 'x' * 10, 'x' * 10, 'x' * 5, 'bb cc dd']
+        for kwargs in ({}, {'shrink': True}, {'uax14': True}):
+            fmt = FormatBlock(text)
+            self.assertEqual(
+                fmt.format(width=10, overlong='split', **kwargs).split('\n'),
+                expected,
+                msg='Not split for: {}'.format(kwargs),
+            )
+            self.assertEqual(
+                list(fmt.measure(width=10, overlong='split', **kwargs)[2]),
+                [len(line) for line in expected],
+                msg='measure() does not match for: {}'.format(kwargs),
+            )
+            breaks = fmt.get_breaks(width=10, overlong='split', **kwargs)
+            self.assertEqual(
+                [text[i:j] for i, j in zip(breaks[::2], breaks[1::2])],
+                expected,
+                msg='get_breaks() does not match for: {}'.format(kwargs),
+            )
+        self.assertEqual(
+            core.format_block('\u6f22' * 5, width=5, overlong='split'),
+            '\u6f22\u6f22\n\u6f22\u6f22\n\u6f22',
+            msg='A wide character was split.',
+        )
+        self.assertEqual(
+            core.format_block(
+                '\x1b[31m{}\x1b[0m'.format('x' * 20),
+                width=10,
+                overlong='split',
+            ),
+            '\x1b[31m{0}\n{0}\x1b[0m'.format('x' * 10),
+            msg='Escape codes were counted, or not kept.',
+        )
+        formatter = IncrementalFormatter(width=10, overlong='split')
+        lines = []
+        for i in range(0, len(text), 3):
+            lines.extend(formatter.feed(text[i:i + 3]))
+        lines.extend(formatter.flush())
+        self.assertEqual(
+            lines,
+            expected,
+            msg='IncrementalFormatter does not match.',
+        )
+
+    def test_truncate(self):
+        """ overlong='truncate' should cut long words off with a marker. """
+        text = 'aa {} bb'.format('x' * 25)
+        for kwargs in ({}, {'shrink': True}, {'uax14': True}):
+            self.assertEqual(
+                core.format_block(
+                    text,
+                    width=10,
+                    overlong='truncate',
+                    **kwargs
+                ).split('\n'),
+                ['aa', 'x' * 7 + core.TRUNCATED, 'bb'],
+                msg='Not truncated for: {}'.format(kwargs),
+            )
+        self.assertEqual(
+            core.format_block(
+                '\x1b[31m{}\x1b[0m'.format('x' * 20),
+                width=10,
+                overlong='truncate',
+            ),
+            '\x1b[31m{}\x1b[0m{}'.format('x' * 7, core.TRUNCATED),
+            msg='Escape codes that were cut off were not kept.',
+        )
+        self.assertEqual(
+            core.measure(text, width=10, overlong='truncate')[:2],
+            (3, 10),
+            msg='measure() does not count the marker.',
+        )
+        with self.assertRaises(ValueError):
+            core.format_block(text, overlong='wrap')
+
+
+class FollowTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'app.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def wait_lines(self, lines, count, timeout=5):
+        """ Wait until `lines` has `count` lines, or fail. """
+        deadline = time.monotonic() + timeout
+        while len(lines) < count:
+            if time.monotonic() > deadline:
+                self.fail('Timed out waiting for lines: {!r}'.format(lines))
+            time.sleep(0.001)
+
+    def write(self, text, mode='a'):
+        """ Write text to the followed file. """
+        with open(self.filename, mode) as f:
+            f.write(text)
+
+    def test_iter_follow(self):
+        """ iter_follow() should format text as it's appended. """
+        for inotify in (True, False):
+            self.write('one two three\nfour', mode='w')
+            stop = threading.Event()
+            lines = []
+            thread = threading.Thread(
+                target=lambda: lines.extend(follow.iter_follow(
+                    self.filename,
+                    interval=0.01,
+                    stop=stop.is_set,
+                    inotify=inotify,
+                    width=7,
+                    newlines=True,
+                )),
+                daemon=True,
+            )
+            thread.start()
+            self.wait_lines(lines, 2)
+            self.write(' fi')
+            self.write('ve \x1b[31msix\x1b[0m\n')
+            self.wait_lines(lines, 5)
+            # Truncated files are formatted again from the start.
+            self.write('seven', mode='w')
+            time.sleep(0.1)
+            stop.set()
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive(), msg='Did not stop.')
+            self.assertListEqual(
+                lines,
+                [
+                    'one two', 'three', 'four', 'five',
+                    '\x1b[31msix\x1b[0m', 'seven',
+                ],
+                msg='Wrong lines with inotify={}.'.format(inotify),
+            )
+
+
+class TailTests(unittest.TestCase):
+
+    def test_tail_lines(self):
+        """ tail_lines() should match the end of FormatBlock.format(). """
+        s = '\n'.join((
+            '',
+            'A  AA\tAAA B \x1b[31mBB\x1b[0m BBB C CC CCC \u00e9\u20ac',
+            '',
+            '   ',
+            ' '.join(['word'] * 20),
+            'overlongword and \x1b[1mmore\x1b[0m text',
+            '',
+            '',
+        ))
+        data = s.encode('utf-8')
+        for kwargs in (
+                {},
+                {'chars': True, 'lstrip': True},
+                {'fill': True},
+                {'shrink': True},
+                {'prepend': '> ', 'strip_first': True},
+                {'append': ' |', 'strip_last': True},
+                {'overlong': 'split'}):
+            expected = FormatBlock(s).format(
+                width=9,
+                newlines=True,
+                **kwargs
+            ).split('\n')
+            for count in (1, 4, 100):
+                for source in (data, io.BytesIO(data)):
+                    self.assertListEqual(
+                        tail.tail_lines(source, count, width=9, **kwargs),
+                        expected[-count:],
+                        msg='Wrong lines for {}, count={}, {}.'.format(
+                            kwargs,
+                            count,
+                            type(source).__name__,
+                        ),
+                    )
+        self.assertListEqual(tail.tail_lines(data, 0), [])
+
+    def test_tail_lines_long(self):
+        """ tail_lines() should only read the end of the text. """
+        reads = []
+
+        def read(start, stop):
+            reads.append(stop - start)
+            return data[start:stop]
+
+        data = ''.join(
+            'line {} \x1b[31mhas\x1b[0m some words\n'.format(i)
+            for i in range(100000)
+        ).encode('utf-8')
+        self.assertEqual(
+            tail.find_lines_start(read, len(data), 2),
+            data.rindex(b'line 99998'),
+            msg='Wrong start for the last lines.',
+        )
+        self.assertLess(sum(reads), 100000, msg='Read too much.')
+        self.assertListEqual(
+            tail.tail_lines(data, 3, width=12),
+            ['line 99999', '\x1b[31mhas\x1b[0m some', 'words'],
+        )
+        # A very long last line is formatted from its start.
+        data += b'word ' * 10000
+        self.assertListEqual(
+            tail.tail_lines(data, 2, width=9),
+            ['word word'] * 2,
+        )
+
+    def test_tail_lines_blank(self):
+        """ Blank lines before the last lines should only be read once. """
+        reads = []
+
+        def read(start, stop):
+            reads.append(stop - start)
+            return data[start:stop]
+
+        data = b'first line\n' + (b'\n  \n' * 50000) + b'last\n'
+        self.assertTrue(
+            tail.has_lines(read, data.rindex(b'last'), width=9),
+            msg='The first line was not found.',
+        )
+        self.assertEqual(tail.find_lines_start(read, len(data), 2), 0)
+        self.assertLess(sum(reads), len(data) * 3, msg='Read too much.')
+        kwargs = {'prepend': '> ', 'strip_first': True}
+        self.assertListEqual(
+            tail.tail_lines(data, 2, width=9, **kwargs),
+            FormatBlock(data.decode('utf-8')).format(
+                width=9,
+                newlines=True,
+                **kwargs
+            ).split('\n')[-2:],
+        )
+
+
+class ParallelTests(unittest.TestCase):
+
+    def test_iter_space_block(self):
+        """ parallel.iter_space_block() should match iter_space_block(). """
+        rand = random.Random(0)
+        words = [
+            'a', 'bb', 'ccc', '\x1b[31mred\x1b[0m', '\u00e9t\u00e9',
+            '\u4e16\u754c', 'x' * 25, '  ', '\t',
+        ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for _ in range(200):
+                text = ' '.join(
+                    rand.choice(words)
+                    for _ in range(rand.randint(0, 200))
+                )
+                if rand.random() < 0.25:
+                    text = ' {} '.format(text)
+                width = rand.randint(1, 30)
+                jobs = rand.randint(1, 12)
+                self.assertListEqual(
+                    list(parallel.iter_space_block(
+                        text,
+                        width=width,
+                        jobs=jobs,
+                        executor=executor,
+                    )),
+                    list(core.iter_space_block(text, width=width)),
+                    msg='Wrong lines for width={}, jobs={}: {!r}'.format(
+                        width,
+                        jobs,
+                        text,
+                    ),
+                )
+        text = ' '.join(['word'] * 5000)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertListEqual(
+                list(parallel.iter_space_lines(
+                    text,
+                    width=13,
+                    executor=executor,
+                )),
+                list(core.iter_space_lines(text, width=13)),
+                msg='Worker processes gave different lines.',
+            )
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def test_profiler(self):
+        """ Profiler should report functions, stages, and call stacks. """
+        text = ' '.join(
+            ['some \x1b[31mcolored\x1b[0m words'] * 2000
+        )
+        expected = FormatBlock(text).format(width=40, fill=True)
+        thread = threading.Thread(
+            target=FormatBlock(text).format,
+            kwargs={'width': 20},
+        )
+        with Profiler(interval=0.0001) as profiler:
+            output = FormatBlock(text).format(width=40, fill=True)
+            # Pipelines in other threads are not profiled.
+            thread.start()
+            thread.join()
+        self.assertEqual(output, expected, msg='Profiling changed output.')
+        self.assertIsNone(
+            pipeline.current_stage_wrapper.get(),
+            msg='Pipeline stages are still wrapped.',
+        )
+        self.assertListEqual(
+            list(profiler.stages),
+            ['tokenize', 'break_lines', 'justify', 'output'],
+        )
+        self.assertEqual(
+            profiler.stages['output'].calls,
+            len(expected.split('\n')),
+            msg='Wrong number of output items.',
+        )
+        self.assertGreater(profiler.peak, 0, msg='No memory was traced.')
+        names = [info[0] for info in profiler.get_functions()]
+        self.assertTrue(
+            any('find_word_end' in name for name in names),
+            msg='Missing a hot function: {}'.format(names[:10]),
+        )
+        self.assertFalse(
+            any('profiler.py' in name for name in names),
+            msg='The profiler was profiled.',
+        )
+        for line in profiler.iter_stacks():
+            stack, _, count = line.rpartition(' ')
+            self.assertTrue(stack and count.isdigit(), msg=repr(line))
+            self.assertNotIn('profiler.py', stack)
+
+    def test_profile_cli(self):
+        """ --profile should print a report, and write call stacks. """
+        from fmtblock import __main__ as cli
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stacksfile = os.path.join(tmpdir, 'fmtblock.stacks')
+            out = io.StringIO()
+            err = io.StringIO()
+            with redirect_stdout(out), redirect_stderr(err):
+                status = cli.main([
+                    'This is a test okay.', '-w', '5', '--profile',
+                    '--stacks', stacksfile,
+                ])
+            self.assertEqual(status, 0)
+            self.assertTrue(os.path.exists(stacksfile))
+        self.assertEqual(out.getvalue(), 'This\nis a\ntest\nokay.\n')
+        self.assertIn('Pipeline stages:', err.getvalue())
+
 
 if __name__ == '__main__':
     sys.exit(unittest.main(argv=sys.argv))